@@ -1,7 +1,8 @@
-from biosim_server.common.storage.file_service import FileService, ListingItem
-from biosim_server.common.storage.file_service_gcs import FileServiceGCS
-from biosim_server.common.storage.gcs_aio import get_listing_of_gcs_path, download_gcs_file, upload_file_to_gcs, \
-    get_gcs_modified_date, get_gcs_file_contents, upload_bytes_to_gcs, create_token, close_token
+from common.storage.file_service import FileService, ListingItem
+from common.storage.file_service_gcs import FileServiceGCS
+from common.storage.gcs_aio import get_listing_of_gcs_path, download_gcs_file, upload_file_to_gcs, \
+    get_gcs_modified_date, get_gcs_metadata, get_gcs_file_contents, upload_bytes_to_gcs, create_token, close_token, \
+    create_client, stream_gcs_file, upload_stream_to_gcs
 
 __all__ = [
     "FileService",
@@ -11,8 +12,12 @@ __all__ = [
     "download_gcs_file",
     "upload_file_to_gcs",
     "get_gcs_modified_date",
+    "get_gcs_metadata",
     "get_gcs_file_contents",
     "upload_bytes_to_gcs",
     "create_token",
     "close_token",
-]
\ No newline at end of file
+    "create_client",
+    "stream_gcs_file",
+    "upload_stream_to_gcs",
+]
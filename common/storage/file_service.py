@@ -1,12 +1,9 @@
 from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Optional
 
 from pydantic import BaseModel
-from temporalio import workflow
-
-with workflow.unsafe.imports_passed_through():
-    from datetime import datetime
-from pathlib import Path
-from typing import Optional
 
 
 class ListingItem(BaseModel):
@@ -14,6 +11,7 @@ class ListingItem(BaseModel):
     LastModified: datetime
     ETag: str
     Size: int
+    md5Hash: Optional[str] = None
 
 
 class FileService(ABC):
@@ -30,10 +28,19 @@ class FileService(ABC):
     async def upload_bytes(self, file_contents: bytes, gcs_path: str) -> str:
         pass
 
+    @abstractmethod
+    async def upload_stream(self, chunks: AsyncIterator[bytes], gcs_path: str) -> str:
+        """Upload the concatenation of `chunks` without holding all of it in memory."""
+        pass
+
     @abstractmethod
     async def get_modified_date(self, gcs_path: str) -> datetime:
         pass
 
+    @abstractmethod
+    async def get_metadata(self, gcs_path: str) -> ListingItem:
+        pass
+
     @abstractmethod
     async def get_listing(self, gcs_path: str) -> list[ListingItem]:
         pass
@@ -42,6 +49,12 @@ class FileService(ABC):
     async def get_file_contents(self, gcs_path: str) -> bytes | None:
         pass
 
+    @abstractmethod
+    def stream_file(self, gcs_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                    chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        """Yield the contents of `gcs_path` (or of its bytes `start` to `end`, inclusive) in chunks of `chunk_size`."""
+        pass
+
     @abstractmethod
     async def close(self) -> None:
-        pass
\ No newline at end of file
+        pass
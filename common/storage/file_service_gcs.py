@@ -1,21 +1,18 @@
 import logging
 import uuid
-
-from temporalio import workflow
-
-from biosim_server.common.storage.gcs_aio import create_token, close_token, download_gcs_file, upload_file_to_gcs, \
-    upload_bytes_to_gcs, get_gcs_modified_date, get_listing_of_gcs_path, get_gcs_file_contents
-from biosim_server.config import get_local_cache_dir
-
-with workflow.unsafe.imports_passed_through():
-    from datetime import datetime
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
-from gcloud.aio.auth import Token
+from tempfile import mkdtemp
+from typing import AsyncIterator, Optional
 
+from gcloud.aio.auth import Token
 from typing_extensions import override
 
-from biosim_server.common.storage.file_service import FileService, ListingItem
+from common.storage.file_service import FileService, ListingItem
+from common.storage.gcs_aio import create_token, close_token, create_client, download_gcs_file, upload_file_to_gcs, \
+    upload_bytes_to_gcs, get_gcs_modified_date, get_gcs_metadata, get_listing_of_gcs_path, get_gcs_file_contents, \
+    stream_gcs_file, upload_stream_to_gcs, _StorageWithListPrefix
+from shared.environment import DEFAULT_BUCKET_NAME
 
 
 logger = logging.getLogger(__name__)
@@ -23,43 +20,71 @@ logger.setLevel(logging.INFO)
 
 class FileServiceGCS(FileService):
     token: Token
+    client: _StorageWithListPrefix
 
-    def __init__(self) -> None:
+    def __init__(self, bucket_name: str = DEFAULT_BUCKET_NAME) -> None:
         self.token = create_token()
+        self.bucket_name = bucket_name
+        # a single client, and thus a single pooled aiohttp session, is shared by every call on this service
+        self.client = create_client(self.token)
 
     @override
     async def download_file(self, gcs_path: str, file_path: Optional[Path]=None) -> tuple[str, str]:
         logger.info(f"Downloading {gcs_path} to {file_path}")
         if file_path is None:
-            file_path = get_local_cache_dir() / ("temp_file_"+uuid.uuid4().hex)
-        full_gcs_path = await download_gcs_file(gcs_path=gcs_path, file_path=file_path, token=self.token)
+            file_path = Path(mkdtemp()) / ("temp_file_"+uuid.uuid4().hex)
+        full_gcs_path = await download_gcs_file(gcs_path=gcs_path, file_path=file_path, token=self.token,
+                                                bucket=self.bucket_name, client=self.client)
         return full_gcs_path, str(file_path)
 
     @override
     async def upload_file(self, file_path: Path, gcs_path: str) -> str:
         logger.info(f"Uploading {file_path} to {gcs_path}")
-        return await upload_file_to_gcs(file_path=file_path, gcs_path=gcs_path, token=self.token)
+        return await upload_file_to_gcs(file_path=file_path, gcs_path=gcs_path, token=self.token,
+                                        bucket=self.bucket_name, client=self.client)
 
     @override
     async def upload_bytes(self, file_contents: bytes, gcs_path: str) -> str:
         logger.info(f"Uploading {len(file_contents)} bytes to {gcs_path}")
-        return await upload_bytes_to_gcs(file_contents=file_contents, gcs_path=gcs_path, token=self.token)
+        return await upload_bytes_to_gcs(file_contents=file_contents, gcs_path=gcs_path, token=self.token,
+                                         bucket=self.bucket_name, client=self.client)
+
+    @override
+    async def upload_stream(self, chunks: AsyncIterator[bytes], gcs_path: str) -> str:
+        logger.info(f"Uploading stream to {gcs_path}")
+        return await upload_stream_to_gcs(chunks=chunks, gcs_path=gcs_path, token=self.token, bucket=self.bucket_name,
+                                          client=self.client)
 
     @override
     async def get_modified_date(self, gcs_path: str) -> datetime:
         logger.info(f"Getting modified date of {gcs_path}")
-        return await get_gcs_modified_date(gcs_path=gcs_path, token=self.token)
+        return await get_gcs_modified_date(gcs_path=gcs_path, token=self.token, bucket=self.bucket_name,
+                                           client=self.client)
+
+    @override
+    async def get_metadata(self, gcs_path: str) -> ListingItem:
+        logger.info(f"Getting metadata of {gcs_path}")
+        return await get_gcs_metadata(gcs_path=gcs_path, token=self.token, bucket=self.bucket_name, client=self.client)
 
     @override
     async def get_listing(self, gcs_path: str) -> list[ListingItem]:
         logger.info(f"Getting listing of {gcs_path}")
-        return await get_listing_of_gcs_path(gcs_path, token=self.token)
+        return await get_listing_of_gcs_path(gcs_path, token=self.token, bucket=self.bucket_name, client=self.client)
 
     @override
     async def get_file_contents(self, gcs_path: str) -> bytes | None:
         logger.info(f"Getting contents of {gcs_path}")
-        return await get_gcs_file_contents(gcs_path=gcs_path, token=self.token)
+        return await get_gcs_file_contents(gcs_path=gcs_path, token=self.token, bucket=self.bucket_name,
+                                           client=self.client)
+
+    @override
+    async def stream_file(self, gcs_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                          chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        async for chunk in stream_gcs_file(gcs_path=gcs_path, token=self.token, bucket=self.bucket_name,
+                                           client=self.client, start=start, end=end, chunk_size=chunk_size):
+            yield chunk
 
     @override
     async def close(self) -> None:
+        await self.client.close()
         await close_token(self.token)
@@ -1,20 +1,30 @@
 import asyncio
+import json
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Optional
 from urllib.parse import quote
 
+import aiohttp
 from gcloud.aio.auth import Token
 from gcloud.aio.storage import Storage
 from gcloud.aio.storage.constants import DEFAULT_TIMEOUT
 
-from biosim_server.common.storage import ListingItem
-from biosim_server.config import get_settings
+from common.storage.file_service import ListingItem
+from shared.environment import DEFAULT_BUCKET_NAME, DEFAULT_GCS_CREDENTIALS_FILE
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# bytes sent per request of a resumable upload: must be a multiple of 256 KiB
+RESUMABLE_CHUNK_BYTES = 32 * 256 * 1024
+RESUMABLE_CHUNK_TIMEOUT = 120
+# a streamed download has no overall deadline (large files take as long as they take), but fails if the connection
+# stalls for this many seconds between reads
+STREAM_SOCK_READ_TIMEOUT = 300
+
 
 class _StorageWithListPrefix(Storage):
 
@@ -32,9 +42,57 @@ class _StorageWithListPrefix(Storage):
         data: Dict[str, Any] = await resp.json(content_type=None)
         return data
 
+    async def upload_stream(self, bucket: str, object_name: str, chunks: AsyncIterator[bytes],
+                            content_type: str = "application/octet-stream",
+                            chunk_size: int = RESUMABLE_CHUNK_BYTES) -> Dict[str, Any]:
+        """Upload `chunks` of unknown total size, holding at most about `chunk_size` bytes in memory: as a resumable upload
+            sending `chunk_size` bytes per request, or as a single request if the stream is smaller than that.
+        """
+        buffer = bytearray()
+        session_uri = None
+        offset = 0
+        async for data in chunks:
+            buffer.extend(data)
+            while len(buffer) >= chunk_size:
+                if session_uri is None:
+                    session_uri = await self._initiate_stream_upload(bucket, object_name, content_type)
+                await self._put_chunk(session_uri, bytes(buffer[:chunk_size]), offset)
+                del buffer[:chunk_size]
+                offset += chunk_size
+
+        if session_uri is None:
+            return await self.upload(bucket=bucket, object_name=object_name, file_data=bytes(buffer), content_type=content_type)
+        return await self._put_chunk(session_uri, bytes(buffer), offset, total=offset + len(buffer))
+
+    async def _initiate_stream_upload(self, bucket: str, object_name: str, content_type: str) -> str:
+        # https://cloud.google.com/storage/docs/performing-resumable-uploads#chunked-upload
+        url = f'{self._api_root_write}/{bucket}/o'
+        headers: dict[str, Any] = {'Content-Type': 'application/json; charset=UTF-8', 'X-Upload-Content-Type': content_type}
+        headers.update(await self._headers())
+        resp = await self.session.post(url=url, headers=headers, params={'uploadType': 'resumable'},
+                                       data=json.dumps({'name': object_name}), timeout=DEFAULT_TIMEOUT)
+        session_uri: str = resp.headers['Location']
+        return session_uri
+
+    async def _put_chunk(self, session_uri: str, data: bytes, offset: int, total: Optional[int] = None) -> Dict[str, Any]:
+        if data:
+            content_range = f"bytes {offset}-{offset + len(data) - 1}/{'*' if total is None else total}"
+        else:
+            content_range = f"bytes */{total}"
+        headers: dict[str, Any] = {'Content-Range': content_range, 'Content-Length': str(len(data))}
+        headers.update(await self._headers())
+        # the raw aiohttp session: intermediate chunks are acknowledged with 308, which the wrapped session treats as an error
+        async with self.session.session.put(session_uri, data=data, headers=headers,
+                                            timeout=aiohttp.ClientTimeout(total=RESUMABLE_CHUNK_TIMEOUT)) as resp:
+            if resp.status == 308:
+                return {}
+            resp.raise_for_status()
+            result: Dict[str, Any] = await resp.json(content_type=None)
+            return result
+
 
 def create_token() -> Token:
-    return Token(service_file=get_settings().storage_gcs_credentials_file,
+    return Token(service_file=DEFAULT_GCS_CREDENTIALS_FILE,
                  scopes=["https://www.googleapis.com/auth/cloud-platform.read-only",
                          "https://www.googleapis.com/auth/devstorage.read_write"])
 
@@ -43,66 +101,124 @@ async def close_token(token: Token) -> None:
         await token.close()
 
 
-async def download_gcs_file(gcs_path: str, file_path: Path, token: Token) -> str:
-    logger.info(f"Downloading {file_path} to {gcs_path}")
-    async with Storage(token=token) as client:
-        await client.download_to_filename(bucket=get_settings().storage_bucket, object_name=gcs_path, filename=str(file_path))
+def create_client(token: Token) -> _StorageWithListPrefix:
+    """Long-lived client whose aiohttp session (and thus connection pool) is reused across calls."""
+    return _StorageWithListPrefix(token=token)
+
+
+@asynccontextmanager
+async def _storage(token: Token, client: Optional[Storage] = None) -> AsyncIterator[Storage]:
+    # reuse a pooled client if one is given (and leave it open), otherwise use a short-lived client for this call
+    if client is not None:
+        yield client
+    else:
+        async with _StorageWithListPrefix(token=token) as temp_client:
+            yield temp_client
+
+
+def _listing_item(item: Dict[str, Any]) -> ListingItem:
+    return ListingItem(Key=item["id"], LastModified=datetime.fromisoformat(item["updated"]),
+                       Size=item["size"], ETag=item["etag"], md5Hash=item.get("md5Hash"))
+
+
+async def download_gcs_file(gcs_path: str, file_path: Path, token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                            client: Optional[Storage] = None) -> str:
+    logger.info(f"Downloading {gcs_path} to {file_path}")
+    async with _storage(token, client) as client:
+        await client.download_to_filename(bucket=bucket, object_name=gcs_path, filename=str(file_path))
         return gcs_path
 
 
-async def upload_file_to_gcs(file_path: Path, gcs_path: str, token: Token) -> str:
+async def upload_file_to_gcs(file_path: Path, gcs_path: str, token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                             client: Optional[Storage] = None) -> str:
     logger.info(f"Uploading {file_path} to {gcs_path}")
-    async with Storage(token=token) as client:
-        result: dict[str, Any] = await client.upload_from_filename(bucket=get_settings().storage_bucket, object_name=gcs_path, filename=str(file_path))
+    async with _storage(token, client) as client:
+        result: dict[str, Any] = await client.upload_from_filename(bucket=bucket, object_name=gcs_path, filename=str(file_path))
         logger.info(f"Upload result: {result}")
         return gcs_path
 
 
-async def upload_bytes_to_gcs(file_contents: bytes, gcs_path: str, token: Token) -> str:
+async def upload_bytes_to_gcs(file_contents: bytes, gcs_path: str, token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                              client: Optional[Storage] = None) -> str:
     logger.info(f"Uploading {len(file_contents)} bytes to {gcs_path}")
-    async with Storage(token=token) as client:
-        await client.upload(bucket=get_settings().storage_bucket, file_data=file_contents, object_name=gcs_path)
+    async with _storage(token, client) as client:
+        await client.upload(bucket=bucket, file_data=file_contents, object_name=gcs_path)
+        return gcs_path
+
+
+async def upload_stream_to_gcs(chunks: AsyncIterator[bytes], gcs_path: str, token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                               client: Optional[Storage] = None) -> str:
+    logger.info(f"Uploading stream to {gcs_path}")
+    async with _storage(token, client) as my_client:
+        assert isinstance(my_client, _StorageWithListPrefix)  # to avoid mypy error
+        await my_client.upload_stream(bucket=bucket, object_name=gcs_path, chunks=chunks)
         return gcs_path
 
 
-async def get_gcs_modified_date(gcs_path: str, token: Token) -> datetime:
+async def get_gcs_metadata(gcs_path: str, token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                           client: Optional[Storage] = None) -> ListingItem:
+    logger.info(f"Getting metadata for {gcs_path}")
+    async with _storage(token, client) as client:
+        metadata: dict[str, Any] = await client.download_metadata(bucket=bucket, object_name=gcs_path)
+        return _listing_item(metadata)
+
+
+async def get_gcs_modified_date(gcs_path: str, token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                                client: Optional[Storage] = None) -> datetime:
     logger.info(f"Getting modified date for {gcs_path}")
-    async with Storage(token=token) as client:
-        metadata: dict[str, Any] = await client.download_metadata(bucket=get_settings().storage_bucket, object_name=gcs_path)
+    async with _storage(token, client) as client:
+        metadata: dict[str, Any] = await client.download_metadata(bucket=bucket, object_name=gcs_path)
         return datetime.fromisoformat(metadata["updated"])
 
 
-async def get_listing_of_gcs(token: Token) -> list[ListingItem]:
+async def get_listing_of_gcs(token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                             client: Optional[Storage] = None) -> list[ListingItem]:
     logger.info(f"Retrieving file list from root of bucket")
-    async with Storage(token=token) as client:
-        metadata: dict[str, Any] = await client.list_objects(bucket=get_settings().storage_bucket)
-        files: list[ListingItem] = [ListingItem(Key=item["id"], LastModified=datetime.fromisoformat(item["updated"]),
-                                                Size=item["size"], ETag=item["etag"]) for item in metadata["items"]]
+    async with _storage(token, client) as client:
+        metadata: dict[str, Any] = await client.list_objects(bucket=bucket)
+        files: list[ListingItem] = [_listing_item(item) for item in metadata["items"]]
         return files
 
 
-async def get_listing_of_gcs_path(gcs_path: str, token: Token) -> list[ListingItem]:
+async def get_listing_of_gcs_path(gcs_path: str, token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                                  client: Optional[Storage] = None) -> list[ListingItem]:
     logger.info(f"Retrieving file list from {gcs_path}")
-    async with _StorageWithListPrefix(token=token) as my_client:
+    async with _storage(token, client) as my_client:
         assert isinstance(my_client, _StorageWithListPrefix)  # to avoid mypy error
-        metadata: dict[str, Any] = await my_client.list_objects_with_prefix(bucket=get_settings().storage_bucket,
-                                                                            prefix=gcs_path)
-        files: list[ListingItem] = [ListingItem(Key=item["id"], LastModified=datetime.fromisoformat(item["updated"]),
-                                                Size=item["size"], ETag=item["etag"]) for item in metadata["items"]]
+        metadata: dict[str, Any] = await my_client.list_objects_with_prefix(bucket=bucket, prefix=gcs_path)
+        files: list[ListingItem] = [_listing_item(item) for item in metadata["items"]]
         return files
 
 
-async def get_gcs_file_contents(gcs_path: str, token: Token) -> bytes | None:
+async def get_gcs_file_contents(gcs_path: str, token: Token, bucket: str = DEFAULT_BUCKET_NAME,
+                                client: Optional[Storage] = None) -> bytes | None:
     logger.info(f"Getting file contents for {gcs_path}")
     try:
-        async with Storage(token=token) as client:
-            return await client.download(bucket=get_settings().storage_bucket, object_name=gcs_path)
+        async with _storage(token, client) as client:
+            return await client.download(bucket=bucket, object_name=gcs_path)
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
         return None
 
+async def stream_gcs_file(gcs_path: str, token: Token, bucket: str = DEFAULT_BUCKET_NAME, client: Optional[Storage] = None,
+                          start: Optional[int] = None, end: Optional[int] = None,
+                          chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    logger.info(f"Streaming {gcs_path} (bytes {start}-{end})")
+    headers = {}
+    if start is not None or end is not None:
+        headers["Range"] = f"bytes={start or 0}-{'' if end is None else end}"
+    async with _storage(token, client) as client:
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=DEFAULT_TIMEOUT, sock_read=STREAM_SOCK_READ_TIMEOUT)
+        stream = await client.download_stream(bucket=bucket, object_name=gcs_path, headers=headers, timeout=timeout)
+        async with stream:
+            while True:
+                chunk = await stream.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
 async def main() -> None:
-    settings = get_settings()
     token = create_token()
     # await download_gcs_file(gcs_path="local_data/toy_zarr/.zarray", file_path=Path(".zarray"), token=token)
     print(f"datetime is {await get_gcs_modified_date(gcs_path='local_data/toy_zarr/.zarray', token=token)}")
@@ -111,4 +227,4 @@ async def main() -> None:
     await close_token(token)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+"""
+Batch submission of parameter studies.
+
+A study is one base composition spec (or SBML model) and a list of overrides, one per variant. The model files shared by
+the variants are hashed and uploaded once for the whole batch, every variant becomes a regular job (tagged with the
+batch id, and run by the worker like any other) and all of them are created with a single bulk insert. The batch is
+recorded in the batches collection, and its status is aggregated from the statuses of its jobs in one query.
+"""
+import asyncio
+import copy
+import importlib
+import json
+import uuid
+from typing import *
+
+from fastapi import HTTPException, UploadFile
+
+from shared.data_model import BatchRun, BatchStatus, CompositionNode, CompositionSpec, JobStatuses
+from shared.database import DatabaseConnector
+from shared.environment import (
+    DEFAULT_JOB_COLLECTION_NAME,
+    DEFAULT_BATCHES_COLLECTION_NAME,
+    DEFAULT_BUCKET_NAME,
+    DEFAULT_MAX_BATCH_SIZE
+)
+from shared.io import write_uploaded_file, hash_uploaded_file
+from shared.results_cache import job_fingerprint, composition_simulators
+from shared.utils import new_job_id
+
+from gateway.handlers.submit import match_model_files, memoized_fields
+
+
+# simulators that UTC batches can be run with
+UTC_BATCH_SIMULATORS = ("amici", "copasi", "tellurium")
+# time course parameters that each variant of a UTC batch may override (model parameters are varied with a sweep, see
+# `gateway.handlers.sweep`)
+UTC_OVERRIDE_FIELDS = ("start", "stop", "steps")
+# statuses of jobs that have not finished yet
+UNFINISHED_STATUSES = (JobStatuses.PENDING, JobStatuses.IN_PROGRESS)
+
+
+def parse_overrides(contents: bytes, max_size: int = DEFAULT_MAX_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """Parse the JSON list of overrides of a batch, one object per variant.
+
+        Raises:
+            HTTPException(400) if `contents` is not a non-empty list of at most `max_size` objects.
+    """
+    try:
+        overrides = json.loads(contents)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON format.")
+    if not isinstance(overrides, list) or not overrides or not all(isinstance(override, dict) for override in overrides):
+        raise HTTPException(status_code=400, detail="Overrides must be a non-empty JSON list of objects, one per variant.")
+    if len(overrides) > max_size:
+        raise HTTPException(status_code=400, detail=f"A batch has at most {max_size} variants, got {len(overrides)}.")
+    return overrides
+
+
+def merge_override(base: Mapping[str, Any], override: Mapping[str, Any]) -> Dict[str, Any]:
+    """Copy of `base` with `override` merged in: objects are merged key by key, any other value replaces the base one."""
+    merged = copy.deepcopy(dict(base))
+    for key, value in override.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = merge_override(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def batch_status(statuses: Mapping[str, int]) -> str:
+    """Summary of the number of jobs of a batch in each state: PENDING until one of them starts, IN_PROGRESS until all
+        are done, then FAILED if all of them failed and COMPLETE otherwise (`statuses` tells how many failed).
+    """
+    n_jobs = sum(statuses.values())
+    if statuses.get(JobStatuses.PENDING, 0) == n_jobs:
+        return JobStatuses.PENDING
+    if any(statuses.get(status, 0) for status in UNFINISHED_STATUSES):
+        return JobStatuses.IN_PROGRESS
+    if statuses.get(JobStatuses.FAILED, 0) == n_jobs:
+        return JobStatuses.FAILED
+    return "COMPLETE"
+
+
+async def create_batch(db_connector: DatabaseConnector, batch_id: str, kind: str, documents: List[Dict[str, Any]]) -> BatchRun:
+    """Insert the job `documents` of a batch in bulk, then record the batch."""
+    await db_connector.write_many(DEFAULT_JOB_COLLECTION_NAME, documents)
+    batch = BatchRun(
+        batch_id=batch_id,
+        kind=kind,
+        last_updated=db_connector.timestamp(),
+        n_jobs=len(documents),
+        job_ids=[document["job_id"] for document in documents]
+    )
+    await db_connector.write(collection_name=DEFAULT_BATCHES_COLLECTION_NAME, **batch.serialize())
+    return batch
+
+
+async def submit_composition_batch(
+        db_connector: DatabaseConnector,
+        spec: Dict[str, Any],
+        model_files: List[UploadFile],
+        duration: int,
+        overrides: List[Dict[str, Any]],
+        scheduling: Mapping[str, Any] = None
+) -> BatchRun:
+    """Submit one composition job per override of `spec`. An override is merged into the spec (see `merge_override`),
+        except for its `duration` key, which replaces `duration`. Variants answered from the results cache are COMPLETE
+        from the start. Every variant gets the `scheduling` fields of the submission.
+    """
+    batch_id = new_job_id("batch")
+
+    # hash and upload each model file once, even if it is the source of several nodes
+    nodes, files = match_model_files(spec, model_files)
+    unique_files = {}
+    for model_file, file_ext in files:
+        unique_files.setdefault(id(model_file), (model_file, file_ext))
+    file_hashes = {key: await hash_uploaded_file(model_file) for key, (model_file, _) in unique_files.items()}
+    locations = await asyncio.gather(*[
+        write_uploaded_file(job_id=batch_id, uploaded_file=model_file, bucket_name=DEFAULT_BUCKET_NAME, extension=file_ext)
+        for model_file, file_ext in unique_files.values()
+    ])
+    file_locations = dict(zip(unique_files.keys(), locations))
+
+    model_hashes = {}
+    located_spec = copy.deepcopy(spec)
+    for node_name, (model_file, _) in zip(nodes, files):
+        model_hashes[node_name] = file_hashes[id(model_file)]
+        located_spec[node_name]["config"]["model"]["model_source"] = file_locations[id(model_file)]
+
+    variants = []
+    for override in overrides:
+        override = dict(override)
+        variant_duration = override.pop("duration", duration)
+        job_id = new_job_id("composition")
+        # fingerprinted like a single submission of the same spec, so that both share the results cache
+        inputs = {"spec": merge_override(spec, override), "models": model_hashes, "duration": variant_duration}
+        fingerprint, versions = job_fingerprint("composition", inputs, simulators=composition_simulators(inputs["spec"]))
+        composition = CompositionSpec(
+            nodes=[CompositionNode(name=node_name, **node_spec) for node_name, node_spec in merge_override(located_spec, override).items()],
+            emitter_mode="all",
+            job_id=job_id
+        )
+        variants.append((job_id, variant_duration, composition.spec, fingerprint, versions))
+
+    cached = await db_connector.find_many_cached_results([variant[3] for variant in variants if variant[3]])
+    timestamp = db_connector.timestamp()
+    documents = [
+        {
+            "job_id": job_id,
+            "batch_id": batch_id,
+            "last_updated": timestamp,
+            "status": "PENDING",
+            "spec": variant_spec,
+            "simulators": [],
+            "duration": variant_duration,
+            "results": {},
+            **memoized_fields(fingerprint, versions, cached.get(fingerprint)),
+            **(scheduling or {}),
+        }
+        for job_id, variant_duration, variant_spec, fingerprint, versions in variants
+    ]
+    return await create_batch(db_connector, batch_id, "composition", documents)
+
+
+async def submit_utc_batch(
+        db_connector: DatabaseConnector,
+        simulator: str,
+        model_file: UploadFile,
+        start: int,
+        stop: int,
+        steps: int,
+        overrides: List[Dict[str, Any]],
+        scheduling: Mapping[str, Any] = None
+) -> BatchRun:
+    """Submit one uniform time course of `model_file` with `simulator` per override, which replaces any of the time
+        course parameters (`UTC_OVERRIDE_FIELDS`). Every variant gets the `scheduling` fields of the submission.
+    """
+    simulator = simulator.lower()
+    if simulator not in UTC_BATCH_SIMULATORS:
+        raise HTTPException(status_code=400, detail=f"Simulator must be one of {', '.join(UTC_BATCH_SIMULATORS)}.")
+    unknown_fields = set().union(*overrides) - set(UTC_OVERRIDE_FIELDS)
+    if "params" in unknown_fields:
+        raise HTTPException(status_code=400, detail="UTC batches cannot override model parameters: submit a parameter sweep (/run-utc-sweep) instead.")
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Overrides may only set {', '.join(UTC_OVERRIDE_FIELDS)}, got {', '.join(sorted(unknown_fields))}.")
+
+    batch_id = new_job_id("batch")
+    model_hash = await hash_uploaded_file(model_file)
+    model_location = await write_uploaded_file(job_id=batch_id, uploaded_file=model_file, bucket_name=DEFAULT_BUCKET_NAME, extension='.xml')
+    context_model = getattr(importlib.import_module("shared.data_model"), simulator.capitalize() + "Run")
+
+    variants = []
+    for override in overrides:
+        parameters = {"start": start, "stop": stop, "steps": steps, "params": {}, **override}
+        # fingerprinted like a single submission of the same run, so that both share the results cache
+        fingerprint, versions = job_fingerprint("utc", {"model": model_hash, **parameters}, simulators=[simulator])
+        run_data = context_model(
+            job_id=f"run-{simulator}-process-" + str(uuid.uuid4()),
+            last_updated=db_connector.timestamp(),
+            status="PENDING",
+            simulator=simulator,
+            model_file=model_location,
+            **parameters
+        )
+        variants.append((run_data, fingerprint, versions))
+
+    cached = await db_connector.find_many_cached_results([variant[1] for variant in variants if variant[1]])
+    documents = [
+        {
+            **run_data.serialize(),
+            "batch_id": batch_id,
+            **memoized_fields(fingerprint, versions, cached.get(fingerprint)),
+            **(scheduling or {}),
+        }
+        for run_data, fingerprint, versions in variants
+    ]
+    return await create_batch(db_connector, batch_id, f"utc-{simulator}", documents)
+
+
+async def get_batch_status(db_connector: DatabaseConnector, batch_id: str) -> Optional[BatchStatus]:
+    """Aggregate status of the jobs of batch `batch_id`, or `None` if there is no such batch."""
+    batch = await db_connector.read(
+        collection_name=DEFAULT_BATCHES_COLLECTION_NAME,
+        projection={"_id": 0, "job_ids": 0},
+        batch_id=batch_id
+    )
+    if batch is None:
+        return None
+
+    statuses = await db_connector.count_statuses(batch_id=batch_id)
+    return BatchStatus(
+        batch_id=batch_id,
+        kind=batch["kind"],
+        last_updated=db_connector.timestamp(),
+        n_jobs=batch["n_jobs"],
+        status=batch_status(statuses),
+        statuses=statuses
+    )
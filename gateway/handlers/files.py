@@ -0,0 +1,112 @@
+"""
+Streaming of result files (ie: smoldyn txt, readdy h5) for /get-output-file.
+
+Files are relayed from the file service chunk by chunk, so the first byte reaches the client without waiting for a full
+download and nothing is written to a temporary directory. Single-range `Range` requests are honored, so that clients can
+resume a download or read part of an h5 file. Hot files are served from the local `FileCache` shared with the rest of
+the process: whole-file downloads of files small enough to be cached are written to it as they are relayed.
+"""
+import asyncio
+import os
+import re
+import uuid
+from typing import *
+
+from fastapi import HTTPException
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from shared.io import FileCache, get_file_cache, get_file_service
+from shared.log_config import setup_logging
+
+
+logger = setup_logging(__file__)
+
+OUTPUT_FILE_CHUNK_BYTES = 1024 * 1024
+OUTPUT_FILE_MEDIA_TYPE = "application/octet-stream"
+# files larger than this fraction of the cache budget are never cached, so that one file cannot flush the cache
+CACHEABLE_FILE_FRACTION = 4
+BYTE_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range `Range` header into the inclusive `(first, last)` byte positions of a file of `size` bytes,
+        or `None` to serve the whole file (no header, or one this does not handle, such as several ranges).
+
+        Raises:
+            HTTPException(416) if the range cannot be satisfied.
+    """
+    if not range_header:
+        return None
+    match = BYTE_RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: the last `last` bytes
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise HTTPException(status_code=416, detail=f"Range {range_header} not satisfiable.", headers={"Content-Range": f"bytes */{size}"})
+    return first, last
+
+
+async def output_file_response(bucket_name: str, blob_path: str, range_header: Optional[str] = None) -> Response:
+    """Response relaying `blob_path` (or the byte range of it requested by `range_header`) from `bucket_name`."""
+    filename = blob_path.split("/")[-1]
+    file_service = get_file_service(bucket_name)
+    metadata = await file_service.get_metadata(blob_path)
+    cache = get_file_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = FileCache.cache_key(bucket_name, blob_path, content_hash=metadata.md5Hash, generation=metadata.ETag)
+        cached_fp = cache.get(cache_key)
+        if cached_fp is not None:
+            # handles range requests itself
+            return FileResponse(path=cached_fp, media_type=OUTPUT_FILE_MEDIA_TYPE, filename=filename)
+
+    size = metadata.Size
+    byte_range = parse_range(range_header, size)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+    if byte_range is not None:
+        first, last = byte_range
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+        headers["Content-Length"] = str(last - first + 1)
+        chunks = file_service.stream_file(blob_path, start=first, end=last, chunk_size=OUTPUT_FILE_CHUNK_BYTES)
+        return StreamingResponse(chunks, status_code=206, headers=headers, media_type=OUTPUT_FILE_MEDIA_TYPE)
+
+    headers["Content-Length"] = str(size)
+    chunks = file_service.stream_file(blob_path, chunk_size=OUTPUT_FILE_CHUNK_BYTES)
+    if cache is not None and size <= cache.max_bytes // CACHEABLE_FILE_FRACTION:
+        chunks = tee_to_cache(chunks, cache, cache_key)
+    return StreamingResponse(chunks, headers=headers, media_type=OUTPUT_FILE_MEDIA_TYPE)
+
+
+async def tee_to_cache(chunks: AsyncIterator[bytes], cache: FileCache, key: str) -> AsyncIterator[bytes]:
+    """Relay `chunks` while writing them to a partial file, which becomes the cache entry for `key` once complete."""
+    entry_path = cache.entry_path(key)
+    partial_fp = f"{entry_path}.{uuid.uuid4().hex}{FileCache.PARTIAL_SUFFIX}"
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    complete = False
+    try:
+        with open(partial_fp, 'wb') as f:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+                yield chunk
+        complete = True
+    finally:
+        if complete:
+            async def adopt(dest_fp: str):
+                os.replace(partial_fp, dest_fp)
+
+            try:
+                await cache.fetch(key, adopt)
+            except OSError as e:
+                logger.warning(f"Could not cache {key}: {e}")
+        if os.path.exists(partial_fp):
+            os.remove(partial_fp)
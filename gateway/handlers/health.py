@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import FastAPI
 
 from shared.data_model import DbClientResponse
@@ -5,12 +7,12 @@ from shared.database import DatabaseConnector
 from shared.environment import DEFAULT_DB_TYPE
 
 
-def check_client(db_connector: DatabaseConnector) -> DbClientResponse:
+async def check_client(db_connector: DatabaseConnector) -> DbClientResponse:
     """TODO: generalize this to work with multiple client types. Currently using Mongo."""
     msg = "Pinged your deployment. You successfully connected to MongoDB!"
     status = "PASS"
     try:
-        db_connector.client.admin.command('ping')
+        await db_connector.ping()
     except Exception as e:
         msg = f"Failed to connect to MongoDB:\n{e}"
         status = "FAIL"
@@ -22,9 +24,11 @@ def check_client(db_connector: DatabaseConnector) -> DbClientResponse:
     )
 
 
-def stop_client(db_connector: DatabaseConnector) -> DbClientResponse:
+async def stop_client(db_connector: DatabaseConnector) -> DbClientResponse:
     """TODO: generalize this to work with multiple client types. Currently using Mongo."""
-    db_connector.client.close()
+    closed = db_connector.client.close()
+    if asyncio.iscoroutine(closed):
+        await closed
 
     return DbClientResponse(
         message=f"{DEFAULT_DB_TYPE} successfully closed!",
@@ -0,0 +1,270 @@
+"""
+Retrieval of (a window of) job results for /get-output.
+
+Clients usually want a few species over part of a run, so the requested species and steps are pushed down as far as
+they can go: into the Mongo projection (field selection and `$slice`) for results stored inline as lists, and into
+`ResultsStore.read` (chunk and column selection) for binary results. Only the stride and the page limit are applied in
+the gateway, on data already restricted to the requested window.
+
+Large results can also be streamed as newline-delimited JSON (`stream_job_output`): one line per column and block of
+rows, read from the results store one chunk at a time, so that gateway memory per request stays constant and clients
+can start consuming data before the whole output has been read.
+"""
+import json
+from dataclasses import dataclass, replace
+from typing import *
+
+import numpy as np
+
+from shared.data_model import OutputData
+from shared.database import DatabaseConnector, SPILL_KEY
+from shared.environment import DEFAULT_JOB_COLLECTION_NAME
+from shared.results_store import ResultsStore, MANIFEST_KEYS
+from shared.utils import arrays_to_json
+
+
+# fields of the job document that are never part of its output
+OUTPUT_EXCLUDED_FIELDS = ("_id", "spec", "duration", "simulators")
+OUTPUT_METADATA_FIELDS = ("job_id", "status", "last_updated")
+# non-column values stored alongside results (see `ResultsStore.attributes`), always part of the output
+OUTPUT_ATTRIBUTE_KEYS = ("species_counts_header", "species", "failed", "n_replicates", "seeds")
+# projected in place of (possibly) spilled results: tells that they were spilled without reading them
+SPILLED_MARKER_KEY = f"{SPILL_KEY}.size"
+# `$slice` requires a count: used when the window has no end
+MAX_SLICE_COUNT = 2 ** 31 - 1
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# rows of a column emitted per ndjson line
+DEFAULT_STREAM_ROWS_PER_LINE = 10000
+
+
+@dataclass
+class OutputWindow:
+    """The part of a job's results requested from /get-output: the `species` (all by default) at steps
+        `start:stop:stride`, paginated `limit` steps at a time from page `cursor` (in steps of the output).
+    """
+    species: Optional[List[str]] = None
+    start: int = 0
+    stop: Optional[int] = None
+    stride: int = 1
+    cursor: int = 0
+    limit: Optional[int] = None
+
+    def rows(self) -> Tuple[int, Optional[int]]:
+        """The range `[row_start, row_stop)` of stored rows covering the requested page. When paginating it includes one
+            row beyond the page (if any), which tells whether there is a next page.
+        """
+        row_start = self.start + self.cursor * self.stride
+        row_stop = self.stop
+        if self.limit is not None:
+            page_stop = row_start + self.limit * self.stride + 1
+            row_stop = page_stop if row_stop is None else min(row_stop, page_stop)
+        return row_start, row_stop
+
+    def unpaginated(self) -> "OutputWindow":
+        """The same rows as the requested page, as a plain `start:stop:stride` window."""
+        row_start = self.start + self.cursor * self.stride
+        row_stop = self.stop
+        if self.limit is not None:
+            page_stop = row_start + self.limit * self.stride
+            row_stop = page_stop if row_stop is None else min(row_stop, page_stop)
+        return replace(self, start=row_start, stop=row_stop, cursor=0, limit=None)
+
+
+def output_projection(window: OutputWindow, simulators: List[str], status: str = "COMPLETE") -> Tuple[Dict[str, Any], bool]:
+    """Mongo projection for the output of a job with `window`, and whether the window was pushed into it (in which case
+        results stored inline only contain the rows `window.rows()`). Results may be stored per simulator, hence the
+        `simulators` of the job. Only the results of COMPLETE jobs are pushed into: others may hold an error message or
+        partial results of any shape.
+    """
+    if not window.species or status != "COMPLETE":
+        return {field: 0 for field in OUTPUT_EXCLUDED_FIELDS}, False
+
+    row_start, row_stop = window.rows()
+    if row_stop is not None:
+        species_projection = {"$slice": [row_start, max(row_stop - row_start, 1)]}
+    elif row_start > 0:
+        species_projection = {"$slice": [row_start, MAX_SLICE_COUNT]}
+    else:
+        species_projection = 1
+
+    projection = {"_id": 0, **{field: 1 for field in OUTPUT_METADATA_FIELDS}}
+    for prefix in ["results"] + [f"results.{simulator}" for simulator in simulators]:
+        for key in MANIFEST_KEYS + OUTPUT_ATTRIBUTE_KEYS + ("error", SPILLED_MARKER_KEY):
+            projection[f"{prefix}.{key}"] = 1
+        for species in window.species:
+            projection[f"{prefix}.{species}"] = species_projection
+    return projection, True
+
+
+class ResultsPage(object):
+    def __init__(self, window: OutputWindow, results_store: ResultsStore, pushed_down: bool):
+        self.window = window
+        self.results_store = results_store
+        self.pushed_down = pushed_down
+        self.has_more = False
+
+    @property
+    def next_cursor(self) -> Optional[int]:
+        return self.window.cursor + self.window.limit if self.has_more else None
+
+    def _limit(self, values: Sequence) -> Sequence:
+        if self.window.limit is not None and len(values) > self.window.limit:
+            self.has_more = True
+            return values[:self.window.limit]
+        return values
+
+    async def expand(self, results: Any) -> Any:
+        """Restrict `results` (stored or inline, possibly per simulator) to the page and decode it into JSON-able data."""
+        window = self.window
+        row_start, row_stop = window.rows()
+        if ResultsStore.is_stored(results):
+            arrays = await self.results_store.read(
+                results,
+                names=window.species,
+                start=row_start,
+                stop=row_stop,
+                step=window.stride
+            )
+            arrays = {name: self._limit(array) for name, array in arrays.items()}
+            return {**ResultsStore.attributes(results), **arrays_to_json(arrays)}
+        elif isinstance(results, dict):
+            page = {}
+            for key, value in results.items():
+                if key in OUTPUT_ATTRIBUTE_KEYS:
+                    page[key] = value
+                elif isinstance(value, (list, np.ndarray)):
+                    # a column of rows
+                    if window.species and key not in window.species:
+                        continue
+                    rows = value[::window.stride] if self.pushed_down else value[row_start:row_stop:window.stride]
+                    page[key] = self._limit(rows)
+                else:
+                    page[key] = await self.expand(value)
+            return page
+        return results
+
+
+def has_spilled_marker(document: Any) -> bool:
+    if not isinstance(document, dict):
+        return False
+    return SPILL_KEY in document or any(has_spilled_marker(value) for value in document.values())
+
+
+async def read_output_document(
+        db_connector: DatabaseConnector,
+        job_id: str,
+        window: OutputWindow
+) -> Tuple[Optional[Mapping[str, Any]], bool]:
+    """Read the output fields of job `job_id` projected for `window`, and whether the window was pushed into them. Spilled
+        results cannot be projected: the job is then read again without pushing the window down.
+    """
+    simulators, status = [], None
+    if window.species:
+        # results may be stored per simulator: find out which before projecting species under them
+        job_status = await db_connector.get_job_status(job_id)
+        if job_status is None:
+            return None, False
+        simulators = job_status.get("simulators") or [job_status.get("simulator")]
+        simulators = [simulator for simulator in simulators if simulator]
+        status = job_status.get("status")
+
+    projection, pushed_down = output_projection(window, simulators, status)
+    job = await db_connector.read(collection_name=DEFAULT_JOB_COLLECTION_NAME, projection=projection, job_id=job_id)
+    if pushed_down and job is not None and has_spilled_marker(job.get("results")):
+        projection, pushed_down = output_projection(replace(window, species=None), simulators, status)
+        job = await db_connector.read(collection_name=DEFAULT_JOB_COLLECTION_NAME, projection=projection, job_id=job_id)
+    return job, pushed_down
+
+
+async def get_job_output(
+        db_connector: DatabaseConnector,
+        results_store: ResultsStore,
+        job_id: str,
+        window: OutputWindow = None
+) -> Optional[OutputData]:
+    """Read the page of job `job_id`'s results described by `window` (everything by default), or `None` if there is no
+        such job.
+    """
+    window = window or OutputWindow()
+    job, pushed_down = await read_output_document(db_connector, job_id, window)
+    if job is None:
+        return None
+
+    page = ResultsPage(window, results_store, pushed_down)
+    results = await page.expand(job.get("results", {}))
+    return OutputData(
+        job_id=job["job_id"],
+        status=job["status"],
+        last_updated=job["last_updated"],
+        results=results,
+        next_cursor=page.next_cursor
+    )
+
+
+async def stream_job_output(
+        db_connector: DatabaseConnector,
+        results_store: ResultsStore,
+        job_id: str,
+        window: OutputWindow = None,
+        rows_per_line: int = DEFAULT_STREAM_ROWS_PER_LINE
+) -> Optional[AsyncIterator[bytes]]:
+    """Newline-delimited JSON rendering of job `job_id`'s results in `window`, or `None` if there is no such job.
+
+        The first line holds the job's `job_id`, `status` and `last_updated`. Each following line holds up to
+        `rows_per_line` values of one column: `{"path": [..., column], "start": first_row, "values": [...]}`, where the
+        values are those of rows `first_row`, `first_row + stride`, ... (`start` is `null` for non-column values).
+    """
+    window = (window or OutputWindow()).unpaginated()
+    job, pushed_down = await read_output_document(db_connector, job_id, window)
+    if job is None:
+        return None
+
+    async def lines() -> AsyncIterator[bytes]:
+        metadata = {field: job.get(field) for field in OUTPUT_METADATA_FIELDS}
+        yield ndjson_line(metadata)
+        async for path, first_row, values in iter_columns(job.get("results", {}), window, results_store, pushed_down, rows_per_line):
+            yield ndjson_line({"path": path, "start": first_row, "values": values})
+
+    return lines()
+
+
+async def iter_columns(
+        results: Any,
+        window: OutputWindow,
+        results_store: ResultsStore,
+        pushed_down: bool,
+        rows_per_line: int,
+        path: List[str] = None
+) -> AsyncIterator[Tuple[List[str], Optional[int], Any]]:
+    """Yield `(path, first_row, values)` for blocks of at most `rows_per_line` rows of each column in `results`."""
+    path = path or []
+    row_start, row_stop = window.rows()
+    if ResultsStore.is_stored(results):
+        for key, value in ResultsStore.attributes(results).items():
+            yield path + [key], None, value
+        async for first_row, arrays in results_store.iter_chunks(
+                results, names=window.species, start=row_start, stop=row_stop, step=window.stride):
+            for name, array in arrays.items():
+                for offset in range(0, len(array), rows_per_line):
+                    block = arrays_to_json({name: array[offset:offset + rows_per_line]})[name]
+                    yield path + [name], first_row + offset * window.stride, block
+    elif isinstance(results, dict):
+        for key, value in results.items():
+            if key in OUTPUT_ATTRIBUTE_KEYS:
+                yield path + [key], None, value
+            elif isinstance(value, (list, np.ndarray)):
+                if window.species and key not in window.species:
+                    continue
+                first_row = row_start
+                rows = value[::window.stride] if pushed_down else value[row_start:row_stop:window.stride]
+                for offset in range(0, len(rows), rows_per_line):
+                    yield path + [key], first_row + offset * window.stride, list(rows[offset:offset + rows_per_line])
+            else:
+                async for column in iter_columns(value, window, results_store, pushed_down, rows_per_line, path + [key]):
+                    yield column
+    else:
+        yield path, None, results
+
+
+def ndjson_line(obj: Any) -> bytes:
+    return (json.dumps(obj) + "\n").encode()
@@ -1,19 +1,75 @@
 import importlib
+import os
 import uuid
 from logging import Logger
 from typing import *
 
-from fastapi import UploadFile, HTTPException
-from process_bigraph import Composite
+from fastapi import UploadFile, HTTPException, Query
 
-from shared.data_model import UtcRun, AmiciRun, CobraRun, CopasiRun, TelluriumRun, ValidatedComposition, Mem3dgRun
+from shared.data_model import UtcRun, AmiciRun, CobraRun, CopasiRun, TelluriumRun, ValidatedComposition, Mem3dgRun, JobPriorities
 from shared.database import DatabaseConnector
 from shared.environment import DEFAULT_JOB_COLLECTION_NAME, DEFAULT_BUCKET_NAME
-from shared.io import write_uploaded_file
+from shared.io import write_uploaded_file, hash_uploaded_file
+from shared.results_cache import job_fingerprint
 
 from gateway.handlers.states import generate_mem3dg_state
 
 
+def match_model_files(spec: Mapping[str, Any], model_files: List[UploadFile]) -> Tuple[List[str], List[Tuple[UploadFile, str]]]:
+    """Nodes of composition `spec` whose model source is one of `model_files` (matched by filename), with that file and
+        the extension of the source.
+    """
+    nodes = []
+    files = []
+    for node_name, node_spec in spec.items():
+        spec_model_source = (node_spec.get("config") or {}).get("model", {}).get("model_source")
+        if not spec_model_source:
+            continue
+        for model_file in model_files:
+            if spec_model_source.split('/')[-1] == model_file.filename:
+                nodes.append(node_name)
+                files.append((model_file, os.path.splitext(spec_model_source)[-1]))
+    return nodes, files
+
+
+# -- scheduling --
+
+def scheduling_fields(
+        priority: str = Query(default="normal", description="Priority class of the job: high, normal or low. Jobs waiting long enough are raised to the next class."),
+        submitter: Optional[str] = Query(default=None, description="Submitter of the job (ie: a user or project), between whom the workers share their capacity."),
+) -> Dict[str, Any]:
+    """Scheduling fields of a submission (see `worker.scheduler`), as a FastAPI dependency of the submission endpoints.
+        The job's queue is derived from its type when it is written.
+    """
+    rank = JobPriorities.NAMES.get(priority.lower())
+    if rank is None:
+        raise HTTPException(status_code=400, detail=f"Priority must be one of {', '.join(JobPriorities.NAMES)}.")
+    fields = {"priority": rank}
+    if submitter:
+        fields["submitter"] = submitter
+    return fields
+
+
+# -- memoization --
+
+async def find_cached_results(db_connector: DatabaseConnector, fingerprint: Optional[str]) -> Optional[Mapping[str, Any]]:
+    """Results-cache entry of a submission with `fingerprint` (see `shared.results_cache.job_fingerprint`), if any."""
+    if fingerprint is None:
+        return None
+    return await db_connector.find_cached_results(fingerprint)
+
+
+def memoized_fields(fingerprint: Optional[str], versions: Dict[str, Any], cached: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """Fields of a new job document recording its fingerprint and, if `cached`, answering it from the cache: COMPLETE,
+        sharing the cached results and pointing at the inputs of the job that computed them.
+    """
+    fields = {"fingerprint": fingerprint, "versions": versions}
+    if cached is not None:
+        fields.update(cached.get("inputs", {}))
+        fields.update(status="COMPLETE", results=cached["results"], cached_from=cached["job_id"])
+    return fields
+
+
 async def submit_pymem3dg_run(
         db_connector: DatabaseConnector,
         job_id: str,
@@ -31,8 +87,13 @@ async def submit_pymem3dg_run(
         geometry_type: Optional[str] = None,
         geometry_parameters: Optional[Dict[str, Union[float, int]]] = None,
         mesh_file: Optional[str] = None,
+        job_fields: Optional[Dict[str, Any]] = None,
 ):
-    input_state = generate_mem3dg_state(
+    """`job_fields` are additional fields of the job document (see `memoized_fields`): a cached `spec` replaces the
+        generated one.
+    """
+    job_fields = dict(job_fields or {})
+    input_state = job_fields.pop("spec", None) or generate_mem3dg_state(
         characteristic_time_step=characteristic_time_step,
         tension_modulus=tension_modulus,
         preferred_area=preferred_area,
@@ -51,7 +112,7 @@ async def submit_pymem3dg_run(
     mem3dg_job = Mem3dgRun(
         job_id=job_id,
         last_updated=db_connector.timestamp(),
-        status="PENDING",
+        status=job_fields.pop("status", "PENDING"),
         simulators=["pymem3dg"],
         duration=duration,
         spec=input_state
@@ -60,7 +121,7 @@ async def submit_pymem3dg_run(
     # save job to db
     await db_connector.write(
         collection_name=DEFAULT_JOB_COLLECTION_NAME,
-        **mem3dg_job.serialize()
+        **{**mem3dg_job.serialize(), **job_fields}
     )
 
     return mem3dg_job
@@ -75,6 +136,8 @@ async def submit_utc_run(
         stop: int,
         steps: int,
         logger: Logger,
+        context_model: Type[UtcRun] = None,
+        scheduling: Mapping[str, Any] = None,
         **params
 ) -> AmiciRun | CobraRun | CopasiRun | TelluriumRun:
     """
@@ -86,6 +149,11 @@ async def submit_utc_run(
     :param stop: simulation stop time
     :param steps: simulation steps
     :param logger: logger from current __file__
+    :param context_model: run data model returned; defaults to the one named after `simulator`
+    :param scheduling: scheduling fields of the job (see `scheduling_fields`)
+
+    Identical submissions (same model contents, time course and simulator version) are answered from the results
+    cache: the returned run is then already COMPLETE.
     """
     try:
         # parse process or step and simulator for correct path routing
@@ -93,25 +161,34 @@ async def submit_utc_run(
             implementation_scope += "rocess" if "p" in implementation_scope else "tep"
         job_id = f"run-{simulator}-{implementation_scope}-" + str(uuid.uuid4())
 
-        # upload model file to bucket
-        remote_model_path = await write_uploaded_file(
-            job_id=job_id,
-            uploaded_file=model_file,
-            bucket_name=DEFAULT_BUCKET_NAME,
-            extension='.xml'
-        )
+        # look for the results of an identical run
+        inputs = {"model": await hash_uploaded_file(model_file), "start": start, "stop": stop, "steps": steps, "params": params}
+        fingerprint, versions = job_fingerprint("utc", inputs, simulators=[simulator])
+        cached = await find_cached_results(db_connector, fingerprint)
+        job_fields = memoized_fields(fingerprint, versions, cached)
+
+        # upload model file to bucket, unless answered from the cache
+        remote_model_path = job_fields.pop("model_file", None)
+        if remote_model_path is None:
+            remote_model_path = await write_uploaded_file(
+                job_id=job_id,
+                uploaded_file=model_file,
+                bucket_name=DEFAULT_BUCKET_NAME,
+                extension='.xml'
+            )
 
         # fit/validate data to return structure
-        data_models = importlib.import_module("shared.data_model")
-        ContextModel = getattr(
-            data_models,
-            simulator.replace(simulator[0], simulator[0].upper())
-        )
-
-        run_data: AmiciRun | CobraRun | CopasiRun | TelluriumRun = ContextModel(
+        if context_model is None:
+            data_models = importlib.import_module("shared.data_model")
+            context_model = getattr(
+                data_models,
+                simulator.replace(simulator[0], simulator[0].upper()) + "Run"
+            )
+
+        run_data: AmiciRun | CobraRun | CopasiRun | TelluriumRun = context_model(
             job_id=job_id,
             last_updated=db_connector.timestamp(),
-            status="PENDING",
+            status=job_fields.pop("status", "PENDING"),
             simulator=simulator,
             model_file=remote_model_path,
             start=start,
@@ -123,7 +200,9 @@ async def submit_utc_run(
         # save job to db
         await db_connector.write(
             collection_name=DEFAULT_JOB_COLLECTION_NAME,
-            **run_data.serialize()
+            **run_data.serialize(),
+            **job_fields,
+            **(scheduling or {})
         )
 
         return run_data
@@ -0,0 +1,115 @@
+"""
+Submission of parameter sweeps of SBML uniform time courses.
+
+A sweep is one job: the model is uploaded once, the parameter sets (given as a grid, which is expanded here, or as an
+explicit sample matrix) are stored in binary form by the `ResultsStore` rather than as BSON lists in the job document,
+and the worker runs all of them with the sweep engine in `worker.sim_runs.sweep`.
+"""
+import json
+import uuid
+from typing import *
+
+import numpy as np
+from fastapi import HTTPException, UploadFile
+
+from shared.data_model import SweepRun
+from shared.database import DatabaseConnector
+from shared.environment import DEFAULT_JOB_COLLECTION_NAME, DEFAULT_BUCKET_NAME, DEFAULT_MAX_SWEEP_SAMPLES
+from shared.io import write_uploaded_file
+from shared.results_store import ResultsStore
+
+
+# simulators that the worker's sweep engine can run
+UTC_SWEEP_SIMULATORS = ("amici", "copasi", "tellurium")
+
+
+def parameter_grid(grid: Mapping[str, Sequence[float]]) -> Tuple[List[str], np.ndarray]:
+    """Names of the parameters of `grid` (`{name: values}`) and the `(n_samples, n_parameters)` matrix of every
+        combination of their values, the last parameter varying fastest.
+    """
+    parameters = list(grid.keys())
+    axes = np.meshgrid(*[np.asarray(grid[name], dtype=float) for name in parameters], indexing="ij")
+    return parameters, np.stack([axis.ravel() for axis in axes], axis=-1)
+
+
+def parse_sweep(contents: bytes, max_samples: int = DEFAULT_MAX_SWEEP_SAMPLES) -> Tuple[List[str], np.ndarray]:
+    """Parse a JSON sweep: either `{"grid": {name: [values]}}` or `{"parameters": [names], "samples": [[values]]}`
+        with one row of values (one per parameter) per sample.
+
+        Returns:
+            The parameter names and the `(n_samples, n_parameters)` sample matrix.
+
+        Raises:
+            HTTPException(400) if the sweep is malformed or has more than `max_samples` samples.
+    """
+    try:
+        sweep = json.loads(contents)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON format.")
+    if not isinstance(sweep, dict) or ("grid" in sweep) == ("samples" in sweep):
+        raise HTTPException(status_code=400, detail='A sweep is an object with either a "grid" or "parameters" and "samples".')
+
+    try:
+        if "grid" in sweep:
+            grid = sweep["grid"]
+            if not isinstance(grid, dict) or not grid or not all(isinstance(values, list) and values for values in grid.values()):
+                raise ValueError('"grid" must map each parameter to a non-empty list of values.')
+            n_samples = int(np.prod([len(values) for values in grid.values()]))
+            if n_samples > max_samples:
+                raise ValueError(f"A sweep has at most {max_samples} samples, the grid has {n_samples}.")
+            parameters, samples = parameter_grid(grid)
+        else:
+            parameters = sweep.get("parameters")
+            if not isinstance(parameters, list) or not parameters or not all(isinstance(name, str) for name in parameters):
+                raise ValueError('"parameters" must be a non-empty list of parameter names.')
+            samples = np.asarray(sweep["samples"], dtype=float)
+            if samples.ndim != 2 or samples.shape[0] == 0 or samples.shape[1] != len(parameters):
+                raise ValueError('"samples" must be a non-empty list of rows with one value per parameter.')
+            if samples.shape[0] > max_samples:
+                raise ValueError(f"A sweep has at most {max_samples} samples, got {samples.shape[0]}.")
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(set(parameters)) != len(parameters):
+        raise HTTPException(status_code=400, detail="Parameter names must be unique.")
+    if not np.all(np.isfinite(samples)):
+        raise HTTPException(status_code=400, detail="Parameter values must be finite numbers.")
+    return parameters, samples
+
+
+async def submit_utc_sweep(
+        db_connector: DatabaseConnector,
+        results_store: ResultsStore,
+        simulator: str,
+        model_file: UploadFile,
+        start: int,
+        stop: int,
+        steps: int,
+        parameters: List[str],
+        samples: np.ndarray,
+        scheduling: Mapping[str, Any] = None
+) -> SweepRun:
+    """Submit a uniform time course of `model_file` with `simulator` for each row of `samples` (values of
+        `parameters`), run by the worker as a single job with the `scheduling` fields of the submission.
+    """
+    simulator = simulator.lower()
+    if simulator not in UTC_SWEEP_SIMULATORS:
+        raise HTTPException(status_code=400, detail=f"Simulator must be one of {', '.join(UTC_SWEEP_SIMULATORS)}.")
+
+    job_id = f"run-{simulator}-sweep-" + str(uuid.uuid4())
+    model_location = await write_uploaded_file(job_id=job_id, uploaded_file=model_file, bucket_name=DEFAULT_BUCKET_NAME, extension='.xml')
+    stored_samples = await results_store.write(job_id, {"samples": samples}, key="samples")
+    run_data = SweepRun(
+        job_id=job_id,
+        last_updated=db_connector.timestamp(),
+        status="PENDING",
+        simulator=simulator,
+        model_file=model_location,
+        start=start,
+        stop=stop,
+        steps=steps,
+        parameters=parameters,
+        n_samples=len(samples)
+    )
+    await db_connector.write(collection_name=DEFAULT_JOB_COLLECTION_NAME, **run_data.serialize(), samples=stored_samples, **(scheduling or {}))
+    return run_data
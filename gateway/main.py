@@ -4,6 +4,7 @@ Server gateway implementation.
 Author: Alexander Patrie <@AlexPatrie>
 """
 
+import asyncio
 import json
 import os
 import uuid
@@ -13,21 +14,26 @@ from typing import *
 
 import dotenv
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, APIRouter, Body
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, APIRouter, Body, Header, Depends
 from process_bigraph import Process, pp, Composite
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import FileResponse
+from starlette.responses import StreamingResponse
 from pydantic import BeforeValidator
+from pymongo.errors import PyMongoError
 
-from shared.database import MongoConnector
-from shared.io import write_uploaded_file, download_file_from_bucket
+from shared.database import AsyncMongoConnector
+from shared.io import write_uploaded_file, hash_uploaded_file, close_file_services
+from shared.results_cache import job_fingerprint, composition_simulators
 from shared.log_config import setup_logging
+from shared.results_store import ResultsStore
 from shared.utils import get_project_version, new_job_id, handle_exception, serialize_numpy, clean_temp_files
 from shared.environment import (
     ENV_PATH,
     DEFAULT_DB_NAME,
     DEFAULT_JOB_COLLECTION_NAME,
-    DEFAULT_BUCKET_NAME
+    DEFAULT_BUCKET_NAME,
+    DEFAULT_RESULT_STATES_COLLECTION_NAME,
+    DEFAULT_MAX_REPLICATES
 )
 from shared.data_model import (
     BigraphRegistryAddresses,
@@ -51,10 +57,25 @@ from shared.data_model import (
     HealthCheckResponse,
     ProcessMetadata,
     Mem3dgRun,
-    BigraphSchemaType
+    BigraphSchemaType,
+    BatchRun,
+    BatchStatus,
+    SweepRun
 )
-from gateway.handlers.submit import submit_utc_run, check_composition, submit_pymem3dg_run
+from gateway.handlers.submit import (
+    submit_utc_run,
+    check_composition,
+    submit_pymem3dg_run,
+    find_cached_results,
+    memoized_fields,
+    match_model_files,
+    scheduling_fields
+)
+from gateway.handlers.batch import parse_overrides, submit_composition_batch, submit_utc_batch, get_batch_status
+from gateway.handlers.sweep import parse_sweep, submit_utc_sweep
+from gateway.handlers.files import output_file_response
 from gateway.handlers.health import check_client
+from gateway.handlers.output import OutputWindow, get_job_output, stream_job_output, NDJSON_MEDIA_TYPE
 
 
 logger = setup_logging(__file__)
@@ -93,7 +114,8 @@ APP_ORIGINS = [
     'https://compose.biosimulations.org'
 ]
 
-db_conn_gateway = MongoConnector(connection_uri=MONGO_URI, database_id=DEFAULT_DB_NAME)
+db_conn_gateway = AsyncMongoConnector(connection_uri=MONGO_URI, database_id=DEFAULT_DB_NAME)
+results_store = ResultsStore(bucket_name=DEFAULT_BUCKET_NAME)
 router = APIRouter()
 app = FastAPI(title=APP_TITLE, version=APP_VERSION, servers=APP_SERVERS)
 app.add_middleware(
@@ -108,6 +130,20 @@ app.mongo_client = db_conn_gateway.client
 PyObjectId = Annotated[str, BeforeValidator(str)]
 
 
+@app.on_event("startup")
+async def ensure_database_indexes():
+    try:
+        await db_conn_gateway.ensure_indexes()
+    except PyMongoError as e:
+        logger.error(f"Could not create database indexes: {e}")
+
+
+@app.on_event("shutdown")
+async def close_storage_clients():
+    await close_file_services()
+    await db_conn_gateway.close()
+
+
 # -- Composition: submit composition jobs --
 
 @app.post(
@@ -277,6 +313,7 @@ async def submit_composition(
         # simulators: List[str] = Query(..., description="Simulator package names to use for implementation"),
         duration: int = Query(..., description="Duration of simulation"),
         model_files: List[UploadFile] = File(..., description="List of uploaded model files"),
+        scheduling: Dict[str, Any] = Depends(scheduling_fields),
 ) -> CompositionRun:
     # validate filetype
     if not spec_file.filename.endswith('.json') and spec_file.content_type != 'application/json':
@@ -289,54 +326,62 @@ async def submit_composition(
         data: Dict = json.loads(contents)
 
         simulators: List[str] = []
-        for node_name, node_spec in data.items():
-            # parse list of simulators required from spec addresses
-
-            address = node_spec['address']  # MUST be like: local:copasi-process
-            # if "emitter" not in address:
-            #     simulator = address.split(":")[-1].split('-')[0]
-            #     simulators.append(simulator)
-
-            # upload model files as needed (model filepath MUST match that which is in the spec-->./model-file
-            for model_file in model_files:
-                spec_model_source = node_spec.get("config").get("model", {}).get("model_source")
-                if spec_model_source:
-                    if (spec_model_source.split('/')[-1] == model_file.filename):
-                        file_ext = os.path.splitext(spec_model_source)[-1]
-                        uploaded_model_source_location = await write_uploaded_file(
-                            job_id=job_id,
-                            uploaded_file=model_file,
-                            bucket_name=DEFAULT_BUCKET_NAME,
-                            extension=file_ext
-                        )
-                        data[node_name]["config"]["model"]["model_source"] = uploaded_model_source_location
-
-        # 1a. verification by fitting the individual process specs to an expected structure
-        nodes: List[CompositionNode] = []
-        for node_name, node_spec in data.items():
-            node = CompositionNode(name=node_name, **node_spec)
-            nodes.append(node)
-
-        # 1b. verification by fitting that tree of nodes into an expected structure (which is consumed by pbg.Composite())
-        composition = CompositionSpec(
-            nodes=nodes,
-            emitter_mode="all",
-            job_id=job_id
-        )
+        # model files to upload (model filepath MUST match that which is in the spec-->./model-file)
+        uploading_nodes, uploading_files = match_model_files(data, model_files)
+
+        # look for the results of an identical composition: same spec, model contents and duration
+        model_hashes = {}
+        for node_name, (model_file, _) in zip(uploading_nodes, uploading_files):
+            model_hashes[node_name] = await hash_uploaded_file(model_file)
+        inputs = {"spec": data, "models": model_hashes, "duration": duration}
+        fingerprint, versions = job_fingerprint("composition", inputs, simulators=composition_simulators(data))
+        cached = await find_cached_results(db_conn_gateway, fingerprint)
+        job_fields = memoized_fields(fingerprint, versions, cached)
+
+        if cached is None:
+            # transfer all model files concurrently
+            uploaded_model_source_locations = await asyncio.gather(*[
+                write_uploaded_file(job_id=job_id, uploaded_file=model_file, bucket_name=DEFAULT_BUCKET_NAME, extension=file_ext)
+                for model_file, file_ext in uploading_files
+            ])
+            for node_name, uploaded_model_source_location in zip(uploading_nodes, uploaded_model_source_locations):
+                data[node_name]["config"]["model"]["model_source"] = uploaded_model_source_location
+
+            # 1a. verification by fitting the individual process specs to an expected structure
+            nodes: List[CompositionNode] = []
+            for node_name, node_spec in data.items():
+                node = CompositionNode(name=node_name, **node_spec)
+                nodes.append(node)
+
+            # 1b. verification by fitting that tree of nodes into an expected structure (which is consumed by pbg.Composite())
+            composition = CompositionSpec(
+                nodes=nodes,
+                emitter_mode="all",
+                job_id=job_id
+            )
+            job_fields["spec"] = composition.spec
 
         # 2. verification by fitting write confirmation into CompositionRun...to verify O phase of IO, garbage in garbage out
+        job_fields.setdefault("status", "PENDING")
+        job_fields.setdefault("results", {})
         write_confirmation: Dict = await db_conn_gateway.write(
             collection_name=DEFAULT_JOB_COLLECTION_NAME,
-            status="PENDING",
-            spec=composition.spec,
-            job_id=composition.job_id,
+            job_id=job_id,
             last_updated=db_conn_gateway.timestamp(),
             simulators=simulators,
             duration=duration,
-            results={}
+            **job_fields,
+            **scheduling
         )
 
-        return CompositionRun(**write_confirmation)
+        return CompositionRun(
+            job_id=write_confirmation["job_id"],
+            last_updated=write_confirmation["last_updated"],
+            status=write_confirmation["status"],
+            simulators=write_confirmation["simulators"],
+            duration=write_confirmation["duration"],
+            spec=write_confirmation["spec"]
+        )
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON format.")
     except Exception as e:
@@ -352,7 +397,12 @@ async def submit_composition(
     summary="Get the composite spec of a given simulation run indexed by job_id.")
 async def get_composition_state(job_id: str):
     try:
-        spec = await db_conn_gateway.read(collection_name="result_states", job_id=job_id)
+        spec = await db_conn_gateway.read(collection_name=DEFAULT_RESULT_STATES_COLLECTION_NAME, job_id=job_id)
+        if spec is None:
+            # jobs answered from the results cache share the state of the job that computed their results
+            job = await db_conn_gateway.get_job_status(job_id)
+            if job is not None and job.get("cached_from"):
+                spec = await db_conn_gateway.read(collection_name=DEFAULT_RESULT_STATES_COLLECTION_NAME, job_id=job["cached_from"])
         if spec is None:
             raise HTTPException(status_code=404, detail="Could not find result state.")
         else:
@@ -366,6 +416,105 @@ async def get_composition_state(job_id: str):
         raise HTTPException(status_code=400, detail=message)
 
 
+# -- Batch: submit parameter studies --
+
+@app.post(
+    "/submit-composition-batch",
+    response_model=BatchRun,
+    tags=["Batch"],
+    operation_id="submit-composition-batch",
+    summary="Submit one composition job per variant of a composition spec",
+)
+async def submit_composition_batch_run(
+        spec_file: UploadFile = File(..., description="Base composition JSON File"),
+        overrides_file: UploadFile = File(..., description="JSON list of overrides, one per variant, each merged into the base spec. A `duration` key overrides the duration."),
+        duration: int = Query(..., description="Duration of simulation"),
+        model_files: List[UploadFile] = File(..., description="List of uploaded model files, shared by all variants"),
+        scheduling: Dict[str, Any] = Depends(scheduling_fields),
+) -> BatchRun:
+    if not spec_file.filename.endswith('.json') and spec_file.content_type != 'application/json':
+        raise HTTPException(status_code=400, detail="Invalid file type. Only JSON files are supported.")
+    overrides = parse_overrides(await overrides_file.read())
+    try:
+        spec: Dict = json.loads(await spec_file.read())
+        return await submit_composition_batch(db_conn_gateway, spec, model_files, duration, overrides, scheduling)
+    except HTTPException:
+        raise
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON format.")
+    except Exception as e:
+        message = handle_exception("submit-composition-batch") + f'-{str(e)}'
+        logger.error(message)
+        raise HTTPException(status_code=400, detail=message)
+
+
+@app.post(
+    "/run-utc-batch",
+    response_model=BatchRun,
+    tags=["Batch"],
+    operation_id="run-utc-batch",
+    summary="Submit one uniform time course per variant of the time course parameters of a model",
+)
+async def run_utc_batch(
+        simulator: str = Query(..., description="Simulator: one of amici, copasi or tellurium."),
+        model_file: UploadFile = File(..., description="SBML file, shared by all variants"),
+        overrides_file: UploadFile = File(..., description="JSON list of overrides of start, stop and/or steps, one per variant."),
+        start: int = Query(..., description="Start time"),
+        stop: int = Query(..., description="End time(duration)"),
+        steps: int = Query(..., description="Number of steps."),
+        scheduling: Dict[str, Any] = Depends(scheduling_fields),
+) -> BatchRun:
+    overrides = parse_overrides(await overrides_file.read())
+    try:
+        return await submit_utc_batch(db_conn_gateway, simulator, model_file, start, stop, steps, overrides, scheduling)
+    except HTTPException:
+        raise
+    except Exception as e:
+        message = handle_exception("run-utc-batch") + f'-{str(e)}'
+        logger.error(message)
+        raise HTTPException(status_code=500, detail=message)
+
+
+@app.get(
+    "/get-batch-status/{batch_id}",
+    response_model=BatchStatus,
+    operation_id='get-batch-status',
+    tags=["Batch"],
+    summary='Get the aggregate status of the jobs of a batch.')
+async def get_batch_status_run(batch_id: str) -> BatchStatus:
+    status = await get_batch_status(db_conn_gateway, batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Batch with id: {batch_id} not found.")
+    return status
+
+
+@app.post(
+    "/run-utc-sweep",
+    response_model=SweepRun,
+    tags=["Batch"],
+    operation_id="run-utc-sweep",
+    summary="Run a uniform time course of a model for each parameter set of a grid or sample matrix, as a single job",
+)
+async def run_utc_sweep(
+        simulator: str = Query(..., description="Simulator: one of amici, copasi or tellurium."),
+        model_file: UploadFile = File(..., description="SBML file"),
+        sweep_file: UploadFile = File(..., description='JSON sweep: {"grid": {parameter: [values]}} or {"parameters": [names], "samples": [[values]]}.'),
+        start: int = Query(..., description="Start time"),
+        stop: int = Query(..., description="End time(duration)"),
+        steps: int = Query(..., description="Number of steps."),
+        scheduling: Dict[str, Any] = Depends(scheduling_fields),
+) -> SweepRun:
+    parameters, samples = parse_sweep(await sweep_file.read())
+    try:
+        return await submit_utc_sweep(db_conn_gateway, results_store, simulator, model_file, start, stop, steps, parameters, samples, scheduling)
+    except HTTPException:
+        raise
+    except Exception as e:
+        message = handle_exception("run-utc-sweep") + f'-{str(e)}'
+        logger.error(message)
+        raise HTTPException(status_code=500, detail=message)
+
+
 # -- Data: output data --
 
 @app.get(
@@ -374,19 +523,26 @@ async def get_composition_state(job_id: str):
     operation_id='get-output',
     tags=["Data"],
     summary='Get the results of an existing simulation run.')
-async def get_output(job_id: str):
-    # get the job
-    job = await db_conn_gateway.read(collection_name=DEFAULT_JOB_COLLECTION_NAME, job_id=job_id)
-
-    # parse id and return if job exist
-    if job is not None:
-        not_included = ["_id", "spec", "duration", "simulators"]
-        data = {}
-        for key in job.keys():
-            if key not in not_included:
-                data[key] = job[key]
-
-        return OutputData(**data)
+async def get_output(
+        job_id: str,
+        species: List[str] = Query(default=None, description="Only return the results of these species (observables)."),
+        start: int = Query(default=0, ge=0, description="First step (time point index) to return."),
+        stop: Optional[int] = Query(default=None, ge=0, description="Step at which to stop (exclusive)."),
+        stride: int = Query(default=1, ge=1, description="Return every `stride`-th step."),
+        cursor: int = Query(default=0, ge=0, description="Page to start from, as returned in `next_cursor`."),
+        limit: Optional[int] = Query(default=None, ge=1, description="Maximum number of steps per page."),
+        stream: bool = Query(default=False, description="Stream the results as newline-delimited JSON, one line per species and block of steps."),
+):
+    window = OutputWindow(species=species, start=start, stop=stop, stride=stride, cursor=cursor, limit=limit)
+    if stream:
+        lines = await stream_job_output(db_conn_gateway, results_store, job_id, window)
+        output = StreamingResponse(lines, media_type=NDJSON_MEDIA_TYPE) if lines is not None else None
+    else:
+        output = await get_job_output(db_conn_gateway, results_store, job_id, window)
+
+    # return if job exists
+    if output is not None:
+        return output
     else:
         # otherwise, job does not exists
         msg = f"Job with id: {job_id} not found. Please check the job_id and try again."
@@ -400,49 +556,34 @@ async def get_output(job_id: str):
     tags=["Data"],
     summary='Get the results of an existing simulation run from Smoldyn or Readdy as either a downloadable file or job progression status.'
 )
-async def get_output_file(job_id: str):
-    # state-case: job is completed
+async def get_output_file(job_id: str, range_header: Optional[str] = Header(default=None, alias="Range")):
     if not job_id.startswith("simulation-execution"):
         raise HTTPException(status_code=404, detail="This must be an output file job query starting with 'simulation-execution'.")
-    job = await db_conn_gateway.read(collection_name="completed_jobs", job_id=job_id)
-    if job is not None:
-        # rm mongo index
-        job.pop('_id', None)
-        # parse filepath in bucket and create file response
-        job_data = job
-        if isinstance(job_data, dict):
-            remote_fp = job_data.get("results").get("results_file")
-            if remote_fp is not None:
-                temp_dest = mkdtemp()
-                local_fp = download_file_from_bucket(source_blob_path=remote_fp, out_dir=temp_dest, bucket_name=DEFAULT_BUCKET_NAME)
-                # return downloadable file blob
-                return FileResponse(path=local_fp, media_type="application/octet-stream", filename=local_fp.split("/")[-1])  # TODO: return special smoldyn file instance
-    # state-case: job has failed
-    if job is None:
-        job = await db_conn_gateway.read(collection_name="failed_jobs", job_id=job_id)
-    # state-case: job is not in completed:
-    if job is None:
-        job = await db_conn_gateway.read(collection_name="in_progress_jobs", job_id=job_id)
-    # state-case: job is not in progress:
+
+    # one round trip, whatever state the job is in
+    job = await db_conn_gateway.get_job_status(job_id)
     if job is None:
-        job = await db_conn_gateway.read(collection_name="pending_jobs", job_id=job_id)
-    # case: job is either failed, in prog, or pending
-    if job is not None:
-        # rm mongo index
-        job.pop('_id', None)
-        # specify source safely
-        src = job.get('source', job.get('path'))
-        if src is not None:
-            source = src.split('/')[-1]
-        else:
-            source = None
+        msg = f"Job with id: {job_id} not found. Please check the job_id and try again."
+        logger.error(msg)
+        raise HTTPException(status_code=404, detail=msg)
 
-        return IncompleteFileJob(
-            job_id=job_id,
-            timestamp=job.get('timestamp'),
-            status=job.get('status'),
-            source=source
-        )
+    # state-case: job is completed
+    if job.get('status') == "COMPLETE":
+        remote_fp = job.get('results', {}).get('results_file')
+        if remote_fp is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} has no output file. Its results are available from /get-output.")
+        # stream downloadable file blob straight from the bucket (or the local cache)
+        return await output_file_response(DEFAULT_BUCKET_NAME, remote_fp, range_header)  # TODO: return special smoldyn file instance
+
+    # case: job is either failed, in prog, or pending
+    src = job.get('source', job.get('path'))
+    source = src.split('/')[-1] if src is not None else None
+    return IncompleteFileJob(
+        job_id=job_id,
+        timestamp=job.get('timestamp', job.get('last_updated')),
+        status=job.get('status'),
+        source=source
+    )
 
 
 # -- Files: submit file IO jobs --
@@ -504,8 +645,8 @@ async def generate_simularium_file(
     summary="Health check",
     response_model=HealthCheckResponse,
 )
-def check_health() -> HealthCheckResponse:
-    response = check_client(db_conn_gateway)
+async def check_health() -> HealthCheckResponse:
+    response = await check_client(db_conn_gateway)
     return HealthCheckResponse(
         version=APP_VERSION,
         status="running" if response.status == "PASS" else response
@@ -538,23 +679,43 @@ async def run_mem3dg_process(
         # geometry_type: Optional[str] = None,
         # geometry_parameters: Optional[Dict[str, Union[float, int]]] = None,
         mesh_file: UploadFile = File(...),
+        scheduling: Dict[str, Any] = Depends(scheduling_fields),
 )-> Mem3dgRun:
     from bsp import app_registrar
 
     try:
         job_id = 'run-mem3dg-' + str(uuid.uuid4())
-        uploaded_file_location = await write_uploaded_file(
-            job_id=job_id,
-            uploaded_file=mesh_file,
-            bucket_name=DEFAULT_BUCKET_NAME,
-            extension='.ply'
-        )
-
         parameters = {
             "bending": {
                 "Kbc": bending_kbc,
             }
         }
+
+        # look for the results of an identical run
+        inputs = {
+            "mesh": await hash_uploaded_file(mesh_file),
+            "duration": duration,
+            "characteristic_time_step": characteristic_time_step,
+            "tension_modulus": tension_modulus,
+            "preferred_area": preferred_area,
+            "preferred_volume": preferred_volume,
+            "reservoir_volume": reservoir_volume,
+            "osmotic_strength": osmotic_strength,
+            "volume": volume,
+            "damping": damping,
+            "tolerance": tolerance,
+            "parameters": parameters,
+        }
+        fingerprint, versions = job_fingerprint("mem3dg", inputs, simulators=["pymem3dg"])
+        cached = await find_cached_results(db_conn_gateway, fingerprint)
+        uploaded_file_location = None
+        if cached is None:
+            uploaded_file_location = await write_uploaded_file(
+                job_id=job_id,
+                uploaded_file=mesh_file,
+                bucket_name=DEFAULT_BUCKET_NAME,
+                extension='.ply'
+            )
         mem3dg_run = await submit_pymem3dg_run(
             job_id=job_id,
             db_connector=db_conn_gateway,
@@ -569,7 +730,8 @@ async def run_mem3dg_process(
             tolerance=tolerance,
             mesh_file=uploaded_file_location,
             parameters_config=parameters,
-            duration=duration
+            duration=duration,
+            job_fields={**memoized_fields(fingerprint, versions, cached), **scheduling}
         )
 
         from vivarium.vivarium import Vivarium
@@ -598,7 +760,8 @@ async def run_amici_process(
     model_file: UploadFile = File(..., description="SBML file"),
     start: int = Query(..., description="Start time"),
     stop: int = Query(..., description="End time(duration)"),
-    steps: int = Query(..., description="Number of steps.")
+    steps: int = Query(..., description="Number of steps."),
+    scheduling: Dict[str, Any] = Depends(scheduling_fields)
 ) -> AmiciRun:
     run_data = await submit_utc_run(
         db_connector=db_conn_gateway,
@@ -609,6 +772,7 @@ async def run_amici_process(
         stop=stop,
         steps=steps,
         context_model=AmiciRun,
+        scheduling=scheduling,
         logger=logger
     )
 
@@ -626,7 +790,8 @@ async def run_cobra_process(
     model_file: UploadFile = File(..., description="SBML file"),
     start: int = Query(..., description="Start time"),
     stop: int = Query(..., description="End time(duration)"),
-    steps: int = Query(..., description="Number of steps.")
+    steps: int = Query(..., description="Number of steps."),
+    scheduling: Dict[str, Any] = Depends(scheduling_fields)
 ) -> CobraRun:
     run_data = await submit_utc_run(
         db_connector=db_conn_gateway,
@@ -637,6 +802,7 @@ async def run_cobra_process(
         stop=stop,
         steps=steps,
         context_model=CobraRun,
+        scheduling=scheduling,
         logger=logger
     )
 
@@ -654,7 +820,8 @@ async def run_copasi_process(
     model_file: UploadFile = File(..., description="SBML file"),
     start: int = Query(..., description="Start time"),
     stop: int = Query(..., description="End time(duration)"),
-    steps: int = Query(..., description="Number of steps.")
+    steps: int = Query(..., description="Number of steps."),
+    scheduling: Dict[str, Any] = Depends(scheduling_fields)
 ) -> CopasiRun:
     run_data = await submit_utc_run(
         db_connector=db_conn_gateway,
@@ -665,6 +832,7 @@ async def run_copasi_process(
         stop=stop,
         steps=steps,
         context_model=CopasiRun,
+        scheduling=scheduling,
         logger=logger
     )
 
@@ -682,7 +850,8 @@ async def run_tellurium_process(
     model_file: UploadFile = File(..., description="SBML file"),
     start: int = Query(..., description="Start time"),
     stop: int = Query(..., description="End time(duration)"),
-    steps: int = Query(..., description="Number of steps.")
+    steps: int = Query(..., description="Number of steps."),
+    scheduling: Dict[str, Any] = Depends(scheduling_fields)
 ) -> TelluriumRun:
     run_data = await submit_utc_run(
         db_connector=db_conn_gateway,
@@ -693,6 +862,7 @@ async def run_tellurium_process(
         stop=stop,
         steps=steps,
         context_model=TelluriumRun,
+        scheduling=scheduling,
         logger=logger
     )
 
@@ -712,7 +882,8 @@ async def run_amici_step(
     model_file: UploadFile = File(..., description="SBML file"),
     start: int = Query(..., description="Start time"),
     stop: int = Query(..., description="End time(duration)"),
-    steps: int = Query(..., description="Number of steps.")
+    steps: int = Query(..., description="Number of steps."),
+    scheduling: Dict[str, Any] = Depends(scheduling_fields)
 ) -> AmiciRun:
     run_data = await submit_utc_run(
         db_connector=db_conn_gateway,
@@ -723,6 +894,7 @@ async def run_amici_step(
         stop=stop,
         steps=steps,
         context_model=AmiciRun,
+        scheduling=scheduling,
         logger=logger
     )
 
@@ -740,7 +912,8 @@ async def run_cobra_step(
     model_file: UploadFile = File(..., description="SBML file"),
     start: int = Query(..., description="Start time"),
     stop: int = Query(..., description="End time(duration)"),
-    steps: int = Query(..., description="Number of steps.")
+    steps: int = Query(..., description="Number of steps."),
+    scheduling: Dict[str, Any] = Depends(scheduling_fields)
 ) -> CobraRun:
     run_data = await submit_utc_run(
         db_connector=db_conn_gateway,
@@ -751,6 +924,7 @@ async def run_cobra_step(
         stop=stop,
         steps=steps,
         context_model=CobraRun,
+        scheduling=scheduling,
         logger=logger
     )
 
@@ -768,7 +942,8 @@ async def run_copasi_step(
     model_file: UploadFile = File(..., description="SBML file"),
     start: int = Query(..., description="Start time"),
     stop: int = Query(..., description="End time(duration)"),
-    steps: int = Query(..., description="Number of steps.")
+    steps: int = Query(..., description="Number of steps."),
+    scheduling: Dict[str, Any] = Depends(scheduling_fields)
 ) -> CopasiRun:
     run_data = await submit_utc_run(
         db_connector=db_conn_gateway,
@@ -779,6 +954,7 @@ async def run_copasi_step(
         stop=stop,
         steps=steps,
         context_model=CopasiRun,
+        scheduling=scheduling,
         logger=logger
     )
 
@@ -844,7 +1020,9 @@ async def run_readdy_step(
             ]
         ),
         unit_system_config: Dict[str, str] = Body({"length_unit": "micrometer", "time_unit": "second"}, description="Unit system configuration"),
-        reaction_handler: str = Query(default="UncontrolledApproximation", description="Reaction handler as per Readdy simulation documentation.")
+        reaction_handler: str = Query(default="UncontrolledApproximation", description="Reaction handler as per Readdy simulation documentation."),
+        replicates: int = Query(default=1, ge=1, le=DEFAULT_MAX_REPLICATES, description="Number of replicates. Above 1, the mean, variance and quantiles of the particle counts over the replicates are returned rather than a trajectory file."),
+        scheduling: Dict[str, Any] = Depends(scheduling_fields),
 ) -> ReaddyRun:
     try:
         # get job params
@@ -863,7 +1041,8 @@ async def run_readdy_step(
             reactions_config=reactions_config,
             particles_config=particles_config,
             unit_system_config={"length_unit": "micrometer", "time_unit": "second"},
-            reaction_handler="UncontrolledApproximation"
+            reaction_handler="UncontrolledApproximation",
+            replicates=replicates
         )
 
         # insert job
@@ -879,7 +1058,9 @@ async def run_readdy_step(
             reactions_config=[config.serialize() for config in readdy_run.reactions_config],
             particles_config=[config.serialize() for config in readdy_run.particles_config],
             unit_system_config=readdy_run.unit_system_config,
-            reaction_handler=readdy_run.reaction_handler
+            reaction_handler=readdy_run.reaction_handler,
+            replicates=readdy_run.replicates,
+            **scheduling
         )
 
         return readdy_run
@@ -899,31 +1080,49 @@ async def run_smoldyn_step(
         uploaded_file: UploadFile = File(..., description="Smoldyn Configuration File"),
         duration: int = Query(default=None, description="Simulation Duration"),
         dt: float = Query(default=None, description="Interval of step with which simulation runs"),
+        seed: Optional[int] = Query(default=None, description="Random seed of the simulation. Only seeded runs are answered from (and added to) the results cache."),
+        replicates: int = Query(default=1, ge=1, le=DEFAULT_MAX_REPLICATES, description="Number of replicates, seeded from `seed`. Above 1, the mean, variance and quantiles of the species counts over the replicates are returned rather than a trajectory."),
+        scheduling: Dict[str, Any] = Depends(scheduling_fields),
         # initial_molecule_state: List = Body(default=None, description="Mapping of species names to initial molecule conditions including counts and location.")
 ) -> SmoldynRun:
     try:
         # get job params
         job_id = "simulation-execution-smoldyn" + str(uuid.uuid4())
         _time = db_conn_gateway.timestamp()
-        uploaded_file_location = await write_uploaded_file(job_id=job_id, uploaded_file=uploaded_file, bucket_name=DEFAULT_BUCKET_NAME, extension='.txt')
+
+        # look for the results of an identical (seeded) run
+        inputs = {"model": await hash_uploaded_file(uploaded_file), "duration": duration, "dt": dt}
+        if replicates > 1:
+            inputs["replicates"] = replicates
+        fingerprint, versions = job_fingerprint("smoldyn", inputs, simulators=["smoldyn"], seed=seed)
+        cached = await find_cached_results(db_conn_gateway, fingerprint)
+        job_fields = memoized_fields(fingerprint, versions, cached)
+        uploaded_file_location = job_fields.pop("path", None)
+        if uploaded_file_location is None:
+            uploaded_file_location = await write_uploaded_file(job_id=job_id, uploaded_file=uploaded_file, bucket_name=DEFAULT_BUCKET_NAME, extension='.txt')
         # instantiate new return
         smoldyn_run = SmoldynRun(
             job_id=job_id,
             last_updated=_time,
-            status="PENDING",
+            status=job_fields.pop("status", "PENDING"),
             path=uploaded_file_location,
             duration=duration,
-            dt=dt
+            dt=dt,
+            replicates=replicates
         )
         # insert job
         pending_job = await db_conn_gateway.write(
-            collection_name="smoldyn_jobs",
+            collection_name=DEFAULT_JOB_COLLECTION_NAME,
             job_id=smoldyn_run.job_id,
             last_updated=smoldyn_run.last_updated,
             status=smoldyn_run.status,
             path=smoldyn_run.path,
             duration=smoldyn_run.duration,
-            dt=smoldyn_run.dt
+            dt=smoldyn_run.dt,
+            seed=seed,
+            replicates=smoldyn_run.replicates,
+            **job_fields,
+            **scheduling
         )
 
         return smoldyn_run
@@ -943,7 +1142,8 @@ async def run_tellurium_step(
     model_file: UploadFile = File(..., description="SBML file"),
     start: int = Query(..., description="Start time"),
     stop: int = Query(..., description="End time(duration)"),
-    steps: int = Query(..., description="Number of steps.")
+    steps: int = Query(..., description="Number of steps."),
+    scheduling: Dict[str, Any] = Depends(scheduling_fields)
 ) -> TelluriumRun:
     run_data = await submit_utc_run(
         db_connector=db_conn_gateway,
@@ -954,6 +1154,7 @@ async def run_tellurium_step(
         stop=stop,
         steps=steps,
         context_model=TelluriumRun,
+        scheduling=scheduling,
         logger=logger
     )
 
@@ -64,6 +64,7 @@ class SmoldynRun(Run):
     path: str
     duration: float
     dt: float
+    replicates: int = field(default=1)
 
 
 
@@ -125,6 +126,17 @@ class TelluriumRun(UtcRun):
     pass
 
 
+@dataclass
+class SweepRun(Run):
+    simulator: str
+    model_file: str
+    start: int
+    stop: int
+    steps: int
+    parameters: List[str]
+    n_samples: int
+
+
 @dataclass
 class ReaddySpeciesConfig(BaseClass):
     name: str
@@ -153,6 +165,7 @@ class ReaddyRun(Run):
     reactions_config: Union[Dict[str, float], List[ReaddyReactionConfig]]
     unit_system_config: Dict[str, Any]
     reaction_handler: str
+    replicates: int = field(default=1)
 
 
 @dataclass
@@ -259,6 +272,7 @@ class OutputData(BaseClass):
     status: str
     last_updated: str
     results: Dict
+    next_cursor: Optional[int] = field(default=None)
 
 
 class SmoldynOutput(FileResponse):
@@ -276,6 +290,13 @@ class OutputFile(BaseClass):
     results_file: str
 
 
+@dataclass
+class StoredUpload(BaseClass):
+    location: str
+    sha256: str
+    size: int
+
+
 # -- misc --
 
 @dataclass
@@ -294,6 +315,27 @@ class IncompleteFileJob(BaseClass):
     source: str
 
 
+@dataclass
+class BatchRun(BaseClass):
+    """A parameter study submitted at once: one job per variant of a base composition spec or model."""
+    batch_id: str
+    kind: str
+    last_updated: str
+    n_jobs: int
+    job_ids: List[str]
+
+
+@dataclass
+class BatchStatus(BaseClass):
+    """Aggregate status of the jobs of a batch: `status` summarizes the number of jobs in each state, `statuses`."""
+    batch_id: str
+    kind: str
+    last_updated: str
+    n_jobs: int
+    status: str
+    statuses: Dict[str, int]
+
+
 class JobStatuses:
     PENDING = "PENDING"
     IN_PROGRESS = "IN_PROGRESS"
@@ -301,6 +343,14 @@ class JobStatuses:
     FAILED = "FAILED"
 
 
+class JobPriorities:
+    """Priority classes of jobs, stored as their rank (lower runs first) in the `priority` field of the job."""
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+    NAMES = {"high": HIGH, "normal": NORMAL, "low": LOW}
+
+
 APP_SERVERS = [
     # {
     #     "url": "https://compose.biosimulations.org",
@@ -1,15 +1,315 @@
+import asyncio
+import re
 from abc import abstractmethod, ABC
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 from typing import *
 
-from pymongo import MongoClient
+import bson
+from bson.errors import BSONError
+from gridfs import GridFSBucket, GridOut, AsyncGridFSBucket
+from gridfs.asynchronous.grid_file import AsyncGridOut
+from pymongo import MongoClient, AsyncMongoClient, IndexModel, ASCENDING, ReturnDocument
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.change_stream import CollectionChangeStream
 from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import PyMongoError, OperationFailure, DuplicateKeyError
 from pymongo.results import UpdateResult
 
-from shared.environment import DEFAULT_JOB_COLLECTION_NAME, DEFAULT_DB_NAME
+from shared.data_model import JobStatuses, JobPriorities
+from shared.environment import (
+    DEFAULT_JOB_COLLECTION_NAME,
+    DEFAULT_DB_NAME,
+    DEFAULT_SPILL_THRESHOLD_BYTES,
+    DEFAULT_MONGO_MAX_POOL_SIZE,
+    DEFAULT_MONGO_MIN_POOL_SIZE,
+    DEFAULT_MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    DEFAULT_RESULT_STATES_COLLECTION_NAME,
+    DEFAULT_RESULTS_CACHE_COLLECTION_NAME,
+    DEFAULT_BATCHES_COLLECTION_NAME
+)
+from shared.log_config import setup_logging
+from shared.results_cache import CACHED_INPUT_FIELDS, is_cacheable
+from shared.utils import job_queue, ANONYMOUS_SUBMITTER
+
+
+logger = setup_logging(__file__)
+
+# compound index backing the pending queue: equality on status, then oldest submission first
+PENDING_QUEUE_INDEX = [("status", ASCENDING), ("last_updated", ASCENDING)]
+# compound index backing the scheduler's view of the pending queue: equality on status, then by priority class and age
+SCHEDULING_INDEX = [("status", ASCENDING), ("priority", ASCENDING), ("last_updated", ASCENDING)]
+# fields read by `get_job_status`: enough to answer a poll and to locate the job's results, without reading them
+JOB_STATUS_PROJECTION = {
+    "_id": 0,
+    "job_id": 1,
+    "status": 1,
+    "last_updated": 1,
+    "timestamp": 1,
+    "path": 1,
+    "source": 1,
+    "simulator": 1,
+    "simulators": 1,
+    "cached_from": 1,
+    "results.results_file": 1,
+}
+# documents with a (datetime) value in this field are removed by mongo's TTL monitor once it has passed
+EXPIRE_AT_FIELD = "expire_at"
+
+
+def collection_indexes() -> Dict[str, List[IndexModel]]:
+    """Indexes backing the hot queries, by collection: every lookup filters on `job_id`, the pending queue on
+        `status`/`last_updated`, and ephemeral documents (result states) carry an `expire_at` date.
+    """
+    return {
+        DEFAULT_JOB_COLLECTION_NAME: [
+            IndexModel([("job_id", ASCENDING)], name="job_id_unique", unique=True),
+            IndexModel(PENDING_QUEUE_INDEX, name="status_last_updated"),
+            IndexModel(SCHEDULING_INDEX, name="status_priority_last_updated"),
+            # only jobs of a batch: a sparse compound index would still hold every job, as each one has a status
+            IndexModel(
+                [("batch_id", ASCENDING), ("status", ASCENDING)],
+                name="batch_id_status_partial",
+                partialFilterExpression={"batch_id": {"$exists": True}}
+            ),
+        ],
+        DEFAULT_RESULT_STATES_COLLECTION_NAME: [
+            IndexModel([("job_id", ASCENDING)], name="job_id"),
+            IndexModel([(EXPIRE_AT_FIELD, ASCENDING)], name="expire_at_ttl", expireAfterSeconds=0),
+        ],
+        DEFAULT_RESULTS_CACHE_COLLECTION_NAME: [
+            IndexModel([("fingerprint", ASCENDING)], name="fingerprint_unique", unique=True),
+        ],
+        DEFAULT_BATCHES_COLLECTION_NAME: [
+            IndexModel([("batch_id", ASCENDING)], name="batch_id_unique", unique=True),
+        ],
+        # GridFS files of spilled values: looked up by owner when they are superseded or deleted, and by expiry
+        f"{SPILL_BUCKET_NAME}.files": [
+            IndexModel([("metadata.job_id", ASCENDING), ("metadata.field", ASCENDING)], name="metadata_job_id_field"),
+            IndexModel(
+                [("metadata.expire_at", ASCENDING)],
+                name="metadata_expire_at",
+                partialFilterExpression={"metadata.expire_at": {"$exists": True}}
+            ),
+        ],
+    }
+
+
+def results_cache_entry(fingerprint: str, job: Mapping[str, Any], timestamp: str) -> Dict[str, Any]:
+    """Results-cache document mapping `fingerprint` to the results of completed `job`, as stored (spilled values and
+        chunked results are shared by reference, not copied), with the inputs that hits point at.
+    """
+    return {
+        "fingerprint": fingerprint,
+        "job_id": job["job_id"],
+        "results": job.get("results"),
+        "versions": job.get("versions"),
+        "inputs": {field: job[field] for field in CACHED_INPUT_FIELDS if field in job},
+        "created": timestamp,
+    }
+
+
+def status_counts_pipeline(query: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """Aggregation pipeline counting the jobs matching `query` by status."""
+    return [
+        {"$match": dict(query)},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]
+
+
+def with_scheduling_fields(document: Dict[str, Any]) -> Dict[str, Any]:
+    """`document` (a job) with the fields the scheduler selects by, defaulted where the submission did not set them:
+        its `queue` (see `shared.utils.job_queue`), `priority` class and `submitter`.
+    """
+    if "job_id" in document:
+        document.setdefault("queue", job_queue(document["job_id"]))
+        document.setdefault("priority", JobPriorities.NORMAL)
+        document.setdefault("submitter", ANONYMOUS_SUBMITTER)
+    return document
+
+
+def pending_heads_pipeline(query: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """Aggregation pipeline returning, for each queue, submitter and priority class with pending jobs matching `query`,
+        the oldest such job (`job_id`, `last_updated`) and their number (`pending`). Jobs submitted before scheduling
+        fields existed are grouped with a null queue and submitter.
+    """
+    return [
+        {"$match": {"status": JobStatuses.PENDING, **query}},
+        {"$sort": dict(SCHEDULING_INDEX[1:])},
+        {"$group": {
+            "_id": {"queue": "$queue", "submitter": "$submitter", "priority": "$priority"},
+            "job_id": {"$first": "$job_id"},
+            "last_updated": {"$first": "$last_updated"},
+            "pending": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0,
+            "queue": "$_id.queue",
+            "submitter": "$_id.submitter",
+            "priority": "$_id.priority",
+            "job_id": 1,
+            "last_updated": 1,
+            "pending": 1,
+        }},
+    ]
+
+
+def expiry(seconds: float) -> datetime:
+    """Value of `EXPIRE_AT_FIELD` for a document to be removed in `seconds`."""
+    return datetime.utcnow() + timedelta(seconds=seconds)
+
+
+def plan_stages(explanation: Mapping[str, Any]) -> List[str]:
+    """Stages (ie: `IXSCAN`, `FETCH`, `COLLSCAN`) of the winning plan in the output of a mongo `explain`."""
+    winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+    stages = []
+
+    def visit(stage: Mapping[str, Any]) -> None:
+        if "stage" in stage:
+            stages.append(stage["stage"])
+        # classic plans nest `inputStage(s)`; slot-based (SBE) plans wrap them in `queryPlan`
+        for key in ("queryPlan", "inputStage"):
+            if key in stage:
+                visit(stage[key])
+        for input_stage in stage.get("inputStages", []):
+            visit(input_stage)
+
+    visit(winning_plan)
+    return stages
+
+
+def is_indexed_plan(explanation: Mapping[str, Any]) -> bool:
+    """Whether the query explained by `explanation` is answered without scanning the whole collection."""
+    stages = plan_stages(explanation)
+    return bool(stages) and "COLLSCAN" not in stages
+
+
+def mongo_client_options() -> Dict[str, Any]:
+    """Connection pool settings shared by the sync and async mongo clients."""
+    return {
+        "maxPoolSize": DEFAULT_MONGO_MAX_POOL_SIZE,
+        "minPoolSize": DEFAULT_MONGO_MIN_POOL_SIZE,
+        "waitQueueTimeoutMS": DEFAULT_MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    }
+
+
+# -- spill-over of oversized values -- #
+
+SPILL_BUCKET_NAME = "spilled_values"
+SPILL_KEY = "_spilled"
+# small fields that queries and status updates rely on are never spilled
+SPILL_EXEMPT_FIELDS = ("_id", "job_id", "status", "last_updated")
+# mongo's 16 MB document cap, less headroom for the remaining keys and the references that replace spilled values
+MAX_DOCUMENT_BYTES = 16 * 1024 ** 2 - 256 * 1024
+
+
+def encode_spill_value(value: Any) -> bytes:
+    return bson.encode({"value": value})
+
+
+def decode_spill_value(data: bytes) -> Any:
+    return bson.decode(data)["value"]
+
+
+def spill_reference(file_id: Any, size: int) -> Dict[str, Any]:
+    """The value left in the document in place of a spilled one."""
+    return {SPILL_KEY: {"file_id": file_id, "size": size}}
+
+
+def is_spilled(value: Any) -> bool:
+    """Whether `value` is a reference to a spilled value. A projection of a reference without its `file_id` (ie: only
+        `_spilled.size`, to tell that a value was spilled without reading it) is not one, and is left as is by reads.
+    """
+    return isinstance(value, dict) and isinstance(value.get(SPILL_KEY), dict) and "file_id" in value[SPILL_KEY]
+
+
+def spilled_file_ids(document: Any) -> List[Any]:
+    """GridFS file ids of the spilled values nested (in mappings) in `document`."""
+    if is_spilled(document):
+        return [document[SPILL_KEY]["file_id"]]
+    elif isinstance(document, dict):
+        return [file_id for value in document.values() for file_id in spilled_file_ids(value)]
+    return []
+
+
+def spill_metadata(collection_name: str, document: Mapping[str, Any], field: str) -> Dict[str, Any]:
+    """Metadata of the GridFS file of a spilled `field` of `document`: its owner, and the document's expiry if any."""
+    metadata = {"collection": collection_name, "job_id": document.get("job_id"), "field": field}
+    if document.get(EXPIRE_AT_FIELD) is not None:
+        metadata["expire_at"] = document[EXPIRE_AT_FIELD]
+    return metadata
+
+
+def superseded_spills_query(collection_name: str, job_id: str, fields: Iterable[str], keep: Iterable[Any] = ()) -> Dict[str, Any]:
+    """GridFS files query for the values of `fields` (or of paths under them) of `job_id`'s document spilled by earlier
+        writes, other than the files `keep` that the document still references.
+    """
+    pattern = "^(" + "|".join(re.escape(field) for field in fields) + r")(\.|$)"
+    return {
+        "metadata.collection": collection_name,
+        "metadata.job_id": job_id,
+        "metadata.field": {"$regex": pattern},
+        "_id": {"$nin": list(keep)},
+    }
+
+
+def collection_spills_query(collection_name: str, shared_job_ids: Iterable[str] = ()) -> Dict[str, Any]:
+    """GridFS files query for every value spilled from `collection_name`, but those of `shared_job_ids`."""
+    return {"metadata.collection": collection_name, "metadata.job_id": {"$nin": list(shared_job_ids)}}
+
+
+def expired_spills_query(now: datetime = None) -> Dict[str, Any]:
+    """GridFS files query for the values spilled from documents that mongo's TTL monitor has removed (or will soon):
+        the monitor deletes the documents, not the GridFS files they reference.
+    """
+    return {"metadata.expire_at": {"$lte": now or datetime.utcnow()}}
+
+
+class SpillBuffer(object):
+    """A spilled value reassembled as its GridFS chunks are streamed in: each chunk is copied once, into a buffer of the
+        value's stored size, and the value is decoded straight from it.
+    """
+    def __init__(self, reference: Mapping[str, Any]):
+        self.data = bytearray(reference[SPILL_KEY]["size"])
+        self.offset = 0
+
+    def append(self, chunk: bytes) -> None:
+        end = self.offset + len(chunk)
+        self.data[self.offset:end] = chunk
+        self.offset = end
+
+    def value(self) -> Any:
+        return decode_spill_value(memoryview(self.data)[:self.offset])
+
+
+def plan_spill(
+        document: Mapping[str, Any],
+        threshold: int = DEFAULT_SPILL_THRESHOLD_BYTES,
+        max_document_bytes: int = MAX_DOCUMENT_BYTES
+) -> Dict[str, bytes]:
+    """Choose the top-level fields of `document` (or `$set` fields of an update) to spill and return their encoded values:
+        every field larger than `threshold`, then the largest remaining fields until the rest fits in `max_document_bytes`.
+        A `threshold` of 0 disables spilling.
+    """
+    if threshold <= 0:
+        return {}
+    encoded = {
+        field: encode_spill_value(value)
+        for field, value in document.items()
+        if field not in SPILL_EXEMPT_FIELDS and not is_spilled(value)
+    }
+    spill = {field: data for field, data in encoded.items() if len(data) > threshold}
+    remaining_bytes = sum(len(data) for field, data in encoded.items() if field not in spill)
+    for field, data in sorted(encoded.items(), key=lambda item: len(item[1]), reverse=True):
+        if remaining_bytes <= max_document_bytes:
+            break
+        if field not in spill:
+            spill[field] = data
+            remaining_bytes -= len(data)
+    return spill
 
 
 class DatabaseConnector(ABC):
@@ -22,11 +322,6 @@ class DatabaseConnector(ABC):
         self.connector_id = connector_id
         self.connection_uri = connection_uri
 
-    @property
-    @abstractmethod
-    def all_data(self):
-        return None
-
     @abstractmethod
     def _get_client(self, *args):
         pass
@@ -35,6 +330,10 @@ class DatabaseConnector(ABC):
     def _get_database(self, db_id: str):
         pass
 
+    @abstractmethod
+    async def all_data(self) -> Dict[str, List[Mapping[str, Any]]]:
+        pass
+
     @abstractmethod
     async def read(self, collection_name: str, *args, **kwargs):
         pass
@@ -44,7 +343,7 @@ class DatabaseConnector(ABC):
         pass
 
     @abstractmethod
-    def get_jobs(self):
+    async def get_jobs(self) -> List[Mapping[str, Any]]:
         pass
 
     @abstractmethod
@@ -52,13 +351,66 @@ class DatabaseConnector(ABC):
         pass
 
     @abstractmethod
-    def refresh_jobs(self):
+    async def claim_job(self, job_filter: Optional[Mapping[str, Any]] = None):
+        pass
+
+    @abstractmethod
+    async def refresh_jobs(self) -> int:
+        """Delete every job and return how many were deleted."""
+        pass
+
+    @abstractmethod
+    async def ping(self):
         pass
 
     async def get_job(self, job_id: str, **kwargs):
         job_result = await self.read(collection_name=DEFAULT_JOB_COLLECTION_NAME, job_id=job_id, **kwargs)
         return job_result
 
+    async def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of job `job_id`, whatever its type, and the pointer to its results file (`results.results_file`) if
+            any: one query on the `job_id` index of the job collection (see `JOB_STATUS_PROJECTION`). `None` if there is
+            no such job.
+        """
+        return await self.read(collection_name=DEFAULT_JOB_COLLECTION_NAME, projection=JOB_STATUS_PROJECTION, job_id=job_id)
+
+    @abstractmethod
+    async def write_many(self, collection_name: str, documents: List[Dict[str, Any]]):
+        pass
+
+    @abstractmethod
+    async def count_statuses(self, **kwargs) -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def pending_heads(self, job_filter: Optional[Mapping[str, Any]] = None) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def find_cached_results(self, fingerprint: str) -> Optional[Mapping[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def find_many_cached_results(self, fingerprints: Iterable[str]) -> Dict[str, Mapping[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def cache_results(self, fingerprint: str, job_id: str) -> None:
+        pass
+
+    async def memoize_job(self, job: Mapping[str, Any]) -> bool:
+        """Map the fingerprint of completed `job` to its results, if it is cacheable (see
+            `shared.results_cache.is_cacheable`). Failing to do so does not fail the job.
+        """
+        if not is_cacheable(job):
+            return False
+        try:
+            await self.cache_results(job["fingerprint"], job["job_id"])
+            return True
+        except PyMongoError as e:
+            logger.warning(f"Could not cache the results of {job['job_id']}: {e}")
+            return False
+
     @staticmethod
     def timestamp() -> str:
         return str(datetime.utcnow())
@@ -71,10 +423,16 @@ class MongoConnector(DatabaseConnector):
                  connector_id: str = None,
                  local: bool = False):
         super().__init__(connection_uri, database_id, connector_id, local)
+        self._indexes_ready = False
+        self._spill_bucket: Optional[GridFSBucket] = None
+        self.spill_threshold = DEFAULT_SPILL_THRESHOLD_BYTES
 
     def confirm_connection(self):
         print(f"Connection established with database: {self._get_database(self.database_id)}")
 
+    async def ping(self) -> Mapping[str, Any]:
+        return self.client.admin.command('ping')
+
     def get_collection(self, collection_name: str) -> Collection:
         # try:
         #     return self.db[collection_name]
@@ -82,25 +440,29 @@ class MongoConnector(DatabaseConnector):
         #     return None
         return self.db[collection_name]
 
-    @property
-    def all_data(self):
+    async def all_data(self) -> Dict[str, List[Mapping[str, Any]]]:
+        """Every document of every collection, by collection name."""
         return {coll_name: [v for v in self.db[coll_name].find()] for coll_name in self.db.list_collection_names()}
 
     def _get_client(self, *args):
-        return MongoClient(args[0]) if not self.local else MongoClient("localhost", 27017)
+        options = mongo_client_options()
+        return MongoClient(args[0], **options) if not self.local else MongoClient("localhost", 27017, **options)
 
     def _get_database(self, db_id: str) -> Database:
         return self.client.get_database(db_id)
 
-    async def read(self, collection_name: str, **kwargs):
+    async def read(self, collection_name: str, projection: Optional[Mapping[str, Any]] = None, **kwargs):
         """Args:
             collection_name: str
+            projection: mongodb projection limiting the fields (or array elements, via `$slice`) returned
             kwargs: (as in mongodb query)
+
+            Values that were spilled to GridFS are transparently reassembled.
         """
         # coll_name = self._parse_enum_input(collection_name)
         coll = self.get_collection(collection_name)
-        result = coll.find_one(kwargs.copy())
-        return result
+        result = coll.find_one(kwargs.copy(), projection)
+        return await self._resolve_spilled_in_thread(result)
 
     async def write(self, collection_name: str, **kwargs):
         """
@@ -108,18 +470,207 @@ class MongoConnector(DatabaseConnector):
                 collection_name: str: collection name in mongodb
                 **kwargs: mongo db `insert_one` query defining the document where the key is as in the key of the document. For example,
                     something like: results=, etc
+
+            Fields too large to be stored in the document are spilled to GridFS (see `plan_spill`).
         """
+        coll = self.get_collection(collection_name)
         try:
-            coll = self.get_collection(collection_name)
-            result = coll.insert_one(kwargs.copy())
+            document = kwargs.copy()
+            if collection_name == DEFAULT_JOB_COLLECTION_NAME:
+                with_scheduling_fields(document)
+            document = await asyncio.to_thread(self._spill, collection_name, document)
+            coll.insert_one(document)
+            if document.get(EXPIRE_AT_FIELD) is not None:
+                await self.delete_expired_spills()
             return kwargs.copy()
-        except:
-            return {}
+        except (PyMongoError, BSONError) as e:
+            logger.error(f"Could not write {kwargs.get('job_id')} to {collection_name}: {e}")
+            raise
+
+    async def write_many(self, collection_name: str, documents: List[Dict[str, Any]]) -> int:
+        """Insert `documents` in bulk (a single `insert_many`, which the driver splits into as few round trips as the
+            server allows), spilling oversized fields of each as in `write`. Returns the number of documents inserted.
+        """
+        coll = self.get_collection(collection_name)
+        try:
+            if collection_name == DEFAULT_JOB_COLLECTION_NAME:
+                documents = [with_scheduling_fields(dict(document)) for document in documents]
+            documents = await asyncio.to_thread(lambda: [self._spill(collection_name, dict(document)) for document in documents])
+            result = coll.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except (PyMongoError, BSONError) as e:
+            logger.error(f"Could not write {len(documents)} documents to {collection_name}: {e}")
+            raise
 
-    def get_jobs(self):
+    async def count_statuses(self, **kwargs) -> Dict[str, int]:
+        """Number of jobs matching `kwargs` (as in mongodb query) in each status."""
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        return {group["_id"]: group["count"] for group in coll.aggregate(status_counts_pipeline(kwargs))}
+
+    async def pending_heads(self, job_filter: Optional[Mapping[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Oldest pending job matching `job_filter` of each queue, submitter and priority class (see
+            `pending_heads_pipeline`): the scheduler's view of the queue, in one aggregation.
+        """
+        if not self._indexes_ready:
+            self.ensure_indexes()
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        return list(coll.aggregate(pending_heads_pipeline(job_filter or {})))
+
+    @property
+    def spill_bucket(self) -> GridFSBucket:
+        if self._spill_bucket is None:
+            self._spill_bucket = GridFSBucket(self.db, bucket_name=SPILL_BUCKET_NAME)
+        return self._spill_bucket
+
+    def _spill(self, collection_name: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace the fields of `document` chosen by `plan_spill` with references to their values stored in GridFS.
+            Blocking: run it in a thread (see `write`).
+        """
+        spill = plan_spill(document, threshold=self.spill_threshold)
+        for field, data in spill.items():
+            file_id = self.spill_bucket.upload_from_stream(
+                filename=f"{collection_name}/{document.get('job_id')}/{field}",
+                source=data,
+                metadata=spill_metadata(collection_name, document, field)
+            )
+            document[field] = spill_reference(file_id, len(data))
+            logger.info(f"Spilled {len(data)} bytes of {collection_name}.{field} for {document.get('job_id')} to GridFS")
+        return document
+
+    def open_spilled(self, reference: Mapping[str, Any]) -> GridOut:
+        """Open the GridFS stream of a spilled value (as BSON `{"value": ...}`), ie: to relay it without decoding."""
+        return self.spill_bucket.open_download_stream(reference[SPILL_KEY]["file_id"])
+
+    def read_spilled(self, reference: Mapping[str, Any]) -> Any:
+        buffer = SpillBuffer(reference)
+        with self.open_spilled(reference) as stream:
+            for chunk in iter(stream.readchunk, b""):
+                buffer.append(chunk)
+        return buffer.value()
+
+    def resolve_spilled(self, document: Any) -> Any:
+        """Replace every spilled reference nested (in mappings) in `document` with its reassembled value."""
+        if is_spilled(document):
+            return self.read_spilled(document)
+        elif isinstance(document, dict):
+            for key, value in document.items():
+                if isinstance(value, dict):
+                    document[key] = self.resolve_spilled(value)
+        return document
+
+    async def _resolve_spilled_in_thread(self, document: Any) -> Any:
+        # GridFS reads of multi-MB values would otherwise block the event loop, and every other job running on it
+        if not spilled_file_ids(document):
+            return document
+        return await asyncio.to_thread(self.resolve_spilled, document)
+
+    def _delete_spills(self, query: Mapping[str, Any]) -> int:
+        file_ids = [grid_out._id for grid_out in self.spill_bucket.find(query)]
+        for file_id in file_ids:
+            self.spill_bucket.delete(file_id)
+        return len(file_ids)
+
+    async def delete_superseded_spills(self, collection_name: str, job_id: str, fields: Iterable[str], keep: Iterable[Any] = ()) -> int:
+        """Delete the values of `fields` of `job_id`'s document spilled by earlier writes, now overwritten (see
+            `superseded_spills_query`), unless the job's results are shared through the results cache. Returns the number
+            of GridFS files deleted.
+        """
+        if self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME).find_one({"job_id": job_id}, {"_id": 1}) is not None:
+            return 0
+        return await asyncio.to_thread(self._delete_spills, superseded_spills_query(collection_name, job_id, fields, keep))
+
+    async def delete_expired_spills(self) -> int:
+        """Delete the values spilled from documents past their `expire_at` (see `expired_spills_query`)."""
+        return await asyncio.to_thread(self._delete_spills, expired_spills_query())
+
+    async def find_cached_results(self, fingerprint: str) -> Optional[Mapping[str, Any]]:
+        """The results-cache entry (see `results_cache_entry`) for `fingerprint`, or `None`. Spilled values are left as
+            references, so that they can be shared with the job answered from the cache.
+        """
+        return self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME).find_one({"fingerprint": fingerprint}, {"_id": 0})
+
+    async def find_many_cached_results(self, fingerprints: Iterable[str]) -> Dict[str, Mapping[str, Any]]:
+        """Results-cache entries of `fingerprints` that have one, by fingerprint, in one query."""
+        coll = self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME)
+        return {entry["fingerprint"]: entry for entry in coll.find({"fingerprint": {"$in": list(set(fingerprints))}}, {"_id": 0})}
+
+    async def cache_results(self, fingerprint: str, job_id: str) -> None:
+        """Map `fingerprint` to the stored results of completed job `job_id`. The first job to complete wins."""
+        job = self.get_collection(DEFAULT_JOB_COLLECTION_NAME).find_one({"job_id": job_id}, {"_id": 0, "job_id": 1, "results": 1, "versions": 1, **{field: 1 for field in CACHED_INPUT_FIELDS}})
+        if job is None:
+            return
+        try:
+            self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME).update_one(
+                filter={"fingerprint": fingerprint},
+                update={"$setOnInsert": results_cache_entry(fingerprint, job, self.timestamp())},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # inserted concurrently by another job with the same fingerprint
+            pass
+
+    async def get_jobs(self) -> List[Mapping[str, Any]]:
         coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
         return [item for item in coll.find()]
 
+    def ensure_indexes(self) -> List[str]:
+        """Create the indexes of `collection_indexes` that do not exist yet (a no-op for those that do) and return the
+            names of the indexes in place. A collection whose indexes cannot be built (ie: duplicate `job_id`s prevent the
+            unique index) is logged and skipped, so that startup does not depend on it.
+        """
+        names = []
+        for collection_name, indexes in collection_indexes().items():
+            try:
+                names.extend(self.get_collection(collection_name).create_indexes(indexes))
+            except OperationFailure as e:
+                logger.error(f"Could not create the indexes of {collection_name}: {e}")
+        self._indexes_ready = True
+        return names
+
+    def explain_find(self, collection_name: str, projection: Optional[Mapping[str, Any]] = None, **kwargs) -> Mapping[str, Any]:
+        """Output of mongo's `explain` for `read(collection_name, projection, **kwargs)` (see `is_indexed_plan`)."""
+        return self.get_collection(collection_name).find(kwargs.copy(), projection).limit(1).explain()
+
+    async def claim_job(self, job_filter: Optional[Mapping[str, Any]] = None) -> Optional[Mapping[str, Any]]:
+        """Atomically move the oldest PENDING job matching `job_filter` to IN_PROGRESS and return it.
+
+            Args:
+                job_filter: additional mongo query constraints (for example on `job_id`) applied on top of the pending status.
+
+            Returns:
+                the claimed job document (as it is after the update, with spilled values reassembled), or `None` if there
+                are no pending jobs.
+        """
+        if not self._indexes_ready:
+            self.ensure_indexes()
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        query = {'status': JobStatuses.PENDING}
+        if job_filter:
+            query.update(job_filter)
+        job = coll.find_one_and_update(
+            filter=query,
+            update={
+                '$set': {
+                    'status': JobStatuses.IN_PROGRESS,
+                    'last_updated': self.timestamp()
+                }
+            },
+            sort=PENDING_QUEUE_INDEX,
+            return_document=ReturnDocument.AFTER
+        )
+        # the worker needs the job's inputs (ie: a composition `spec`), which may have been spilled on submission
+        return await self._resolve_spilled_in_thread(job)
+
+    def watch_jobs(self, operation_types: Sequence[str] = ("insert",), max_await_time_ms: int = 1000) -> CollectionChangeStream:
+        """Open a change stream over the job collection yielding only the given operation types.
+
+            NOTE: change streams require a replica set or sharded cluster; on a standalone mongod this raises
+            `pymongo.errors.OperationFailure`.
+        """
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        pipeline = [{'$match': {'operationType': {'$in': list(operation_types)}}}]
+        return coll.watch(pipeline=pipeline, max_await_time_ms=max_await_time_ms)
+
     async def update_job_status(self, job_id: str, status: str) -> UpdateResult:
         coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
         return coll.update_one(
@@ -133,17 +684,287 @@ class MongoConnector(DatabaseConnector):
         )
 
     async def update_job(self, job_id: str, **params) -> UpdateResult:
+        """Set `params` (fields or dotted paths) of job `job_id`, spilling oversized values as in `write`. Values of
+            these fields spilled by earlier updates (ie: per-simulator results, then the job's results) are deleted.
+        """
         coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
-        job_params = params.copy()
+        job_params = await asyncio.to_thread(self._spill, DEFAULT_JOB_COLLECTION_NAME, {'job_id': job_id, **params})
+        job_params.pop('job_id')
         job_params['last_updated'] = self.timestamp()
-        return coll.update_one(
+        result = coll.update_one(
             filter={'job_id': job_id},
             update={'$set': job_params}
         )
+        fields = [field for field in params if field not in SPILL_EXEMPT_FIELDS]
+        if fields:
+            await self.delete_superseded_spills(DEFAULT_JOB_COLLECTION_NAME, job_id, fields, keep=spilled_file_ids(job_params))
+        return result
+
+    async def refresh_jobs(self) -> int:
+        """Delete every job, and the values spilled from them but those shared through the results cache."""
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        deleted_count = coll.delete_many({}).deleted_count
+        shared_job_ids = self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME).distinct("job_id")
+        await asyncio.to_thread(self._delete_spills, collection_spills_query(DEFAULT_JOB_COLLECTION_NAME, shared_job_ids))
+        return deleted_count
+
+
+class AsyncMongoConnector(DatabaseConnector):
+    """`MongoConnector` counterpart for use on an event loop (ie: by the gateway): every database round trip is awaited
+        on PyMongo's async client instead of blocking the loop, so that concurrent requests only wait for the connection
+        pool (sized in `shared.environment`) rather than for each other.
+    """
+    def __init__(self,
+                 connection_uri: str,
+                 database_id: str,
+                 connector_id: str = None,
+                 local: bool = False):
+        super().__init__(connection_uri, database_id, connector_id, local)
+        self._indexes_ready = False
+        self._spill_bucket: Optional[AsyncGridFSBucket] = None
+        self.spill_threshold = DEFAULT_SPILL_THRESHOLD_BYTES
+
+    def get_collection(self, collection_name: str) -> AsyncCollection:
+        return self.db[collection_name]
+
+    async def all_data(self) -> Dict[str, List[Mapping[str, Any]]]:
+        """Every document of every collection, by collection name (see `MongoConnector.all_data`)."""
+        return {
+            coll_name: await self.db[coll_name].find().to_list()
+            for coll_name in await self.db.list_collection_names()
+        }
+
+    def _get_client(self, *args):
+        # the client only connects on its first operation, so it can be created before the event loop runs
+        options = mongo_client_options()
+        if self.local:
+            return AsyncMongoClient("localhost", 27017, connect=False, **options)
+        return AsyncMongoClient(args[0], connect=False, **options)
+
+    def _get_database(self, db_id: str) -> AsyncDatabase:
+        return self.client.get_database(db_id)
+
+    async def ping(self) -> Mapping[str, Any]:
+        return await self.client.admin.command('ping')
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def read(self, collection_name: str, projection: Optional[Mapping[str, Any]] = None, **kwargs):
+        """Args:
+            collection_name: str
+            projection: mongodb projection limiting the fields (or array elements, via `$slice`) returned
+            kwargs: (as in mongodb query)
+
+            Values that were spilled to GridFS are transparently reassembled.
+        """
+        coll = self.get_collection(collection_name)
+        result = await coll.find_one(kwargs.copy(), projection)
+        return await self.resolve_spilled(result)
+
+    async def write(self, collection_name: str, **kwargs):
+        """
+            Args:
+                collection_name: str: collection name in mongodb
+                **kwargs: mongo db `insert_one` query defining the document where the key is as in the key of the document.
+
+            Fields too large to be stored in the document are spilled to GridFS (see `plan_spill`).
+        """
+        coll = self.get_collection(collection_name)
+        try:
+            document = kwargs.copy()
+            if collection_name == DEFAULT_JOB_COLLECTION_NAME:
+                with_scheduling_fields(document)
+            document = await self._spill(collection_name, document)
+            await coll.insert_one(document)
+            if document.get(EXPIRE_AT_FIELD) is not None:
+                await self.delete_expired_spills()
+            return kwargs.copy()
+        except (PyMongoError, BSONError) as e:
+            logger.error(f"Could not write {kwargs.get('job_id')} to {collection_name}: {e}")
+            raise
+
+    async def write_many(self, collection_name: str, documents: List[Dict[str, Any]]) -> int:
+        """See `MongoConnector.write_many`."""
+        coll = self.get_collection(collection_name)
+        try:
+            if collection_name == DEFAULT_JOB_COLLECTION_NAME:
+                documents = [with_scheduling_fields(dict(document)) for document in documents]
+            documents = [await self._spill(collection_name, dict(document)) for document in documents]
+            result = await coll.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except (PyMongoError, BSONError) as e:
+            logger.error(f"Could not write {len(documents)} documents to {collection_name}: {e}")
+            raise
+
+    async def count_statuses(self, **kwargs) -> Dict[str, int]:
+        """Number of jobs matching `kwargs` (as in mongodb query) in each status."""
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        cursor = await coll.aggregate(status_counts_pipeline(kwargs))
+        return {group["_id"]: group["count"] async for group in cursor}
+
+    async def pending_heads(self, job_filter: Optional[Mapping[str, Any]] = None) -> List[Dict[str, Any]]:
+        """See `MongoConnector.pending_heads`."""
+        if not self._indexes_ready:
+            await self.ensure_indexes()
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        cursor = await coll.aggregate(pending_heads_pipeline(job_filter or {}))
+        return [head async for head in cursor]
+
+    @property
+    def spill_bucket(self) -> AsyncGridFSBucket:
+        if self._spill_bucket is None:
+            self._spill_bucket = AsyncGridFSBucket(self.db, bucket_name=SPILL_BUCKET_NAME)
+        return self._spill_bucket
+
+    async def _spill(self, collection_name: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace the fields of `document` chosen by `plan_spill` with references to their values stored in GridFS."""
+        spill = plan_spill(document, threshold=self.spill_threshold)
+        for field, data in spill.items():
+            file_id = await self.spill_bucket.upload_from_stream(
+                filename=f"{collection_name}/{document.get('job_id')}/{field}",
+                source=data,
+                metadata=spill_metadata(collection_name, document, field)
+            )
+            document[field] = spill_reference(file_id, len(data))
+            logger.info(f"Spilled {len(data)} bytes of {collection_name}.{field} for {document.get('job_id')} to GridFS")
+        return document
+
+    async def open_spilled(self, reference: Mapping[str, Any]) -> AsyncGridOut:
+        return await self.spill_bucket.open_download_stream(reference[SPILL_KEY]["file_id"])
+
+    async def read_spilled(self, reference: Mapping[str, Any]) -> Any:
+        stream = await self.open_spilled(reference)
+        buffer = SpillBuffer(reference)
+        try:
+            while chunk := await stream.readchunk():
+                buffer.append(chunk)
+        finally:
+            await stream.close()
+        return buffer.value()
+
+    async def resolve_spilled(self, document: Any) -> Any:
+        """Replace every spilled reference nested (in mappings) in `document` with its reassembled value."""
+        if is_spilled(document):
+            return await self.read_spilled(document)
+        elif isinstance(document, dict):
+            for key, value in document.items():
+                if isinstance(value, dict):
+                    document[key] = await self.resolve_spilled(value)
+        return document
+
+    async def _delete_spills(self, query: Mapping[str, Any]) -> int:
+        file_ids = [grid_out._id async for grid_out in self.spill_bucket.find(query)]
+        for file_id in file_ids:
+            await self.spill_bucket.delete(file_id)
+        return len(file_ids)
+
+    async def delete_superseded_spills(self, collection_name: str, job_id: str, fields: Iterable[str], keep: Iterable[Any] = ()) -> int:
+        """See `MongoConnector.delete_superseded_spills`."""
+        if await self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME).find_one({"job_id": job_id}, {"_id": 1}) is not None:
+            return 0
+        return await self._delete_spills(superseded_spills_query(collection_name, job_id, fields, keep))
+
+    async def delete_expired_spills(self) -> int:
+        """See `MongoConnector.delete_expired_spills`."""
+        return await self._delete_spills(expired_spills_query())
+
+    async def find_cached_results(self, fingerprint: str) -> Optional[Mapping[str, Any]]:
+        """See `MongoConnector.find_cached_results`."""
+        return await self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME).find_one({"fingerprint": fingerprint}, {"_id": 0})
+
+    async def find_many_cached_results(self, fingerprints: Iterable[str]) -> Dict[str, Mapping[str, Any]]:
+        """See `MongoConnector.find_many_cached_results`."""
+        coll = self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME)
+        cursor = coll.find({"fingerprint": {"$in": list(set(fingerprints))}}, {"_id": 0})
+        return {entry["fingerprint"]: entry async for entry in cursor}
+
+    async def cache_results(self, fingerprint: str, job_id: str) -> None:
+        """See `MongoConnector.cache_results`."""
+        job = await self.get_collection(DEFAULT_JOB_COLLECTION_NAME).find_one({"job_id": job_id}, {"_id": 0, "job_id": 1, "results": 1, "versions": 1, **{field: 1 for field in CACHED_INPUT_FIELDS}})
+        if job is None:
+            return
+        try:
+            await self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME).update_one(
+                filter={"fingerprint": fingerprint},
+                update={"$setOnInsert": results_cache_entry(fingerprint, job, self.timestamp())},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+
+    async def get_jobs(self) -> List[Mapping[str, Any]]:
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        return await coll.find().to_list()
+
+    async def ensure_indexes(self) -> List[str]:
+        """See `MongoConnector.ensure_indexes`."""
+        names = []
+        for collection_name, indexes in collection_indexes().items():
+            try:
+                names.extend(await self.get_collection(collection_name).create_indexes(indexes))
+            except OperationFailure as e:
+                logger.error(f"Could not create the indexes of {collection_name}: {e}")
+        self._indexes_ready = True
+        return names
+
+    async def explain_find(self, collection_name: str, projection: Optional[Mapping[str, Any]] = None, **kwargs) -> Mapping[str, Any]:
+        return await self.get_collection(collection_name).find(kwargs.copy(), projection).limit(1).explain()
+
+    async def claim_job(self, job_filter: Optional[Mapping[str, Any]] = None) -> Optional[Mapping[str, Any]]:
+        """Atomically move the oldest PENDING job matching `job_filter` to IN_PROGRESS and return it (see
+            `MongoConnector.claim_job`).
+        """
+        if not self._indexes_ready:
+            await self.ensure_indexes()
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        query = {'status': JobStatuses.PENDING}
+        if job_filter:
+            query.update(job_filter)
+        job = await coll.find_one_and_update(
+            filter=query,
+            update={
+                '$set': {
+                    'status': JobStatuses.IN_PROGRESS,
+                    'last_updated': self.timestamp()
+                }
+            },
+            sort=PENDING_QUEUE_INDEX,
+            return_document=ReturnDocument.AFTER
+        )
+        return await self.resolve_spilled(job)
 
-    def refresh_jobs(self):
-        coll = DEFAULT_JOB_COLLECTION_NAME
-        for job in self.db[coll].find():
-            self.db[coll].delete_one(job)
+    async def update_job_status(self, job_id: str, status: str) -> UpdateResult:
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        return await coll.update_one(
+            filter={'job_id': job_id},
+            update={
+                '$set': {
+                    'status': status,
+                    'last_updated': self.timestamp()
+                }
+            }
+        )
 
+    async def update_job(self, job_id: str, **params) -> UpdateResult:
+        """See `MongoConnector.update_job`."""
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        job_params = await self._spill(DEFAULT_JOB_COLLECTION_NAME, {'job_id': job_id, **params})
+        job_params.pop('job_id')
+        job_params['last_updated'] = self.timestamp()
+        result = await coll.update_one(
+            filter={'job_id': job_id},
+            update={'$set': job_params}
+        )
+        fields = [field for field in params if field not in SPILL_EXEMPT_FIELDS]
+        if fields:
+            await self.delete_superseded_spills(DEFAULT_JOB_COLLECTION_NAME, job_id, fields, keep=spilled_file_ids(job_params))
+        return result
 
+    async def refresh_jobs(self) -> int:
+        """See `MongoConnector.refresh_jobs`."""
+        coll = self.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        deleted_count = (await coll.delete_many({})).deleted_count
+        shared_job_ids = await self.get_collection(DEFAULT_RESULTS_CACHE_COLLECTION_NAME).distinct("job_id")
+        await self._delete_spills(collection_spills_query(DEFAULT_JOB_COLLECTION_NAME, shared_job_ids))
+        return deleted_count
@@ -3,6 +3,7 @@ Environmental constraints: dynamic and default
 """
 import dataclasses
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -18,4 +19,29 @@ load_dotenv(ENV_PATH)
 DEFAULT_DB_TYPE = os.getenv("DB_TYPE", "mongodb")
 DEFAULT_DB_NAME = os.getenv("DB_NAME", "compose_db")
 DEFAULT_BUCKET_NAME = os.getenv("BUCKET_NAME", "compose_bucket")
+DEFAULT_GCS_CREDENTIALS_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 DEFAULT_JOB_COLLECTION_NAME = os.getenv("JOB_COLLECTION_NAME", "compose_jobs")
+DEFAULT_RESULT_STATES_COLLECTION_NAME = os.getenv("RESULT_STATES_COLLECTION_NAME", "result_states")
+DEFAULT_RESULT_STATES_TTL_SECONDS = int(os.getenv("RESULT_STATES_TTL_SECONDS", 0))  # 0 keeps result states forever
+DEFAULT_RESULTS_CACHE_COLLECTION_NAME = os.getenv("RESULTS_CACHE_COLLECTION_NAME", "results_cache")
+DEFAULT_RESULTS_CACHE_ENABLED = os.getenv("RESULTS_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+DEFAULT_BATCHES_COLLECTION_NAME = os.getenv("BATCHES_COLLECTION_NAME", "batches")
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 10000))  # variants per batch submission
+DEFAULT_MAX_SWEEP_SAMPLES = int(os.getenv("MAX_SWEEP_SAMPLES", 100000))  # parameter sets per sweep submission
+DEFAULT_SWEEP_CHUNK_BYTES = int(os.getenv("SWEEP_CHUNK_BYTES", 64 * 1024 ** 2))  # stored bytes per chunk of sweep results
+DEFAULT_MAX_REPLICATES = int(os.getenv("MAX_REPLICATES", 1000))  # replicates per stochastic ensemble
+DEFAULT_SCHEDULER_QUEUE_WEIGHTS = os.getenv("SCHEDULER_QUEUE_WEIGHTS", "")  # ie: "tellurium=4,mem3dg=1"; unlisted queues weigh 1
+DEFAULT_SCHEDULER_MAX_QUEUE_SHARE = float(os.getenv("SCHEDULER_MAX_QUEUE_SHARE", 0.75))  # of a worker's slots, per queue
+DEFAULT_SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", 600))  # wait that raises a job one class; 0 disables
+DEFAULT_FILE_CACHE_DIR = os.getenv("FILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "compose_file_cache"))
+DEFAULT_FILE_CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", 2 * 1024 ** 3))  # 0 disables the cache
+DEFAULT_MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "compose_model_cache"))
+DEFAULT_MODEL_CACHE_MAX_BYTES = int(os.getenv("MODEL_CACHE_MAX_BYTES", 4 * 1024 ** 3))  # 0 disables the cache
+DEFAULT_MODEL_CACHE_GRACE_SECONDS = float(os.getenv("MODEL_CACHE_GRACE_SECONDS", 600))  # entries used since are never evicted
+DEFAULT_MODEL_POOL_MAX_BYTES = int(os.getenv("MODEL_POOL_MAX_BYTES", 1024 ** 3))  # per worker process; 0 disables
+DEFAULT_RESULTS_CHUNK_ROWS = int(os.getenv("RESULTS_CHUNK_ROWS", 65536))
+DEFAULT_RESULTS_INLINE_MAX_BYTES = int(os.getenv("RESULTS_INLINE_MAX_BYTES", 64 * 1024))
+DEFAULT_SPILL_THRESHOLD_BYTES = int(os.getenv("SPILL_THRESHOLD_BYTES", 4 * 1024 ** 2))  # 0 disables spilling to GridFS
+DEFAULT_MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))  # connections per client; 0 means no limit
+DEFAULT_MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+DEFAULT_MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))  # wait for a free connection
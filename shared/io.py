@@ -1,8 +1,14 @@
+import asyncio
+import fcntl
+import hashlib
 import os
 import re
+import shutil
 import unicodedata
 import urllib
+import uuid
 import zipfile
+from contextlib import contextmanager
 from pathlib import Path
 from tempfile import mkdtemp
 from typing import *
@@ -10,96 +16,277 @@ from typing import *
 import libsbml
 import chardet
 from fastapi import UploadFile
-from google.cloud import storage
 
+from common.storage import FileService, FileServiceGCS
+from shared.data_model import StoredUpload
+from shared.environment import DEFAULT_FILE_CACHE_DIR, DEFAULT_FILE_CACHE_MAX_BYTES
 
-def check_upload_file_extension(file: UploadFile, purpose: str, ext: str, message: str = None) -> bool:
-    if not file.filename.endswith(ext):
+
+# -- object storage -- #
+
+_file_services: Dict[str, FileService] = {}
+
+
+def get_file_service(bucket_name: str) -> FileService:
+    """Long-lived, pooled async file service for `bucket_name`, shared by every caller in this process."""
+    if bucket_name not in _file_services:
+        _file_services[bucket_name] = FileServiceGCS(bucket_name=bucket_name)
+    return _file_services[bucket_name]
+
+
+async def close_file_services() -> None:
+    for bucket_name in list(_file_services.keys()):
+        await _file_services.pop(bucket_name).close()
+
+
+def check_upload_file_extension(file: UploadFile | str, purpose: str, ext: str, message: str = None) -> bool:
+    filename = file.filename if isinstance(file, UploadFile) else file
+    if not filename.endswith(ext):
         msg = message or f"Files for {purpose} must be passed in {ext} format."
         raise ValueError(msg)
     else:
         return True
 
 
+# bytes of an upload read (and thus held in memory) at a time
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+async def iter_upload_chunks(uploaded_file: UploadFile, digest: Any = None, chunk_size: int = UPLOAD_CHUNK_BYTES) -> AsyncIterator[bytes]:
+    """Yield the contents of `uploaded_file` `chunk_size` bytes at a time, feeding each chunk to `digest` (ie: a hashlib
+        hash) if given.
+    """
+    while True:
+        chunk = await uploaded_file.read(chunk_size)
+        if not chunk:
+            break
+        if digest is not None:
+            digest.update(chunk)
+        yield chunk
+
+
+async def hash_uploaded_file(uploaded_file: UploadFile) -> str:
+    """sha256 hex digest of the contents of `uploaded_file`, which is left rewound for a subsequent upload."""
+    digest = hashlib.sha256()
+    await uploaded_file.seek(0)
+    async for _ in iter_upload_chunks(uploaded_file, digest):
+        pass
+    await uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+async def write_upload_chunks(uploaded_file: UploadFile, file_path: str) -> None:
+    with open(file_path, 'wb') as file:
+        async for chunk in iter_upload_chunks(uploaded_file):
+            await asyncio.to_thread(file.write, chunk)
+
+
 async def save_uploaded_file(uploaded_file: UploadFile, save_dest: str) -> str:
     """Write `fastapi.UploadFile` instance passed by api gateway user to `save_dest`."""
     file_path = os.path.join(save_dest, uploaded_file.filename)
-    with open(file_path, 'wb') as file:
-        contents = await uploaded_file.read()
-        file.write(contents)
+    await write_upload_chunks(uploaded_file, file_path)
     return file_path
 
 
-def upload_blob(bucket_name, source_file_name, destination_blob_name):
-    """Uploads a file to the bucket."""
-    # The ID of your GCS bucket
-    # bucket_name = "your-bucket-name"
-    # The path to your file to upload
-    # source_file_name = "local/path/to/file"
-    # The ID of your GCS object
-    # destination_blob_name = "storage-object-name"
+async def write_uploaded_file(job_id: str, bucket_name: str, uploaded_file: UploadFile | str, extension: str) -> str:
+    """Upload either a `fastapi.UploadFile` passed by an api gateway user or a local file (by path) to
+        `file_uploads/{job_id}/` in `bucket_name` through the shared async file service.
+
+        Returns:
+            location of the uploaded file in the bucket.
+    """
+    # bucket params
+    upload_prefix = f"file_uploads/{job_id}/"
 
-    storage_client = storage.Client('biosimulations')
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
+    check_upload_file_extension(uploaded_file, 'uploaded_file', extension)
+    filename = uploaded_file.filename if isinstance(uploaded_file, UploadFile) else uploaded_file
+    blob_dest = upload_prefix + filename.split("/")[-1]
 
-    # Optional: set a generation-match precondition to avoid potential race conditions
-    # and data corruptions. The request to upload is aborted if the object's
-    # generation number does not match your precondition. For a destination
-    # object that does not yet exist, set the if_generation_match precondition to 0.
-    # If the destination object already exists in your bucket, set instead a
-    # generation-match precondition using its generation number.
-    # generation_match_precondition = 0
+    if isinstance(uploaded_file, UploadFile):
+        return (await stream_uploaded_file(job_id, bucket_name, uploaded_file, extension)).location
 
-    blob.upload_from_filename(source_file_name)  # , if_generation_match=generation_match_precondition)
+    file_service = get_file_service(bucket_name)
+    await file_service.upload_file(Path(uploaded_file), blob_dest)
+    return blob_dest
 
-    return {
-        'message': f"File {source_file_name} uploaded to {destination_blob_name}."
-    }
 
+async def stream_uploaded_file(job_id: str, bucket_name: str, uploaded_file: UploadFile, extension: str) -> StoredUpload:
+    """Upload a `fastapi.UploadFile` to `file_uploads/{job_id}/` in `bucket_name` chunk by chunk (as a resumable upload
+        for large files), hashing it on the fly, so that memory use does not depend on the size of the file.
 
-async def write_uploaded_file(job_id: str, bucket_name: str, uploaded_file: UploadFile, extension: str) -> str:
-    # bucket params
-    upload_prefix = f"file_uploads/{job_id}/"
-    bucket_prefix = f"gs://{bucket_name}/" + upload_prefix
+        Returns:
+            the location of the uploaded file in the bucket, with its sha256 hex digest and size in bytes.
+    """
+    check_upload_file_extension(uploaded_file, 'uploaded_file', extension)
+    blob_dest = f"file_uploads/{job_id}/" + uploaded_file.filename.split("/")[-1]
 
-    save_dest = mkdtemp()
-    fp = await save_uploaded_file(uploaded_file, save_dest)  # save uploaded file to ephemeral store
+    digest = hashlib.sha256()
+    size = 0
 
-    # Save uploaded omex file to Google Cloud Storage
-    uploaded_file_location = None
-    properly_formatted_omex = check_upload_file_extension(uploaded_file, 'uploaded_file', extension)
-    if properly_formatted_omex:
-        blob_dest = upload_prefix + fp.split("/")[-1]
-        upload_blob(bucket_name=bucket_name, source_file_name=fp, destination_blob_name=blob_dest)
-        uploaded_file_location = blob_dest
+    async def chunks() -> AsyncIterator[bytes]:
+        nonlocal size
+        async for chunk in iter_upload_chunks(uploaded_file, digest):
+            size += len(chunk)
+            yield chunk
 
-    return uploaded_file_location
+    await uploaded_file.seek(0)
+    await get_file_service(bucket_name).upload_stream(chunks(), blob_dest)
+    return StoredUpload(location=blob_dest, sha256=digest.hexdigest(), size=size)
 
 
-def download_blob(bucket_name, source_blob_name, destination_file_name):
-    """Downloads a blob from the bucket."""
-    # bucket_name = "your-bucket-name"
-    # source_blob_name = "storage-object-name"
-    # destination_file_name = "local/path/to/file"
+# -- local file cache -- #
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(source_blob_name)
+@contextmanager
+def file_lock(lock_fp: str) -> Iterator[None]:
+    """Exclusive advisory lock on `lock_fp` (created if needed), held across threads and processes of the same host."""
+    with open(lock_fp, 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
 
-    # Download the file to a destination
-    blob.download_to_filename(destination_file_name)
 
+class FileCache(object):
+    """Content-addressed on-disk cache of bucket objects.
 
-def download_file_from_bucket(source_blob_path: str, out_dir: str, bucket_name: str) -> str:
-    """Download any file specified in a given job_params (mongo db collection document) which is saved in the bucket to out_dir. The file is assumed to originate from bucket_name.
+        Entries are keyed by the object's content hash (or by its path plus generation when no hash is available) and
+        evicted least-recently-used first once their total size exceeds `max_bytes`. Concurrent fetches of the same key
+        are deduplicated: within a process by sharing one download task, and across processes by a per-key file lock.
+    """
+    LOCK_SUFFIX = ".lock"
+    PARTIAL_SUFFIX = ".part"
+
+    def __init__(self, root: str = DEFAULT_FILE_CACHE_DIR, max_bytes: int = DEFAULT_FILE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._inflight: Dict[str, asyncio.Future] = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def cache_key(bucket_name: str, blob_name: str, content_hash: str = None, generation: int | str = None) -> str:
+        identity = f"content:{content_hash}" if content_hash else f"gs://{bucket_name}/{blob_name}#{generation}"
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> str | None:
+        """Return the path of the cached entry for `key` (marking it as recently used) or `None` on a miss."""
+        path = self.entry_path(key)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    async def fetch(self, key: str, download: Callable[[str], Awaitable[Any]]) -> str:
+        """Return the path of the cached entry for `key`, awaiting `download(dest_fp)` to populate it on a miss."""
+        cached_fp = self.get(key)
+        if cached_fp is not None:
+            return cached_fp
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._populate(key, download))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _populate(self, key: str, download: Callable[[str], Awaitable[Any]]) -> str:
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + self.LOCK_SUFFIX, 'a') as lock_file:
+            # blocking wait for the lock happens off the event loop
+            await asyncio.to_thread(fcntl.flock, lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                # another process may have populated the entry while we were waiting for the lock
+                if self.get(key) is None:
+                    partial_fp = f"{path}.{uuid.uuid4().hex}{self.PARTIAL_SUFFIX}"
+                    try:
+                        await download(partial_fp)
+                        os.replace(partial_fp, path)
+                    finally:
+                        if os.path.exists(partial_fp):
+                            os.remove(partial_fp)
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+        await asyncio.to_thread(self.evict, keep=path)
+        return path
+
+    def evict(self, keep: str = None) -> int:
+        """Remove least-recently-used entries until the cache fits in `max_bytes`. Returns the number of bytes freed."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(self.LOCK_SUFFIX) or filename.endswith(self.PARTIAL_SUFFIX):
+                    continue
+                fp = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(fp)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fp))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, fp in sorted(entries):
+            if total_bytes - freed <= self.max_bytes:
+                break
+            if fp == keep:
+                continue
+            try:
+                os.remove(fp)
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+
+_file_cache: FileCache | None = None
+
+
+def get_file_cache() -> FileCache | None:
+    """Process-wide `FileCache` singleton, or `None` if caching is disabled (FILE_CACHE_MAX_BYTES=0)."""
+    global _file_cache
+    if _file_cache is None and DEFAULT_FILE_CACHE_MAX_BYTES > 0:
+        _file_cache = FileCache()
+    return _file_cache
+
+
+async def fetch_file(source_blob_path: str, out_dir: str, bucket_name: str, content_hash: str = None) -> str:
+    """Non-blocking, cached download of `source_blob_path` from the bucket. The object is served from the local `FileCache`
+        when its content (per the bucket's md5 hash, or `content_hash` if the caller already knows it, which also skips
+        the metadata request) has been fetched before, and is downloaded into the cache otherwise.
 
         Returns:
-            filepath (`str`) of the downloaded file.
+            filepath (`str`) of a private copy of the file in out_dir, which the caller is free to modify.
     """
-    source_blob_name = source_blob_path
-    local_fp = os.path.join(out_dir, source_blob_name.split('/')[-1])
-    download_blob(bucket_name=bucket_name, source_blob_name=source_blob_name, destination_file_name=local_fp)
+    local_fp = os.path.join(out_dir, source_blob_path.split('/')[-1])
+    file_service = get_file_service(bucket_name)
+    cache = get_file_cache()
+    if cache is None:
+        await file_service.download_file(source_blob_path, Path(local_fp))
+        return local_fp
+
+    if content_hash is None:
+        metadata = await file_service.get_metadata(source_blob_path)
+        key = FileCache.cache_key(bucket_name, source_blob_path, content_hash=metadata.md5Hash, generation=metadata.ETag)
+    else:
+        key = FileCache.cache_key(bucket_name, source_blob_path, content_hash=content_hash)
+
+    async def download(dest_fp: str):
+        await file_service.download_file(source_blob_path, Path(dest_fp))
+
+    # jobs may edit their inputs in place (ie: smoldyn configs), so never hand out the cache entry itself
+    cached_fp = await cache.fetch(key, download)
+    try:
+        await asyncio.to_thread(shutil.copyfile, cached_fp, local_fp)
+    except FileNotFoundError:
+        # evicted by another process between fetch and copy: fetch it once more
+        cached_fp = await cache.fetch(key, download)
+        await asyncio.to_thread(shutil.copyfile, cached_fp, local_fp)
     return local_fp
 
 
@@ -131,25 +318,6 @@ def get_sbml_species_mapping(sbml_fp: str) -> dict:
     return dict(zip(names, species_ids))
 
 
-def download_file(source_blob_path: str, out_dir: str, bucket_name: str) -> str:
-    """Download any file specified in a given job_params (mongo db collection document) to out_dir. The file is assumed to originate from bucket_name.
-
-        Returns:
-            filepath (`str`) of the downloaded file.
-    """
-    source_blob_name = source_blob_path
-    local_fp = os.path.join(out_dir, source_blob_name.split('/')[-1])
-    download_blob(bucket_name=bucket_name, source_blob_name=source_blob_name, destination_file_name=local_fp)
-    return local_fp
-
-
-def read_uploaded_file(bucket_name, source_blob_name, destination_file_name):
-    download_blob(bucket_name, source_blob_name, destination_file_name)
-
-    with open(destination_file_name, 'r') as f:
-        return f.read()
-
-
 async def _save_uploaded_file(uploaded_file: UploadFile | str, save_dest: str) -> str:
     """Write `fastapi.UploadFile` instance passed by api gateway user to `save_dest`."""
     if isinstance(uploaded_file, UploadFile):
@@ -160,15 +328,10 @@ async def _save_uploaded_file(uploaded_file: UploadFile | str, save_dest: str) -
     file_path = os.path.join(save_dest, filename)
     # case: is a fastapi upload
     if isinstance(uploaded_file, UploadFile):
-        with open(file_path, 'wb') as file:
-            contents = await uploaded_file.read()
-            file.write(contents)
+        await write_upload_chunks(uploaded_file, file_path)
     # case: is a string
     else:
-        with open(filename, 'r') as fp:
-            contents = fp.read()
-        with open(file_path, 'w') as f:
-            f.write(contents)
+        await asyncio.to_thread(shutil.copyfile, filename, file_path)
 
     return file_path
 
@@ -0,0 +1,110 @@
+"""
+Memoization of completed results for identical submissions.
+
+A job's fingerprint covers everything its results depend on: the normalized request (composition spec or time course
+parameters), the sha256 of each uploaded file (not its location, which embeds the job id), and the versions of the
+packages that compute it. The gateway fingerprints each submission; once the worker completes a job it maps the
+fingerprint to the job's stored results in the results-cache collection, and later submissions with the same fingerprint
+are answered with a job that is COMPLETE from the start and shares those results.
+
+Results of stochastic simulators only depend on their inputs if the run is seeded, so jobs involving them are only
+memoized when the submission carries an explicit seed.
+"""
+import hashlib
+import json
+from functools import lru_cache
+from importlib import metadata
+from typing import *
+
+from shared.environment import DEFAULT_RESULTS_CACHE_ENABLED
+
+
+# packages whose version may change the output of each simulator
+SIMULATOR_PACKAGES = {
+    "amici": ("amici",),
+    "cobra": ("cobra",),
+    "copasi": ("copasi-basico", "python-copasi"),
+    "pysces": ("pysces",),
+    "tellurium": ("tellurium", "libroadrunner"),
+    "smoldyn": ("smoldyn",),
+    "readdy": ("readdy",),
+    "pymem3dg": ("pymem3dg",),
+}
+# packages implementing the processes of every composition
+COMPOSITION_PACKAGES = ("process-bigraph", "biosimulator-processes")
+# simulators whose results are random unless seeded
+STOCHASTIC_SIMULATORS = ("smoldyn", "readdy")
+# fields of a completed job copied into its cache entry, so that hits can point at the original inputs
+CACHED_INPUT_FIELDS = ("spec", "model_file", "path")
+
+
+@lru_cache(maxsize=None)
+def _package_version(package: str) -> Optional[str]:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def package_versions(packages: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Installed version of each of `packages` (`None` for those that are not installed)."""
+    return {package: _package_version(package) for package in sorted(set(packages))}
+
+
+def simulator_versions(simulators: Iterable[str]) -> Dict[str, Optional[str]]:
+    packages = list(COMPOSITION_PACKAGES)
+    for simulator in simulators:
+        packages.extend(SIMULATOR_PACKAGES.get(simulator.lower(), ()))
+    return package_versions(packages)
+
+
+def composition_simulators(spec: Mapping[str, Any]) -> List[str]:
+    """Known simulators referenced by the process addresses (ie: `local:copasi-process`) of a composition `spec`."""
+    addresses = [str(node.get("address", "")).lower() for node in spec.values() if isinstance(node, Mapping)]
+    return sorted(simulator for simulator in SIMULATOR_PACKAGES if any(simulator in address for address in addresses))
+
+
+def canonical_json(obj: Any) -> str:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def job_fingerprint(
+        kind: str,
+        inputs: Mapping[str, Any],
+        simulators: Iterable[str],
+        seed: Optional[int] = None
+) -> Tuple[Optional[str], Dict[str, Optional[str]]]:
+    """Fingerprint of a job of `kind` (ie: the endpoint) run by `simulators` on `inputs`, and the package versions it
+        covers. The fingerprint is `None` (the job is not memoized) if a stochastic simulator is involved without a
+        `seed`, or if memoization is disabled.
+
+        Args:
+            kind: the type of job, so that identical inputs to different endpoints do not collide.
+            inputs: JSON-able request parameters, with uploaded files replaced by their content hash.
+            simulators: the simulators the job runs.
+            seed: random seed passed to the simulators, if any.
+    """
+    simulators = [simulator.lower() for simulator in simulators]
+    versions = simulator_versions(simulators)
+    if not DEFAULT_RESULTS_CACHE_ENABLED:
+        return None, versions
+    if seed is None and any(simulator in STOCHASTIC_SIMULATORS for simulator in simulators):
+        return None, versions
+
+    document = {"kind": kind, "inputs": inputs, "seed": seed, "versions": versions}
+    return hashlib.sha256(canonical_json(document).encode()).hexdigest(), versions
+
+
+def is_cacheable(job: Mapping[str, Any]) -> bool:
+    """Whether the results of completed `job` can be memoized: it was fingerprinted, and this process runs the package
+        versions that the fingerprint covers.
+    """
+    versions = job.get("versions")
+    return bool(job.get("fingerprint")) and versions is not None and package_versions(versions.keys()) == versions
+
+
+def contains_error(results: Any) -> bool:
+    """Whether `results` (or the results of one of its simulators) record an error rather than an output."""
+    if isinstance(results, Mapping):
+        return "error" in results or any(contains_error(value) for value in results.values() if isinstance(value, Mapping))
+    return False
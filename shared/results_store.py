@@ -0,0 +1,239 @@
+"""
+Binary, columnar storage for job results.
+
+Time series are kept as NumPy arrays end to end rather than being converted into BSON lists of doubles in the job
+document, which inflates them several-fold and runs into Mongo's 16 MB document limit on long runs. A set of named
+columns is stored either:
+
+    - inline, as one compressed npz value (see `shared.utils.pack_results`) when it is small, or
+    - as compressed npz objects in the file service, one per block of `chunk_rows` rows (all columns of a block in the
+      same object), with only a manifest describing the columns and chunks stored in Mongo.
+
+Either way the value written to the job's `results` is a small dict that `ResultsStore.read`/`expand` decode on demand:
+only the chunks overlapping the requested rows are downloaded, and only the requested columns are decompressed.
+"""
+import asyncio
+import io
+import math
+from typing import *
+
+import numpy as np
+
+from common.storage import FileService
+from shared.environment import DEFAULT_BUCKET_NAME, DEFAULT_RESULTS_CHUNK_ROWS, DEFAULT_RESULTS_INLINE_MAX_BYTES
+from shared.io import get_file_service
+from shared.utils import NPZ_FORMAT, encode_npz, decode_npz, pack_results, arrays_to_json
+
+
+RESULTS_PREFIX = "results"
+CHUNKED_FORMAT = "npz-chunks"
+MANIFEST_KEYS = ("format", "data", "location", "n_rows", "chunk_rows", "chunks", "columns")
+
+
+class ResultsStore(object):
+    def __init__(
+            self,
+            bucket_name: str = DEFAULT_BUCKET_NAME,
+            chunk_rows: int = DEFAULT_RESULTS_CHUNK_ROWS,
+            inline_max_bytes: int = DEFAULT_RESULTS_INLINE_MAX_BYTES,
+            file_service: FileService = None
+    ):
+        """
+        :param bucket_name: (`str`) bucket in which chunked results are stored.
+        :param chunk_rows: (`int`) number of rows (along axis 0) per stored chunk.
+        :param inline_max_bytes: (`int`) results whose arrays total at most this many bytes are stored inline.
+        :param file_service: (`FileService`) defaults to the pooled file service of `bucket_name`.
+        """
+        self.bucket_name = bucket_name
+        self.chunk_rows = chunk_rows
+        self.inline_max_bytes = inline_max_bytes
+        self._file_service = file_service
+
+    @property
+    def file_service(self) -> FileService:
+        return self._file_service or get_file_service(self.bucket_name)
+
+    @staticmethod
+    def is_stored(results: Any) -> bool:
+        """Whether `results` is a value written by `ResultsStore.write`."""
+        return isinstance(results, dict) and results.get("format") in (NPZ_FORMAT, CHUNKED_FORMAT)
+
+    @staticmethod
+    def attributes(results: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in results.items() if key not in MANIFEST_KEYS}
+
+    async def write(
+            self,
+            job_id: str,
+            columns: Mapping[str, Any],
+            key: str = None,
+            chunk_rows: int = None,
+            **attributes: Any
+    ) -> Dict[str, Any]:
+        """Store the named `columns` (arrays, or anything `np.asarray` accepts) of job `job_id` and return the value to
+            save as (part of) the job's results. `key` distinguishes several writes of the same job (ie: per simulator),
+            and `chunk_rows` overrides the store's rows per chunk (ie: for wide rows). Scalars are kept as plain
+            attributes alongside the JSON-able `attributes`.
+        """
+        chunk_rows = chunk_rows or self.chunk_rows
+        arrays = {}
+        for name, values in columns.items():
+            array = np.asarray(values)
+            if array.ndim == 0:
+                attributes[name] = array.item()
+            else:
+                arrays[name] = array
+
+        if sum(array.nbytes for array in arrays.values()) <= self.inline_max_bytes:
+            return await asyncio.to_thread(pack_results, arrays, **attributes)
+
+        location = "/".join([RESULTS_PREFIX, job_id] + ([key] if key else []))
+        names = list(arrays.keys())
+        n_rows = max(len(array) for array in arrays.values())
+        n_chunks = math.ceil(n_rows / chunk_rows)
+        chunks = [f"{location}/chunk-{i:05d}.npz" for i in range(n_chunks)]
+
+        async def write_chunk(i: int) -> None:
+            start = i * chunk_rows
+            members = {
+                f"c{j}": arrays[name][start:start + chunk_rows]
+                for j, name in enumerate(names)
+                if len(arrays[name]) > start
+            }
+            contents = await asyncio.to_thread(encode_npz, members)
+            await self.file_service.upload_bytes(file_contents=contents, gcs_path=chunks[i])
+
+        await asyncio.gather(*[write_chunk(i) for i in range(n_chunks)])
+        return {
+            "format": CHUNKED_FORMAT,
+            **attributes,
+            "location": location,
+            "n_rows": n_rows,
+            "chunk_rows": chunk_rows,
+            "chunks": chunks,
+            "columns": [
+                {
+                    "name": name,
+                    "member": f"c{j}",
+                    "dtype": np.lib.format.dtype_to_descr(arrays[name].dtype),
+                    "shape": list(arrays[name].shape)
+                }
+                for j, name in enumerate(names)
+            ],
+        }
+
+    async def select(self, results: Dict[str, Any], names: Iterable[str]) -> Dict[str, Any]:
+        """Restrict stored `results` to the columns in `names`, without rewriting any chunk."""
+        names = set(names)
+        if results["format"] == NPZ_FORMAT:
+            arrays = {name: array for name, array in decode_npz(results["data"]).items() if name in names}
+            return pack_results(arrays, **self.attributes(results))
+        return {**results, "columns": [column for column in results["columns"] if column["name"] in names]}
+
+    async def read(
+            self,
+            results: Dict[str, Any],
+            names: Iterable[str] = None,
+            start: int = 0,
+            stop: int = None,
+            step: int = 1
+    ) -> Dict[str, np.ndarray]:
+        """Decode the columns in `names` (all by default) of stored `results`, limited to rows `start:stop:step`."""
+        names = set(names) if names is not None else None
+        if results["format"] == NPZ_FORMAT:
+            arrays = decode_npz(results["data"])
+            return {name: array[start:stop:step] for name, array in arrays.items() if names is None or name in names}
+
+        columns = [column for column in results["columns"] if names is None or column["name"] in names]
+        n_rows = results["n_rows"]
+        chunk_rows = results["chunk_rows"]
+        stop = n_rows if stop is None else max(min(stop, n_rows), start)
+        first_chunk = start // chunk_rows
+        last_chunk = math.ceil(stop / chunk_rows)
+        members = [column["member"] for column in columns]
+
+        decoded = await asyncio.gather(*[
+            self._read_chunk(chunk, members) for chunk in results["chunks"][first_chunk:last_chunk]
+        ])
+        offset = first_chunk * chunk_rows
+        arrays = {}
+        for column in columns:
+            parts = [chunk[column["member"]] for chunk in decoded if column["member"] in chunk]
+            if parts:
+                array = np.concatenate(parts)
+            else:
+                array = np.empty([0] + column["shape"][1:], dtype=np.lib.format.descr_to_dtype(column["dtype"]))
+            arrays[column["name"]] = array[start - offset:stop - offset:step]
+        return arrays
+
+    async def iter_chunks(
+            self,
+            results: Dict[str, Any],
+            names: Iterable[str] = None,
+            start: int = 0,
+            stop: int = None,
+            step: int = 1
+    ) -> AsyncIterator[Tuple[int, Dict[str, np.ndarray]]]:
+        """Like `read`, but yield `(first_row, arrays)` one stored chunk at a time (downloading the next chunk while the
+            current one is consumed), so that memory is bounded by the chunk size rather than by the size of the results.
+        """
+        if results["format"] == NPZ_FORMAT:
+            yield start, await self.read(results, names=names, start=start, stop=stop, step=step)
+            return
+
+        names = set(names) if names is not None else None
+        columns = [column for column in results["columns"] if names is None or column["name"] in names]
+        members = [column["member"] for column in columns]
+        chunk_rows = results["chunk_rows"]
+        stop = results["n_rows"] if stop is None else min(stop, results["n_rows"])
+
+        # chunks holding at least one of the rows start:stop:step
+        chunk_ranges = []
+        for i in range(start // chunk_rows, math.ceil(stop / chunk_rows)):
+            chunk_start = i * chunk_rows
+            first_row = start if start >= chunk_start else chunk_start + (start - chunk_start) % step
+            chunk_stop = min(stop, chunk_start + chunk_rows)
+            if first_row < chunk_stop:
+                chunk_ranges.append((results["chunks"][i], chunk_start, first_row, chunk_stop))
+
+        prefetch = None
+        try:
+            for i, (chunk, chunk_start, first_row, chunk_stop) in enumerate(chunk_ranges):
+                current = prefetch or asyncio.ensure_future(self._read_chunk(chunk, members))
+                prefetch = None
+                if i + 1 < len(chunk_ranges):
+                    prefetch = asyncio.ensure_future(self._read_chunk(chunk_ranges[i + 1][0], members))
+                decoded = await current
+                yield first_row, {
+                    column["name"]: decoded[column["member"]][first_row - chunk_start:chunk_stop - chunk_start:step]
+                    for column in columns
+                    if column["member"] in decoded
+                }
+        finally:
+            if prefetch is not None:
+                prefetch.cancel()
+
+    async def _read_chunk(self, chunk: str, members: List[str]) -> Dict[str, np.ndarray]:
+        contents = await self.file_service.get_file_contents(gcs_path=chunk)
+        if contents is None:
+            raise FileNotFoundError(f"Results chunk {chunk} is missing.")
+        return await asyncio.to_thread(decode_members, contents, members)
+
+    async def expand(self, results: Any, **kwargs: Any) -> Any:
+        """Replace every stored value nested in `results` with its decoded, JSON-able contents. `kwargs` are passed to
+            `read` (ie: to decode only some rows).
+        """
+        if self.is_stored(results):
+            arrays = await self.read(results, **kwargs)
+            return {**self.attributes(results), **arrays_to_json(arrays)}
+        elif isinstance(results, dict):
+            keys = list(results.keys())
+            values = await asyncio.gather(*[self.expand(results[key], **kwargs) for key in keys])
+            return dict(zip(keys, values))
+        return results
+
+
+def decode_members(contents: bytes, members: List[str]) -> Dict[str, np.ndarray]:
+    """Decompress only `members` of the npz archive in `contents`."""
+    with np.load(io.BytesIO(contents), allow_pickle=False) as archive:
+        return {member: archive[member] for member in members if member in archive.files}
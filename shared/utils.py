@@ -1,3 +1,4 @@
+import io
 import os
 import traceback
 import uuid
@@ -26,6 +27,70 @@ def serialize_numpy(obj: Union[np.ndarray, list, dict]) -> Union[np.ndarray, lis
         return obj
 
 
+def serialize_document(obj: Any) -> Any:
+    """Recursively convert `obj` into a structure that BSON can encode directly: NumPy arrays and tuples become lists,
+        NumPy scalars become Python scalars and mapping keys become strings (as they would through a JSON round trip).
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, dict):
+        return {str(key): serialize_document(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [serialize_document(item) for item in obj]
+    else:
+        return obj
+
+
+# -- compact array serialization -- #
+
+NPZ_FORMAT = "npz"
+
+
+def encode_npz(arrays: Dict[str, np.ndarray], compress: bool = True) -> bytes:
+    """Serialize named NumPy arrays (including structured arrays) into the bytes of a (compressed) `.npz` archive."""
+    buffer = io.BytesIO()
+    if compress:
+        np.savez_compressed(buffer, **arrays)
+    else:
+        np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_npz(data: bytes) -> Dict[str, np.ndarray]:
+    """Inverse of `encode_npz`. Object arrays are refused, so that decoding never unpickles stored data."""
+    with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+def pack_results(arrays: Dict[str, np.ndarray], **attributes: Any) -> Dict[str, Any]:
+    """Wrap `arrays` as a single npz-encoded binary value (stored by BSON as-is) alongside JSON-able `attributes`."""
+    return {"format": NPZ_FORMAT, **attributes, "data": encode_npz(arrays)}
+
+
+def unpack_results(results: Any) -> Any:
+    """Expand results packed by `pack_results` into JSON-able lists, with structured arrays as `{field: column}`.
+        Any other results are returned unchanged.
+    """
+    if not isinstance(results, dict) or results.get("format") != NPZ_FORMAT:
+        return results
+    unpacked = {key: value for key, value in results.items() if key not in ("format", "data")}
+    unpacked.update(arrays_to_json(decode_npz(results["data"])))
+    return unpacked
+
+
+def arrays_to_json(arrays: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Convert named arrays into JSON-able lists, with structured arrays as `{field: column}`."""
+    converted = {}
+    for name, array in arrays.items():
+        if array.dtype.names is not None:
+            converted[name] = {field: array[field].tolist() for field in array.dtype.names}
+        else:
+            converted[name] = array.tolist()
+    return converted
+
+
 def handle_exception(scope: str) -> str:
     tb_str = traceback.format_exc()
     error_message = pformat(f"{scope}:\n{tb_str}")
@@ -36,6 +101,26 @@ def new_job_id(tag: str) -> str:
     return f"{tag}-{unique_id()}"
 
 
+# queue of jobs whose type is not recognized by `job_queue`, and submitter of jobs submitted without one
+DEFAULT_JOB_QUEUE = "default"
+ANONYMOUS_SUBMITTER = "anonymous"
+
+
+def job_queue(job_id: str) -> str:
+    """Scheduling queue of a job, from its id: the simulator for simulator runs (ie: `run-tellurium-step-...` is in
+        "tellurium"), "composition" for compositions, and "sweep" for parameter sweeps.
+    """
+    if job_id.startswith("composition"):
+        return "composition"
+    for simulator in ("smoldyn", "readdy"):
+        if job_id.startswith(f"simulation-execution-{simulator}"):
+            return simulator
+    if job_id.startswith("run-"):
+        parts = job_id.split("-")
+        return "sweep" if parts[2:3] == ["sweep"] else parts[1]
+    return DEFAULT_JOB_QUEUE
+
+
 def unique_id() -> str:
     return str(uuid.uuid4())
 
@@ -0,0 +1,364 @@
+"""
+In-memory stand-ins shared by the tests: a process pool that runs tasks inline, a file service and a database
+connector over documents held in memory, and the pymongo collection and GridFS bucket under the real connectors.
+"""
+import asyncio
+import copy
+import io
+import itertools
+import re
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import *
+
+import pytest
+
+from common.storage import FileService, ListingItem
+from shared.environment import DEFAULT_JOB_COLLECTION_NAME
+
+
+class InlinePool(object):
+    """Runs pool tasks in the calling process, yielding while they run and recording how many were in flight."""
+    slots = 2
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = []
+
+    async def run(self, fn, *args, **kwargs):
+        self.calls.append(getattr(fn, "__name__", fn))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            return fn(*args, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+class MemoryFileService(FileService):
+    def __init__(self):
+        self.blobs = {}
+        self.reads = []
+
+    async def download_file(self, gcs_path: str, file_path: Optional[Path] = None) -> tuple[str, str]:
+        raise NotImplementedError
+
+    async def upload_file(self, file_path: Path, gcs_path: str) -> str:
+        raise NotImplementedError
+
+    async def upload_bytes(self, file_contents: bytes, gcs_path: str) -> str:
+        self.blobs[gcs_path] = file_contents
+        return gcs_path
+
+    async def upload_stream(self, chunks, gcs_path: str) -> str:
+        self.blobs[gcs_path] = b"".join([chunk async for chunk in chunks])
+        return gcs_path
+
+    async def get_modified_date(self, gcs_path: str) -> datetime:
+        raise NotImplementedError
+
+    async def get_metadata(self, gcs_path: str) -> ListingItem:
+        raise NotImplementedError
+
+    async def get_listing(self, gcs_path: str) -> list[ListingItem]:
+        raise NotImplementedError
+
+    async def get_file_contents(self, gcs_path: str) -> bytes | None:
+        self.reads.append(gcs_path)
+        return self.blobs.get(gcs_path)
+
+    async def stream_file(self, gcs_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                          chunk_size: int = 1024 * 1024):
+        contents = self.blobs[gcs_path][start or 0:None if end is None else end + 1]
+        for offset in range(0, len(contents), chunk_size):
+            yield contents[offset:offset + chunk_size]
+
+    async def close(self) -> None:
+        pass
+
+
+_MISSING = object()
+
+
+def get_path(document: Any, path: str) -> Any:
+    for key in path.split("."):
+        if not isinstance(document, dict) or key not in document:
+            return _MISSING
+        document = document[key]
+    return document
+
+
+def matches(document: Mapping[str, Any], query: Mapping[str, Any]) -> bool:
+    """Whether `document` matches `query`: equality, or the `$regex`, `$in`, `$nin`, `$lte`, `$exists` and `$ne`
+        operators.
+    """
+    for path, condition in query.items():
+        value = get_path(document, path)
+        if not (isinstance(condition, dict) and all(key.startswith("$") for key in condition)):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$ne" and value == operand:
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+            if operator == "$nin" and value in operand:
+                return False
+            if operator == "$lte" and not (value is not _MISSING and value <= operand):
+                return False
+            if operator == "$exists" and (value is not _MISSING) != operand:
+                return False
+            if operator == "$regex" and not (isinstance(value, str) and re.search(operand, value)):
+                return False
+    return True
+
+
+def project(document: Mapping[str, Any], projection: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """`document` restricted by a mongo `projection`: exclusion of top-level fields, or inclusion of (dotted) paths,
+        optionally with a `$slice` of `[skip, count]` on arrays. Paths only descend into embedded documents.
+    """
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+    if all(not value for key, value in projection.items()):
+        return {key: value for key, value in document.items() if key not in projection}
+
+    projected = {}
+    for path, spec in projection.items():
+        if not spec:
+            continue
+        source, target = document, projected
+        keys = path.split(".")
+        for key in keys[:-1]:
+            if not isinstance(source, dict) or key not in source or not isinstance(source[key], dict):
+                break
+            source = source[key]
+            target = target.setdefault(key, {})
+        else:
+            if isinstance(source, dict) and keys[-1] in source:
+                value = source[keys[-1]]
+                if isinstance(spec, dict) and "$slice" in spec and isinstance(value, list):
+                    skip, count = spec["$slice"]
+                    value = value[skip:skip + count]
+                target[keys[-1]] = value
+    return projected
+
+
+class MemoryDatabase(object):
+    """Stand-in for a `DatabaseConnector` over collections held in memory, recording the projections read and the
+        job updates. Jobs in `stolen` are claimed by another replica just before this one claims them.
+    """
+    def __init__(self, *jobs, stolen: Iterable[str] = ()):
+        self.collections = {DEFAULT_JOB_COLLECTION_NAME: [dict(job) for job in jobs]}
+        self.stolen = set(stolen)
+        self.projections = []
+        self.updates = []
+        self.memoized = []
+        self.n_writes = 0
+
+    @property
+    def jobs(self) -> List[Dict[str, Any]]:
+        return self.collections[DEFAULT_JOB_COLLECTION_NAME]
+
+    @staticmethod
+    def timestamp():
+        return "2024-01-01 00:00:00"
+
+    def find(self, collection_name: str, query: Mapping[str, Any]) -> List[Dict[str, Any]]:
+        return [document for document in self.collections.get(collection_name, []) if matches(document, query)]
+
+    async def write(self, collection_name, **kwargs):
+        self.n_writes += 1
+        self.collections.setdefault(collection_name, []).append(dict(kwargs))
+        return kwargs
+
+    async def write_many(self, collection_name, documents):
+        self.n_writes += 1
+        self.collections.setdefault(collection_name, []).extend(dict(document) for document in documents)
+        return len(documents)
+
+    async def read(self, collection_name, projection=None, **kwargs):
+        self.projections.append(projection)
+        found = self.find(collection_name, kwargs)
+        return project(found[0], projection) if found else None
+
+    async def get_job_status(self, job_id):
+        from shared.database import JOB_STATUS_PROJECTION
+
+        return await self.read(DEFAULT_JOB_COLLECTION_NAME, projection=JOB_STATUS_PROJECTION, job_id=job_id)
+
+    async def count_statuses(self, **kwargs):
+        counts = {}
+        for job in self.find(DEFAULT_JOB_COLLECTION_NAME, kwargs):
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
+
+    async def pending_heads(self, job_filter=None):
+        return self.find(DEFAULT_JOB_COLLECTION_NAME, {**(job_filter or {}), "status": "PENDING"})
+
+    async def claim_job(self, job_filter=None):
+        pending = self.find(DEFAULT_JOB_COLLECTION_NAME, {**(job_filter or {}), "status": "PENDING"})
+        if not pending:
+            return None
+        job = min(pending, key=lambda document: str(document.get("last_updated")))
+        job["status"] = "IN_PROGRESS"
+        if job["job_id"] in self.stolen:
+            return None
+        return dict(job)
+
+    async def update_job(self, job_id, **params):
+        self.updates.append((job_id, params))
+        for job in self.find(DEFAULT_JOB_COLLECTION_NAME, {"job_id": job_id}):
+            for path, value in params.items():
+                *parents, key = path.split(".")
+                target = job
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                target[key] = value
+
+    async def find_many_cached_results(self, fingerprints):
+        return {}
+
+    async def memoize_job(self, job):
+        self.memoized.append(job["job_id"])
+        return True
+
+
+def set_paths(document: Dict[str, Any], values: Mapping[str, Any]) -> None:
+    """Apply a mongo `$set` of (dotted) paths to `document`."""
+    for path, value in values.items():
+        *parents, key = path.split(".")
+        target = document
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[key] = value
+
+
+class FakeCollection(object):
+    """The part of a pymongo `Collection` used by the connectors, over documents held in memory."""
+    def __init__(self):
+        self.documents = []
+
+    def insert_one(self, document):
+        self.documents.append(dict(document))
+
+    def insert_many(self, documents, ordered=True):
+        self.documents.extend(dict(document) for document in documents)
+
+    def facade(self) -> "AsyncFacade":
+        return AsyncFacade(self)
+
+    def find_one(self, filter, projection=None):
+        for document in self.documents:
+            if matches(document, filter):
+                return project(document, projection)
+        return None
+
+    def find_one_and_update(self, filter, update, sort=None, return_document=None):
+        for document in self.documents:
+            if matches(document, filter):
+                set_paths(document, update["$set"])
+                return dict(document)
+        return None
+
+    def update_one(self, filter, update):
+        self.find_one_and_update(filter, update)
+
+    def delete_many(self, filter):
+        kept = [document for document in self.documents if not matches(document, filter)]
+        deleted_count, self.documents[:] = len(self.documents) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted_count)
+
+    def distinct(self, key):
+        return list({get_path(document, key) for document in self.documents} - {_MISSING})
+
+
+class FakeGridOut(io.BytesIO):
+    def readchunk(self):
+        return self.read(4)
+
+
+class FakeGridFSBucket(object):
+    """The part of a `GridFSBucket` used by the connectors, storing files in memory (in 4-byte chunks)."""
+    def __init__(self):
+        self.files = {}
+        self._ids = itertools.count()
+
+    def upload_from_stream(self, filename, source, metadata=None):
+        file_id = next(self._ids)
+        self.files[file_id] = {"data": bytes(source), "filename": filename, "metadata": metadata}
+        return file_id
+
+    def open_download_stream(self, file_id):
+        return FakeGridOut(self.files[file_id]["data"])
+
+    def find(self, filter):
+        return [
+            SimpleNamespace(_id=file_id)
+            for file_id, file in self.files.items()
+            if matches({"_id": file_id, **file}, filter)
+        ]
+
+    def delete(self, file_id):
+        del self.files[file_id]
+
+    def facade(self) -> "AsyncFacade":
+        return AsyncFacade(self)
+
+
+class AsyncFacade(object):
+    """Awaitable counterpart of a fake, as seen through pymongo's async API."""
+    def __init__(self, fake):
+        self.fake = fake
+
+    def __getattr__(self, name):
+        attribute = getattr(self.fake, name)
+        if not callable(attribute):
+            return attribute
+        if name == "find":
+            # like `AsyncGridFSBucket.find`, a plain call returning an async cursor
+            return lambda *args, **kwargs: AsyncCursor(attribute(*args, **kwargs))
+
+        async def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return AsyncFacade(result) if isinstance(result, FakeGridOut) else result
+        return call
+
+
+class AsyncCursor(object):
+    def __init__(self, items):
+        self.items = items
+
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+
+@pytest.fixture
+def inline_pool() -> InlinePool:
+    return InlinePool()
+
+
+@pytest.fixture
+def memory_file_service() -> MemoryFileService:
+    return MemoryFileService()
+
+
+@pytest.fixture
+def memory_db() -> MemoryDatabase:
+    return MemoryDatabase()
+
+
+@pytest.fixture
+def fake_collections() -> Dict[str, FakeCollection]:
+    return defaultdict(FakeCollection)
+
+
+@pytest.fixture
+def fake_spill_bucket() -> FakeGridFSBucket:
+    return FakeGridFSBucket()
@@ -0,0 +1,60 @@
+import asyncio
+import io
+import json
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from gateway.handlers.batch import parse_overrides, merge_override, batch_status, submit_utc_batch, get_batch_status
+from shared import io as shared_io
+from shared.environment import DEFAULT_BUCKET_NAME, DEFAULT_JOB_COLLECTION_NAME, DEFAULT_BATCHES_COLLECTION_NAME
+
+
+def test_parse_and_merge_overrides():
+    assert parse_overrides(b'[{"a": 1}]') == [{"a": 1}]
+    for contents in (b'{"a": 1}', b'[]', b'[1]', b'[{"a": 1}, {"a": 2}]'):
+        with pytest.raises(HTTPException):
+            parse_overrides(contents, max_size=1)
+
+    base = {"copasi": {"address": "local:copasi-process", "config": {"model": {"model_source": "m.xml"}, "method": "lsoda"}}}
+    merged = merge_override(base, {"copasi": {"config": {"method": "deterministic"}}})
+    assert merged["copasi"]["config"] == {"model": {"model_source": "m.xml"}, "method": "deterministic"}
+    assert base["copasi"]["config"]["method"] == "lsoda"
+
+
+def test_batch_status_summarizes_job_statuses():
+    assert batch_status({"PENDING": 3}) == "PENDING"
+    assert batch_status({"PENDING": 1, "COMPLETE": 2}) == "IN_PROGRESS"
+    assert batch_status({"FAILED": 3}) == "FAILED"
+    assert batch_status({"FAILED": 1, "COMPLETE": 2}) == "COMPLETE"
+
+
+def test_utc_batch_uploads_once_and_inserts_in_bulk(monkeypatch, memory_file_service, memory_db):
+    file_service = memory_file_service
+    monkeypatch.setitem(shared_io._file_services, DEFAULT_BUCKET_NAME, file_service)
+    db_connector = memory_db
+    model_file = UploadFile(file=io.BytesIO(b"<sbml/>"), filename="model.xml")
+    overrides = [{"steps": steps} for steps in range(10, 20)]
+
+    batch = asyncio.run(submit_utc_batch(db_connector, "copasi", model_file, 0, 10, 100, overrides))
+    assert batch.n_jobs == 10 and len(set(batch.job_ids)) == 10
+    assert list(file_service.blobs.keys()) == [f"file_uploads/{batch.batch_id}/model.xml"]
+    assert db_connector.n_writes == 2
+
+    jobs = db_connector.collections[DEFAULT_JOB_COLLECTION_NAME]
+    assert [job["steps"] for job in jobs] == list(range(10, 20))
+    assert all(job["batch_id"] == batch.batch_id and job["job_id"].startswith("run-copasi-") for job in jobs)
+    assert len({job["fingerprint"] for job in jobs}) == 10
+    json.dumps(db_connector.collections[DEFAULT_BATCHES_COLLECTION_NAME][0])
+
+    jobs[0]["status"] = "COMPLETE"
+    status = asyncio.run(get_batch_status(db_connector, batch.batch_id))
+    assert status.status == "IN_PROGRESS" and status.statuses == {"COMPLETE": 1, "PENDING": 9}
+
+    with pytest.raises(HTTPException):
+        asyncio.run(submit_utc_batch(db_connector, "copasi", model_file, 0, 10, 100, [{"simulator": "amici"}]))
+    # model parameters are not applied by utc runs (see sweeps), and cobra has no utc executor
+    with pytest.raises(HTTPException):
+        asyncio.run(submit_utc_batch(db_connector, "copasi", model_file, 0, 10, 100, [{"params": {"k1": 2.0}}]))
+    with pytest.raises(HTTPException):
+        asyncio.run(submit_utc_batch(db_connector, "cobra", model_file, 0, 10, 100, overrides))
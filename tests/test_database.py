@@ -0,0 +1,182 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from shared.database import (
+    AsyncMongoConnector,
+    DatabaseConnector,
+    MongoConnector,
+    collection_indexes,
+    plan_stages,
+    is_indexed_plan,
+    plan_spill,
+    encode_spill_value,
+    decode_spill_value,
+    spill_reference,
+    is_spilled,
+    expiry
+)
+from shared.environment import (
+    DEFAULT_MONGO_MAX_POOL_SIZE,
+    DEFAULT_MONGO_MIN_POOL_SIZE,
+    DEFAULT_JOB_COLLECTION_NAME,
+    DEFAULT_RESULTS_CACHE_COLLECTION_NAME,
+    DEFAULT_RESULT_STATES_COLLECTION_NAME
+)
+
+
+MONGO_URI = os.getenv("MONGO_URI")
+
+
+def fake_connector(connector_type, collections, bucket, threshold: int):
+    """A connector of `connector_type` whose collections and spill bucket are the in-memory fakes `collections` (by
+        name) and `bucket` (see `tests.conftest`).
+    """
+    connector = connector_type(connection_uri="mongodb://localhost:27017", database_id="test")
+    is_async = connector_type is AsyncMongoConnector
+    connector.get_collection = lambda collection_name: (
+        collections[collection_name].facade() if is_async else collections[collection_name]
+    )
+    connector._spill_bucket = bucket.facade() if is_async else bucket
+    connector._indexes_ready = True
+    connector.spill_threshold = threshold
+    return connector
+
+
+def test_plan_spill_spills_fields_over_threshold():
+    document = {"job_id": "x" * 100, "results": list(range(1000)), "status": "COMPLETE", "spec": {"a": 1}}
+    spill = plan_spill(document, threshold=1024)
+    assert list(spill.keys()) == ["results"]
+    assert decode_spill_value(spill["results"]) == document["results"]
+
+
+def test_plan_spill_spills_largest_fields_until_document_fits():
+    document = {"a": "x" * 600, "b": "x" * 500, "c": "x" * 100}
+    spill = plan_spill(document, threshold=1024, max_document_bytes=800)
+    assert list(spill.keys()) == ["a"]
+    assert plan_spill(document, threshold=0) == {}
+
+
+def test_spilled_values_are_not_spilled_again():
+    reference = spill_reference(file_id="abc", size=10)
+    assert is_spilled(reference)
+    assert plan_spill({"results": reference}, threshold=1) == {}
+    assert len(encode_spill_value(reference)) > 0
+
+
+def test_async_connector_is_pooled_and_connects_lazily():
+    # created outside of any event loop, as the gateway does at import time
+    connector = AsyncMongoConnector(connection_uri="mongodb://localhost:27017", database_id="test")
+    pool_options = connector.client.options.pool_options
+    assert pool_options.max_pool_size == DEFAULT_MONGO_MAX_POOL_SIZE
+    assert pool_options.min_pool_size == DEFAULT_MONGO_MIN_POOL_SIZE
+    assert connector.db.name == "test"
+
+
+def test_connectors_share_the_async_job_interface():
+    import inspect
+
+    for connector_type in (MongoConnector, AsyncMongoConnector):
+        assert not connector_type.__abstractmethods__
+        for method in ("all_data", "get_jobs", "refresh_jobs", "claim_job", "update_job_status"):
+            assert inspect.iscoroutinefunction(getattr(connector_type, method)), (connector_type, method)
+    assert "all_data" in DatabaseConnector.__abstractmethods__
+
+
+@pytest.mark.parametrize("connector_type", [MongoConnector, AsyncMongoConnector])
+def test_claimed_jobs_have_their_spilled_inputs_reassembled(connector_type, fake_collections, fake_spill_bucket):
+    collection, bucket = fake_collections[DEFAULT_JOB_COLLECTION_NAME], fake_spill_bucket
+    connector = fake_connector(connector_type, fake_collections, bucket, threshold=64)
+    spec = {"copasi": {"address": "local:copasi-process", "config": {"model": {"model_source": "m" * 100}}}}
+
+    async def submit_and_claim():
+        await connector.write(DEFAULT_JOB_COLLECTION_NAME, job_id="composition-1", status="PENDING", spec=spec)
+        return await connector.claim_job(job_filter={"job_id": {"$regex": "^composition"}})
+
+    job = asyncio.run(submit_and_claim())
+    assert is_spilled(collection.documents[0]["spec"]) and len(bucket.files) == 1
+    assert job["status"] == "IN_PROGRESS"
+    assert job["spec"] == spec
+    assert asyncio.run(connector.claim_job()) is None
+
+
+@pytest.mark.parametrize("connector_type", [MongoConnector, AsyncMongoConnector])
+def test_overwritten_spilled_values_are_deleted(connector_type, fake_collections, fake_spill_bucket):
+    jobs, bucket = fake_collections[DEFAULT_JOB_COLLECTION_NAME], fake_spill_bucket
+    connector = fake_connector(connector_type, fake_collections, bucket, threshold=64)
+    jobs.insert_one({"job_id": "utc-1", "status": "IN_PROGRESS"})
+    copasi_results, tellurium_results = {"S1": list(range(50))}, {"S1": list(range(60))}
+
+    async def run_utc():
+        # as `run_utc` does: each simulator's results as they finish, then all of them
+        await connector.update_job("utc-1", **{"results.copasi": copasi_results})
+        await connector.update_job("utc-1", **{"results.tellurium": tellurium_results})
+        await connector.update_job("utc-1", status="COMPLETE", results={"copasi": copasi_results, "tellurium": tellurium_results})
+        return await connector.read(DEFAULT_JOB_COLLECTION_NAME, job_id="utc-1")
+
+    job = asyncio.run(run_utc())
+    assert job["results"] == {"copasi": copasi_results, "tellurium": tellurium_results}
+    assert [file["metadata"]["field"] for file in bucket.files.values()] == ["results"]
+
+
+@pytest.mark.parametrize("connector_type", [MongoConnector, AsyncMongoConnector])
+def test_spilled_values_shared_through_the_results_cache_are_kept(connector_type, fake_collections, fake_spill_bucket):
+    bucket = fake_spill_bucket
+    connector = fake_connector(connector_type, fake_collections, bucket, threshold=64)
+    fake_collections[DEFAULT_JOB_COLLECTION_NAME].insert_many([{"job_id": "source"}, {"job_id": "other"}])
+    fake_collections[DEFAULT_RESULTS_CACHE_COLLECTION_NAME].insert_one({"fingerprint": "f", "job_id": "source"})
+
+    async def update_and_refresh():
+        for job_id in ("source", "other"):
+            await connector.update_job(job_id, results=list(range(50)))
+            await connector.update_job(job_id, results=list(range(60)))
+        return await connector.refresh_jobs()
+
+    assert asyncio.run(update_and_refresh()) == 2
+    assert sorted(file["metadata"]["job_id"] for file in bucket.files.values()) == ["source", "source"]
+
+
+@pytest.mark.parametrize("connector_type", [MongoConnector, AsyncMongoConnector])
+def test_values_spilled_from_expired_documents_are_swept(connector_type, fake_collections, fake_spill_bucket):
+    bucket = fake_spill_bucket
+    connector = fake_connector(connector_type, fake_collections, bucket, threshold=64)
+
+    async def write_states():
+        await connector.write(DEFAULT_RESULT_STATES_COLLECTION_NAME, job_id="old", state=list(range(50)), expire_at=expiry(-1))
+        await connector.write(DEFAULT_RESULT_STATES_COLLECTION_NAME, job_id="new", state=list(range(50)), expire_at=expiry(60))
+
+    asyncio.run(write_states())
+    assert [file["metadata"]["job_id"] for file in bucket.files.values()] == ["new"]
+
+
+def test_job_lookups_are_indexed():
+    job_indexes = {index.document["name"]: index.document for index in collection_indexes()[DEFAULT_JOB_COLLECTION_NAME]}
+    assert job_indexes["job_id_unique"]["unique"]
+    assert job_indexes["batch_id_status_partial"]["partialFilterExpression"] == {"batch_id": {"$exists": True}}
+    # jobs are kept until deleted: only result states expire
+    assert "expire_at_ttl" not in job_indexes
+    state_indexes = {index.document["name"]: index.document for index in collection_indexes()[DEFAULT_RESULT_STATES_COLLECTION_NAME]}
+    assert state_indexes["expire_at_ttl"]["expireAfterSeconds"] == 0
+
+    indexed = {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "job_id_unique"}}}}
+    sbe_scan = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "LIMIT", "inputStage": {"stage": "COLLSCAN"}}}}}
+    assert plan_stages(indexed) == ["FETCH", "IXSCAN"]
+    assert is_indexed_plan(indexed)
+    assert plan_stages(sbe_scan) == ["LIMIT", "COLLSCAN"]
+    assert not is_indexed_plan(sbe_scan)
+
+
+@pytest.mark.skipif(MONGO_URI is None, reason="requires a mongo deployment (MONGO_URI)")
+def test_status_polls_use_the_job_id_index():
+    connector = MongoConnector(connection_uri=MONGO_URI, database_id=f"test_{uuid.uuid4().hex[:8]}")
+    try:
+        connector.ensure_indexes()
+        coll = connector.get_collection(DEFAULT_JOB_COLLECTION_NAME)
+        coll.insert_many([{"job_id": f"job-{i}", "status": "PENDING", "last_updated": str(i)} for i in range(1000)])
+        assert is_indexed_plan(connector.explain_find(DEFAULT_JOB_COLLECTION_NAME, job_id="job-500"))
+        assert is_indexed_plan(connector.explain_find(DEFAULT_JOB_COLLECTION_NAME, status="PENDING"))
+    finally:
+        connector.client.drop_database(connector.database_id)
+        connector.client.close()
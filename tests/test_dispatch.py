@@ -0,0 +1,188 @@
+import asyncio
+
+import numpy as np
+from pymongo.errors import OperationFailure
+
+from shared.environment import DEFAULT_JOB_COLLECTION_NAME, DEFAULT_RESULT_STATES_COLLECTION_NAME
+from worker import dispatch
+from worker.dispatch import JobDispatcher
+
+
+def pending(job_id: str, submitted: int = 0) -> dict:
+    return {"job_id": job_id, "status": "PENDING", "last_updated": f"2024-01-01 00:00:{submitted:02d}"}
+
+
+def scripted_drain(dispatcher: JobDispatcher, counts) -> list:
+    """Replace `dispatcher.drain` by one returning the numbers of jobs dispatched in `counts`, and record its calls."""
+    counts, calls = iter(counts), []
+
+    async def drain():
+        calls.append(1)
+        return next(counts)
+
+    dispatcher.drain = drain
+    return calls
+
+
+async def free_slots(dispatcher: JobDispatcher) -> int:
+    n_free = 0
+    while not dispatcher.slots.locked():
+        await dispatcher.slots.acquire()
+        n_free += 1
+    return n_free
+
+
+def test_claims_only_dispatchable_jobs(memory_db, inline_pool):
+    jobs = memory_db
+    jobs.jobs.extend([
+        pending("files-generate-simularium-1", submitted=0),
+        pending("run-copasi-1", submitted=1),
+        {**pending("composition-1", submitted=2), "status": "COMPLETE"},
+        pending("composition-2", submitted=3),
+    ])
+    dispatcher = JobDispatcher(db_connector=jobs, pool=inline_pool)
+
+    first = asyncio.run(dispatcher.claim_job())
+    second = asyncio.run(dispatcher.claim_job())
+    assert (first["job_id"], second["job_id"]) == ("run-copasi-1", "composition-2")
+    assert first["status"] == second["status"] == "IN_PROGRESS"
+    assert asyncio.run(dispatcher.claim_job()) is None
+    # jobs of other services stay in the queue
+    assert jobs.find(DEFAULT_JOB_COLLECTION_NAME, {"job_id": "files-generate-simularium-1"})[0]["status"] == "PENDING"
+
+    # a job claimed by another replica first is not dispatched twice
+    jobs.jobs.append(pending("run-amici-1", submitted=4))
+    jobs.stolen.add("run-amici-1")
+    assert asyncio.run(dispatcher.claim_job()) is None
+
+
+def test_drain_releases_its_slot_once_the_queue_is_empty(memory_db, inline_pool):
+    jobs = memory_db
+    simulators = ["amici", "copasi", "tellurium"]
+    jobs.jobs.extend(pending(f"run-{simulator}-1", submitted=i) for i, simulator in enumerate(simulators))
+    dispatcher = JobDispatcher(db_connector=jobs, pool=inline_pool)
+    dispatched = []
+
+    async def dispatch(job):
+        await asyncio.sleep(0.001)
+        dispatched.append(job["job_id"])
+
+    dispatcher.dispatch = dispatch
+
+    async def drain_twice():
+        # more jobs than slots: the third claim waits for one of the first two jobs to finish
+        n_dispatched = await dispatcher.drain()
+        await asyncio.gather(*dispatcher._tasks)
+        return n_dispatched, await dispatcher.drain(), await free_slots(dispatcher)
+
+    assert asyncio.run(drain_twice()) == (3, 0, inline_pool.slots)
+    assert sorted(dispatched) == [f"run-{simulator}-1" for simulator in simulators]
+    assert sum(dispatcher.scheduler.running_queues.values()) == 0
+
+
+def test_poll_backs_off_while_idle_and_resets_on_work(memory_db, inline_pool, monkeypatch):
+    dispatcher = JobDispatcher(db_connector=memory_db, pool=inline_pool)
+    scripted_drain(dispatcher, [0, 0, 0, 2, 0])
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    asyncio.run(dispatcher.poll(min_wait=0.1, max_wait=0.3, limit=5))
+    assert waits == [0.2, 0.3, 0.3, 0.1, 0.2]
+
+
+class FakeChangeStream(object):
+    """Change stream that times out `n_events` times before being closed by the server."""
+    def __init__(self, n_events: int):
+        self.n_events = n_events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def alive(self) -> bool:
+        return self.n_events > 0
+
+    def try_next(self):
+        self.n_events -= 1
+        return None
+
+
+def test_listen_drains_on_change_stream_events(memory_db, inline_pool):
+    jobs = memory_db
+    jobs.watch_jobs = lambda max_await_time_ms: FakeChangeStream(n_events=2)
+    dispatcher = JobDispatcher(db_connector=jobs, pool=inline_pool)
+    calls = scripted_drain(dispatcher, [1, 0, 0])
+    asyncio.run(dispatcher.listen(min_wait=0.1, max_wait=2))
+    # once for the jobs submitted before the stream was opened, then once per event
+    assert len(calls) == 3
+
+
+def test_listen_falls_back_to_polling_without_change_streams(memory_db, inline_pool):
+    jobs = memory_db
+
+    def watch_jobs(max_await_time_ms):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets")
+
+    jobs.watch_jobs = watch_jobs
+    dispatcher = JobDispatcher(db_connector=jobs, pool=inline_pool)
+    polls = []
+
+    async def poll(min_wait, max_wait):
+        polls.append((min_wait, max_wait))
+
+    dispatcher.poll = poll
+    asyncio.run(dispatcher.listen(min_wait=0.1, max_wait=2))
+    assert polls == [(0.1, 2)]
+
+
+class FakeComposite(object):
+    """Stand-in for a `process_bigraph.Composite` whose emitter records the time of each step it is run for."""
+    builds = 0
+
+    def __init__(self, input_state):
+        FakeComposite.builds += 1
+        self.state = input_state
+        self.composition = {"membrane": "process"}
+        self.core = self
+        self.times = []
+
+    def run(self, duration):
+        self.times.extend(np.arange(duration + 1.))
+
+    def gather_results(self):
+        return {("emitter",): {"time": np.array(self.times)}}
+
+    def serialize_state(self):
+        return {"time": self.times[-1]}
+
+    def representation(self, composition):
+        return dict(composition)
+
+
+def test_compositions_are_built_once_and_report_their_timings(memory_db, inline_pool, monkeypatch):
+    jobs = memory_db
+    job = {"job_id": "composition-1", "status": "IN_PROGRESS", "spec": {"membrane": {"config": {}}}, "duration": 2}
+    jobs.jobs.append(job)
+    monkeypatch.setattr(JobDispatcher, "generate_composite", staticmethod(FakeComposite))
+    FakeComposite.builds = 0
+
+    results, state, timings = dispatch.run_composition(job["spec"], job["duration"])
+    assert results == {"time": [0., 1., 2.]}
+    assert state == {"state": {"time": 2.}, "composition": {"membrane": "process"}}
+    assert sorted(timings) == ["construct", "run", "serialize"]
+    assert all(seconds >= 0 for seconds in timings.values())
+
+    dispatcher = JobDispatcher(db_connector=jobs, pool=inline_pool)
+    asyncio.run(dispatcher.dispatch_composition(job))
+    assert FakeComposite.builds == 2 and inline_pool.calls == ["run_composition"]
+    job_id, update = jobs.updates[-1]
+    assert job_id == "composition-1" and update["status"] == "COMPLETE"
+    assert sorted(update["timings"]) == ["construct", "run", "serialize"]
+    assert jobs.collections[DEFAULT_RESULT_STATES_COLLECTION_NAME][0]["data"] == state
+    assert jobs.memoized == ["composition-1"]
@@ -0,0 +1,97 @@
+import asyncio
+
+import numpy as np
+
+from worker.pool import TaskSlots
+from worker.sim_runs.ensemble import EnsembleStatistics, P2Quantile, RunningMoments, replicate_seeds, run_ensemble
+
+
+def noisy_decay(seed: int, fail: bool = False):
+    """Stand-in for a stochastic replicate: two species around a decaying mean."""
+    if fail:
+        return {"error": "replicate failed"}
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 1, 11)
+    counts = 100 * np.exp(-t)[:, None] + rng.normal(0, 5, size=(11, 2))
+    return {"header": ["time", "A", "B"], "values": np.column_stack([t, counts])}
+
+
+def test_running_moments_match_numpy():
+    samples = np.random.default_rng(0).normal(size=(50, 4, 3))
+    moments = RunningMoments()
+    for sample in samples:
+        moments.update(sample)
+    np.testing.assert_allclose(moments.mean, samples.mean(axis=0))
+    np.testing.assert_allclose(moments.variance, samples.var(axis=0, ddof=1))
+    np.testing.assert_allclose(moments.minimum, samples.min(axis=0))
+    np.testing.assert_allclose(moments.maximum, samples.max(axis=0))
+
+
+def test_p2_quantiles_approximate_exact_quantiles():
+    samples = np.random.default_rng(1).normal(size=(4000, 3))
+    estimators = [P2Quantile(p) for p in (0.05, 0.5, 0.95)]
+    for sample in samples:
+        for estimator in estimators:
+            estimator.update(sample)
+    for estimator in estimators:
+        np.testing.assert_allclose(estimator.value(), np.quantile(samples, estimator.p, axis=0), atol=0.1)
+
+    # exact while there are fewer observations than markers
+    few = P2Quantile(0.5)
+    for value in (3., 1., 2.):
+        few.update(np.array([value]))
+    assert few.value().tolist() == [2.]
+
+
+def test_run_ensemble_reduces_replicates_and_skips_failures(inline_pool):
+    seeds = replicate_seeds(42, 20)
+    assert seeds == replicate_seeds(42, 20)
+    assert len(set(seeds)) == 20
+
+    replicates = [{"seed": seed, "fail": i == 3} for i, seed in enumerate(seeds)]
+    ensemble = asyncio.run(run_ensemble(inline_pool, noisy_decay, replicates))
+    assert ensemble["header"] == ["A", "B"]
+    assert ensemble["n_replicates"] == 19
+    assert ensemble["failed"] == [3]
+    np.testing.assert_allclose(ensemble["time"], np.linspace(0, 1, 11))
+
+    counts = np.stack([noisy_decay(seed)["values"][:, 1:] for i, seed in enumerate(seeds) if i != 3])
+    statistics = ensemble["statistics"]
+    np.testing.assert_allclose(statistics["mean"], counts.mean(axis=0))
+    np.testing.assert_allclose(statistics["variance"], counts.var(axis=0, ddof=1))
+    assert set(statistics) == {"mean", "variance", "min", "max"} | {f"quantile_{p:g}" for p in (0.05, 0.25, 0.5, 0.75, 0.95)}
+    assert np.all(statistics["quantile_0.05"] <= statistics["quantile_0.95"])
+
+    assert "error" in asyncio.run(run_ensemble(inline_pool, noisy_decay, [{"seed": 0, "fail": True}]))
+
+
+def test_ensemble_statistics_shapes():
+    statistics = EnsembleStatistics(quantiles=(0.5,))
+    for i in range(7):
+        statistics.update(np.full((5, 2), float(i)))
+    result = statistics.result()
+    assert all(value.shape == (5, 2) for value in result.values())
+    np.testing.assert_allclose(result["mean"], 3.)
+    np.testing.assert_allclose(result["quantile_0.5"], 3., atol=1.)
+
+
+def test_run_ensemble_bounds_replicates_in_flight(inline_pool):
+    replicates = [{"seed": seed} for seed in replicate_seeds(0, 12)]
+    pool = inline_pool
+    assert asyncio.run(run_ensemble(pool, noisy_decay, replicates))["n_replicates"] == 12
+    assert pool.max_in_flight == pool.slots
+
+    async def run_in_dispatcher(charge):
+        # 4 dispatcher slots: one held by the ensemble's job, one by another job, leaving two to borrow
+        shared = asyncio.Semaphore(4)
+        await shared.acquire()
+        await shared.acquire()
+        pool.max_in_flight = 0
+        ensemble = await run_ensemble(pool, noisy_decay, replicates, slots=TaskSlots(shared=shared, charge=charge))
+        return ensemble, pool.max_in_flight, shared._value
+
+    ensemble, max_in_flight, free = asyncio.run(run_in_dispatcher(charge=lambda: True))
+    assert (ensemble["n_replicates"], max_in_flight, free) == (12, 3, 2)
+    # the scheduler refuses extra slots: one replicate at a time, on the job's own slot
+    ensemble, max_in_flight, free = asyncio.run(run_in_dispatcher(charge=lambda: False))
+    assert (ensemble["n_replicates"], max_in_flight, free) == (12, 1, 2)
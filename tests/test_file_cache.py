@@ -0,0 +1,55 @@
+import asyncio
+import os
+
+from shared.io import FileCache
+
+
+def make_download(calls: list, contents: bytes):
+    async def download(dest_fp: str):
+        calls.append(dest_fp)
+        await asyncio.sleep(0.01)
+        with open(dest_fp, 'wb') as f:
+            f.write(contents)
+    return download
+
+
+def test_fetch_deduplicates_concurrent_downloads(tmp_path):
+    cache = FileCache(root=str(tmp_path), max_bytes=1024)
+    key = FileCache.cache_key("bucket", "file_uploads/job/model.xml", content_hash="abc")
+    calls = []
+
+    async def fetch_many():
+        download = make_download(calls, b"<sbml/>")
+        return await asyncio.gather(*[cache.fetch(key, download) for _ in range(5)])
+
+    paths = asyncio.run(fetch_many())
+    assert len(set(paths)) == 1
+    assert len(calls) == 1
+    with open(paths[0], 'rb') as f:
+        assert f.read() == b"<sbml/>"
+
+    # a second fetch is a hit
+    asyncio.run(cache.fetch(key, make_download(calls, b"<sbml/>")))
+    assert len(calls) == 1
+
+
+def test_cache_key_prefers_content_hash():
+    a = FileCache.cache_key("bucket", "file_uploads/job-a/model.xml", content_hash="abc", generation=1)
+    b = FileCache.cache_key("bucket", "file_uploads/job-b/model.xml", content_hash="abc", generation=2)
+    c = FileCache.cache_key("bucket", "file_uploads/job-a/model.xml", generation=1)
+    assert a == b
+    assert a != c
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = FileCache(root=str(tmp_path), max_bytes=10)
+    keys = [FileCache.cache_key("bucket", str(i), content_hash=str(i)) for i in range(3)]
+    calls = []
+    for i, key in enumerate(keys):
+        asyncio.run(cache.fetch(key, make_download(calls, b"12345")))
+        os.utime(cache.entry_path(key), (i, i))
+
+    cache.evict()
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) is not None
+    assert cache.get(keys[2]) is not None
@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from worker.sim_runs import model_cache
+from worker.sim_runs.model_cache import ModelCache, WarmModelPool
+
+
+def write_model(tmp_path, name: str, contents: str) -> str:
+    fp = str(tmp_path / name)
+    with open(fp, 'w') as f:
+        f.write(contents)
+    return fp
+
+
+def test_builds_each_entry_once(tmp_path):
+    cache = ModelCache("amici", root=str(tmp_path / "cache"), max_bytes=1024)
+    model_fp = write_model(tmp_path, "model.xml", "<sbml/>")
+    key = ModelCache.model_key(model_fp, "0.1.0")
+    builds = []
+
+    def build(output_dir: str):
+        builds.append(output_dir)
+        with open(os.path.join(output_dir, "module.so"), 'w') as f:
+            f.write("compiled")
+
+    first = cache.get_or_build(key, build)
+    second = cache.get_or_build(key, build)
+    assert first == second
+    assert len(builds) == 1
+    assert os.path.exists(os.path.join(first, "module.so"))
+
+
+def test_model_key_depends_on_content_and_salt(tmp_path):
+    a = ModelCache.model_key(write_model(tmp_path, "a.xml", "<sbml/>"), "0.1.0")
+    b = ModelCache.model_key(write_model(tmp_path, "b.xml", "<sbml/>"), "0.1.0")
+    c = ModelCache.model_key(write_model(tmp_path, "c.xml", "<sbml/>"), "0.2.0")
+    assert a == b
+    assert a != c
+
+
+def test_failed_build_leaves_no_entry(tmp_path):
+    cache = ModelCache("amici", root=str(tmp_path / "cache"), max_bytes=1024)
+
+    def build(output_dir: str):
+        raise RuntimeError("compilation failed")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_build("key", build)
+    assert cache.get("key") is None
+    assert not os.path.exists(cache.entry_dir("key"))
+    assert not os.path.exists(cache.entry_dir("key") + ModelCache.LOCK_SUFFIX)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ModelCache("amici", root=str(tmp_path / "cache"), max_bytes=10)
+    keys = ["a", "b", "c"]
+    for i, key in enumerate(keys):
+        entry_dir = cache.get_or_build(key, lambda output_dir: open(os.path.join(output_dir, "m"), 'w').write("12345"))
+        os.utime(os.path.join(entry_dir, ModelCache.COMPLETE_MARKER), (i, i))
+
+    cache.evict()
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.get("c") is not None
+
+
+def test_eviction_removes_lock_files_and_spares_entries_in_use(tmp_path):
+    cache = ModelCache("amici", root=str(tmp_path / "cache"), max_bytes=10, grace_seconds=60)
+    for key in ("a", "b", "c"):
+        cache.get_or_build(key, lambda output_dir: open(os.path.join(output_dir, "m"), 'w').write("12345"))
+    # every entry was used within the grace period, ie: is being imported by the worker that asked for it
+    assert cache.evict() == 0
+    assert sorted(os.listdir(cache.root)) == ["a", "a.lock", "b", "b.lock", "c", "c.lock"]
+
+    os.utime(os.path.join(cache.entry_dir("a"), ModelCache.COMPLETE_MARKER), (0, 0))
+    assert cache.evict() == 5
+    assert sorted(os.listdir(cache.root)) == ["b", "b.lock", "c", "c.lock"]
+    # a miss leaves no lock file behind
+    assert cache.get("a") is None
+    assert not os.path.exists(cache.entry_dir("a") + ModelCache.LOCK_SUFFIX)
+
+
+def test_warm_model_pool_reuses_and_evicts_instances(monkeypatch):
+    # every load grows the resident set by 10 bytes
+    rss = iter(range(0, 1000, 10))
+    monkeypatch.setattr(model_cache, "resident_set_size", lambda: next(rss))
+    pool = WarmModelPool(max_bytes=15)
+    loads, closed = [], []
+
+    def load():
+        loads.append(1)
+        return object()
+
+    first = pool.acquire("tellurium", "a", load, close=closed.append)
+    assert pool.acquire("tellurium", "a", load, close=closed.append) is first
+    assert len(loads) == 1
+
+    pool.acquire("copasi", "a", load, close=closed.append)
+    assert closed == [first]
+    assert pool.total_bytes == 10
+
+    pool.discard("copasi", "a")
+    pool.acquire("copasi", "a", load)
+    assert len(loads) == 3
@@ -0,0 +1,113 @@
+import asyncio
+
+import numpy as np
+
+from gateway.handlers.output import (
+    OutputWindow,
+    ResultsPage,
+    output_projection,
+    iter_columns,
+    ndjson_line,
+    read_output_document,
+    get_job_output,
+    OUTPUT_EXCLUDED_FIELDS
+)
+from shared.database import JOB_STATUS_PROJECTION
+from shared.results_store import ResultsStore
+
+
+def test_window_rows_include_one_row_past_the_page():
+    assert OutputWindow().rows() == (0, None)
+    assert OutputWindow(start=10, stride=2, cursor=5, limit=3).rows() == (20, 27)
+    assert OutputWindow(start=10, stop=22, stride=2, cursor=5, limit=3).rows() == (20, 22)
+
+
+def test_projection_pushes_species_and_rows_down():
+    projection, pushed_down = output_projection(OutputWindow(species=["A"], start=5, stop=10), ["amici"])
+    assert pushed_down
+    assert projection["results.A"] == {"$slice": [5, 5]}
+    assert projection["results.amici.A"] == {"$slice": [5, 5]}
+    assert projection["results.amici.columns"] == 1
+    assert "spec" not in projection
+
+    projection, pushed_down = output_projection(OutputWindow(start=5), ["amici"])
+    assert not pushed_down
+    assert projection["spec"] == 0
+
+
+def test_page_of_inline_and_stored_results():
+    store = ResultsStore()
+    stored = asyncio.run(store.write("job", {"A": np.arange(10.0), "B": np.arange(10.0)}))
+    results = {"amici": stored, "copasi": {"A": list(range(10)), "B": list(range(10))}, "tellurium": {"error": "x"}}
+
+    page = ResultsPage(OutputWindow(species=["A"], start=1, stride=2, limit=2), store, pushed_down=False)
+    expanded = asyncio.run(page.expand(results))
+    assert expanded == {"amici": {"A": [1.0, 3.0]}, "copasi": {"A": [1, 3]}, "tellurium": {"error": "x"}}
+    assert page.next_cursor == 2
+
+    page = ResultsPage(OutputWindow(species=["A"], start=1, stride=2, cursor=4, limit=2), store, pushed_down=False)
+    expanded = asyncio.run(page.expand(results))
+    assert expanded["copasi"] == {"A": [9]}
+    assert page.next_cursor is None
+
+
+def test_stream_columns_one_chunk_at_a_time(memory_file_service):
+    file_service = memory_file_service
+    store = ResultsStore(chunk_rows=4, inline_max_bytes=0, file_service=file_service)
+    stored = asyncio.run(store.write("job", {"A": np.arange(10.0)}))
+    results = {"amici": stored, "copasi": {"A": list(range(10))}}
+    window = OutputWindow(start=1, stride=3, cursor=1, limit=2).unpaginated()
+    assert (window.start, window.stop) == (4, 10)
+
+    async def collect():
+        return [column async for column in iter_columns(results, window, store, False, rows_per_line=1)]
+
+    assert asyncio.run(collect()) == [
+        (["amici", "A"], 4, [4.0]),
+        (["amici", "A"], 7, [7.0]),
+        (["copasi", "A"], 4, [4]),
+        (["copasi", "A"], 7, [7]),
+    ]
+    assert ndjson_line({"a": 1}) == b'{"a": 1}\n'
+
+
+def test_output_document_resolves_simulators_from_the_job_status(memory_db):
+    jobs = memory_db
+    jobs.jobs.append({"job_id": "run-1", "status": "COMPLETE", "simulators": ["amici", "copasi"]})
+    job, pushed_down = asyncio.run(read_output_document(jobs, "run-1", OutputWindow(species=["A"])))
+    assert job["job_id"] == "run-1" and pushed_down
+    assert jobs.projections[0] == JOB_STATUS_PROJECTION
+    assert "results.copasi.A" in jobs.projections[1]
+
+    assert asyncio.run(read_output_document(jobs, "run-2", OutputWindow(species=["A"]))) == (None, False)
+    assert len(jobs.projections) == 3
+
+
+def test_projection_keeps_result_attributes_and_spilled_markers():
+    projection, _ = output_projection(OutputWindow(species=["A"]), ["smoldyn"])
+    for key in ("species_counts_header", "species", "failed", "n_replicates", "seeds", "_spilled.size"):
+        assert projection[f"results.{key}"] == 1
+        assert projection[f"results.smoldyn.{key}"] == 1
+
+    page = ResultsPage(OutputWindow(species=["A"]), ResultsStore(), pushed_down=True)
+    results = {"A": [1, 2], "failed": [3], "n_replicates": 4}
+    assert asyncio.run(page.expand(results)) == results
+
+
+def test_spilled_results_are_read_without_push_down(memory_db):
+    jobs = memory_db
+    reference = {"_spilled": {"file_id": 1, "size": 100}}
+    jobs.jobs.append({"job_id": "run-1", "status": "COMPLETE", "simulators": ["amici"], "results": {"amici": reference}})
+    job, pushed_down = asyncio.run(read_output_document(jobs, "run-1", OutputWindow(species=["A"], start=5)))
+    assert not pushed_down
+    assert jobs.projections[1]["results.amici._spilled.size"] == 1
+    assert jobs.projections[2] == {field: 0 for field in OUTPUT_EXCLUDED_FIELDS}
+    assert job["results"] == {"amici": reference}
+
+
+def test_results_of_failed_jobs_are_not_pushed_down(memory_db):
+    jobs = memory_db
+    jobs.jobs.append({"job_id": "run-1", "status": "FAILED", "last_updated": "now", "results": "simulator crashed"})
+    output = asyncio.run(get_job_output(jobs, ResultsStore(), "run-1", OutputWindow(species=["A"], start=5)))
+    assert output.results == "simulator crashed"
+    assert jobs.projections[1] == {field: 0 for field in OUTPUT_EXCLUDED_FIELDS}
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from gateway.handlers.files import parse_range, tee_to_cache
+from shared.io import FileCache
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=95-200", 100) == (95, 99)
+    # several ranges are not handled: serve the whole file
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(HTTPException) as e:
+        parse_range("bytes=100-", 100)
+    assert e.value.status_code == 416
+
+
+def test_tee_to_cache_caches_complete_downloads_only(tmp_path):
+    cache = FileCache(root=str(tmp_path), max_bytes=1024)
+
+    async def chunks():
+        for chunk in (b"abc", b"def"):
+            yield chunk
+
+    async def relay(key: str, n_chunks: int = None) -> bytes:
+        relayed = b""
+        tee = tee_to_cache(chunks(), cache, key)
+        async for chunk in tee:
+            relayed += chunk
+            if n_chunks is not None and len(relayed) >= n_chunks * 3:
+                break
+        await tee.aclose()
+        return relayed
+
+    assert asyncio.run(relay("complete")) == b"abcdef"
+    with open(cache.get("complete"), 'rb') as f:
+        assert f.read() == b"abcdef"
+
+    assert asyncio.run(relay("interrupted", n_chunks=1)) == b"abc"
+    assert cache.get("interrupted") is None
+    assert not [fp for fp in tmp_path.rglob("*") if fp.name.endswith(FileCache.PARTIAL_SUFFIX)]
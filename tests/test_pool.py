@@ -0,0 +1,43 @@
+import asyncio
+import os
+import time
+
+from concurrent.futures.process import BrokenProcessPool
+
+from worker.pool import SimulationPool
+
+
+def crash(delay: float):
+    time.sleep(delay)
+    os._exit(1)
+
+
+def sleep_and_return(delay: float, value: int) -> int:
+    time.sleep(delay)
+    return value
+
+
+def test_broken_pool_is_replaced_without_cancelling_other_jobs():
+    pool = SimulationPool(slots=2)
+
+    async def run_jobs():
+        async def crash_then_resubmit():
+            try:
+                await pool.run(crash, 0.2)
+            except BrokenProcessPool:
+                # submitted to the new pool before the other job of the broken pool has handled its own failure,
+                # which must neither shut the new pool down nor cancel these
+                executor = pool.executor
+                futures = [executor.submit(sleep_and_return, 0.1, i) for i in range(6)]
+                return executor, await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
+
+        return await asyncio.gather(crash_then_resubmit(), pool.run(crash, 0.2), return_exceptions=True)
+
+    try:
+        (executor, resubmitted), other = asyncio.run(run_jobs())
+        assert isinstance(other, BrokenProcessPool)
+        assert resubmitted == list(range(6))
+        assert pool._executor is executor
+        assert asyncio.run(pool.run(sleep_and_return, 0., 7)) == 7
+    finally:
+        pool.shutdown()
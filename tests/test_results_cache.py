@@ -0,0 +1,46 @@
+import asyncio
+import hashlib
+import io
+
+from fastapi import UploadFile
+
+from shared.io import hash_uploaded_file
+from shared.results_cache import job_fingerprint, composition_simulators, is_cacheable, contains_error
+
+
+def test_fingerprint_is_canonical_and_covers_inputs():
+    inputs = {"model": "abc", "start": 0, "stop": 10, "steps": 100, "params": {"a": 1, "b": 2}}
+    fingerprint, versions = job_fingerprint("utc", inputs, simulators=["Copasi"])
+    reordered, _ = job_fingerprint("utc", dict(reversed(list(inputs.items()))), simulators=["copasi"])
+    assert fingerprint is not None and fingerprint == reordered
+    assert "copasi-basico" in versions and "process-bigraph" in versions
+
+    assert job_fingerprint("utc", {**inputs, "steps": 101}, simulators=["copasi"])[0] != fingerprint
+    assert job_fingerprint("utc", inputs, simulators=["amici"])[0] != fingerprint
+    assert job_fingerprint("composition", inputs, simulators=["copasi"])[0] != fingerprint
+
+
+def test_stochastic_simulators_require_a_seed():
+    inputs = {"model": "abc", "duration": 10, "dt": 0.1}
+    assert job_fingerprint("smoldyn", inputs, simulators=["smoldyn"])[0] is None
+    seeded = job_fingerprint("smoldyn", inputs, simulators=["smoldyn"], seed=1)[0]
+    assert seeded is not None and seeded != job_fingerprint("smoldyn", inputs, simulators=["smoldyn"], seed=2)[0]
+
+    spec = {"a": {"address": "local:copasi-process"}, "b": {"address": "local:smoldyn-process"}, "emitter": {"address": "local:ram-emitter"}}
+    assert composition_simulators(spec) == ["copasi", "smoldyn"]
+
+
+def test_only_fingerprinted_results_of_the_same_versions_are_cached():
+    fingerprint, versions = job_fingerprint("utc", {"model": "abc"}, simulators=["tellurium"])
+    assert is_cacheable({"fingerprint": fingerprint, "versions": versions})
+    assert not is_cacheable({"fingerprint": None, "versions": versions})
+    assert not is_cacheable({"fingerprint": fingerprint, "versions": {**versions, "tellurium": "0.0.0-other"}})
+
+    assert contains_error({"copasi": {"A": [1]}, "amici": {"error": "x"}})
+    assert not contains_error({"format": "npz", "data": b""})
+
+
+def test_hash_uploaded_file_rewinds_it():
+    upload = UploadFile(file=io.BytesIO(b"<sbml/>"), filename="model.xml")
+    assert asyncio.run(hash_uploaded_file(upload)) == hashlib.sha256(b"<sbml/>").hexdigest()
+    assert asyncio.run(upload.read()) == b"<sbml/>"
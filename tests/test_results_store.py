@@ -0,0 +1,45 @@
+import asyncio
+
+import numpy as np
+
+from shared.results_store import ResultsStore, CHUNKED_FORMAT
+
+
+def test_small_results_are_stored_inline(memory_file_service):
+    file_service = memory_file_service
+    store = ResultsStore(file_service=file_service)
+    stored = asyncio.run(store.write("job", {"A": np.arange(3.0)}, units="mM"))
+    assert file_service.blobs == {}
+    assert asyncio.run(store.expand({"amici": stored})) == {"amici": {"units": "mM", "A": [0.0, 1.0, 2.0]}}
+
+
+def test_chunked_results_read_only_overlapping_chunks(memory_file_service):
+    file_service = memory_file_service
+    store = ResultsStore(chunk_rows=10, inline_max_bytes=0, file_service=file_service)
+    columns = {"A": np.arange(25.0), "B": np.arange(25.0) * 2, "C": np.arange(4.0)}
+    stored = asyncio.run(store.write("job", columns, key="copasi"))
+    assert stored["format"] == CHUNKED_FORMAT
+    assert len(file_service.blobs) == 3
+
+    arrays = asyncio.run(store.read(stored, names=["B"], start=12, stop=18))
+    np.testing.assert_array_equal(arrays["B"], columns["B"][12:18])
+    assert list(arrays.keys()) == ["B"]
+    assert file_service.reads == ["results/job/copasi/chunk-00001.npz"]
+
+    arrays = asyncio.run(store.read(stored))
+    for name, values in columns.items():
+        np.testing.assert_array_equal(arrays[name], values)
+
+    selected = asyncio.run(store.select(stored, ["A"]))
+    assert [column["name"] for column in selected["columns"]] == ["A"]
+
+
+def test_iter_chunks_keeps_stride_across_chunks(memory_file_service):
+    file_service = memory_file_service
+    store = ResultsStore(chunk_rows=4, inline_max_bytes=0, file_service=file_service)
+    stored = asyncio.run(store.write("job", {"A": np.arange(11.0)}))
+
+    async def collect():
+        return [(first_row, arrays["A"].tolist()) async for first_row, arrays in store.iter_chunks(stored, start=1, step=3)]
+
+    assert asyncio.run(collect()) == [(1, [1.0]), (4, [4.0, 7.0]), (10, [10.0])]
@@ -0,0 +1,50 @@
+import asyncio
+
+import numpy as np
+
+from shared.results_store import ResultsStore
+from worker.sim_runs import runs
+from worker.sim_runs.runs import RunsWorker
+
+
+def fake_utc_simulator(simulator: str, sbml_fp: str, start: int, dur: int, steps: int):
+    """Stand-in for `run_sbml_utc_simulator`: tellurium fails, the others share the species `A`."""
+    if simulator == "tellurium":
+        return {"error": "tellurium failed"}
+    t = np.linspace(start, dur, steps + 1)
+    return {"A": t * 2, simulator.upper(): t}
+
+
+def test_utc_results_are_written_per_simulator_as_they_complete(memory_db, inline_pool, monkeypatch):
+    jobs = memory_db
+    jobs.jobs.append({"job_id": "run-utc-1", "status": "IN_PROGRESS"})
+    monkeypatch.setattr(runs, "run_sbml_utc_simulator", fake_utc_simulator)
+    store = ResultsStore()
+    worker = RunsWorker(pool=inline_pool, results_store=store)
+    job = {"job_id": "run-utc-1", "start": 0, "stop": 10, "steps": 5, "simulators": ["amici", "copasi", "tellurium"]}
+
+    result = asyncio.run(worker.run_utc("model.xml", job, jobs))
+    # each simulator in its own pool task, all of them in flight at once
+    assert inline_pool.calls == ["fake_utc_simulator"] * 3
+    assert inline_pool.max_in_flight == 3
+    # one partial write per simulator, before the job's results are complete
+    assert sorted(key for _, update in jobs.updates for key in update) == ["results.amici", "results.copasi", "results.tellurium"]
+    assert jobs.jobs[0]["results"]["tellurium"] == {"error": "tellurium failed"}
+    assert asyncio.run(store.read(jobs.jobs[0]["results"]["copasi"])).keys() == {"A", "COPASI"}
+
+    # the final results only keep the species shared by every successful simulator
+    assert result["tellurium"] == {"error": "tellurium failed"}
+    for simulator in ("amici", "copasi"):
+        np.testing.assert_allclose(asyncio.run(store.read(result[simulator]))["A"], np.linspace(0, 20, 6))
+        assert asyncio.run(store.read(result[simulator])).keys() == {"A"}
+
+
+def test_single_simulator_utc_results_are_not_written_partially(memory_db, inline_pool, monkeypatch):
+    jobs = memory_db
+    monkeypatch.setattr(runs, "run_sbml_utc_simulator", fake_utc_simulator)
+    worker = RunsWorker(pool=inline_pool, results_store=ResultsStore())
+    job = {"job_id": "run-utc-2", "start": 0, "stop": 10, "steps": 5, "simulator": "copasi"}
+
+    result = asyncio.run(worker.run_utc("model.xml", job, jobs))
+    assert jobs.updates == []
+    assert asyncio.run(worker.results_store.read(result)).keys() == {"A", "COPASI"}
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from shared.data_model import JobPriorities
+from shared.database import with_scheduling_fields
+from shared.utils import job_queue
+from worker.scheduler import JobScheduler, parse_queue_weights
+
+
+NOW = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def head(job_id: str, queue: str, submitter: str = "anonymous", priority: int = JobPriorities.NORMAL, waited: float = 0.):
+    return {
+        "job_id": job_id,
+        "queue": queue,
+        "submitter": submitter,
+        "priority": priority,
+        "last_updated": str(NOW - timedelta(seconds=waited)),
+        "pending": 1,
+        "status": "PENDING",
+    }
+
+
+def test_job_queues_and_defaults():
+    assert job_queue("run-tellurium-step-1234") == "tellurium"
+    assert job_queue("run-mem3dg-1234") == "mem3dg"
+    assert job_queue("run-copasi-sweep-1234") == "sweep"
+    assert job_queue("composition-1234") == "composition"
+    assert job_queue("simulation-execution-smoldyn1234") == "smoldyn"
+    assert job_queue("files-generate-simularium-file1234") == "default"
+
+    job = with_scheduling_fields({"job_id": "run-amici-process-1234", "priority": JobPriorities.HIGH})
+    assert job == {"job_id": "run-amici-process-1234", "priority": JobPriorities.HIGH, "queue": "amici", "submitter": "anonymous"}
+    assert parse_queue_weights("tellurium=4, mem3dg=1,bad=x,zero=0") == {"tellurium": 4., "mem3dg": 1.}
+
+
+def test_priority_classes_and_aging():
+    scheduler = JobScheduler(slots=4, queue_weights={}, aging_seconds=600)
+    heads = [
+        head("low-old", "copasi", priority=JobPriorities.LOW, waited=300),
+        head("normal", "tellurium", priority=JobPriorities.NORMAL, waited=10),
+        head("high", "amici", priority=JobPriorities.HIGH, waited=1),
+    ]
+    assert scheduler.select(heads, now=NOW)["job_id"] == "high"
+    assert scheduler.select(heads[:2], now=NOW)["job_id"] == "normal"
+    # waiting two aging periods raises a low priority job to the high class
+    heads[0] = head("low-old", "copasi", priority=JobPriorities.LOW, waited=1300)
+    assert scheduler.select(heads[:2], now=NOW)["job_id"] == "low-old"
+
+
+def test_heavy_queue_cannot_take_every_slot():
+    scheduler = JobScheduler(slots=4, queue_weights={}, max_queue_share=0.75, aging_seconds=0)
+    for i in range(3):
+        scheduler.started({"job_id": f"run-mem3dg-{i}"})
+    heads = [head("mem3dg-next", "mem3dg", waited=3600), head("tellurium", "tellurium")]
+    assert scheduler.select(heads, now=NOW)["job_id"] == "tellurium"
+    assert scheduler.select(heads[:1], now=NOW) is None
+
+    scheduler.finished({"job_id": "run-mem3dg-0"})
+    assert scheduler.select(heads[:1], now=NOW)["job_id"] == "mem3dg-next"
+
+    # extra slots borrowed by a running job count towards its queue's share
+    assert scheduler.charge({"job_id": "run-mem3dg-1"})
+    assert not scheduler.charge({"job_id": "run-mem3dg-1"})
+    assert scheduler.select(heads[:1], now=NOW) is None
+
+
+def test_weighted_fair_share_between_queues_and_submitters():
+    scheduler = JobScheduler(slots=8, queue_weights={"tellurium": 4}, max_queue_share=1., aging_seconds=0)
+    scheduler.started({"job_id": "run-tellurium-step-1"})
+    scheduler.started({"job_id": "run-tellurium-step-2"})
+    scheduler.started({"job_id": "run-copasi-step-1"})
+    # tellurium uses 2/4 of its weighted share, copasi 1/1: tellurium is next despite being younger
+    heads = [head("copasi", "copasi", waited=100), head("tellurium", "tellurium", waited=1)]
+    assert scheduler.select(heads, now=NOW)["job_id"] == "tellurium"
+
+    # within a queue, the submitter with fewer running jobs goes first
+    scheduler = JobScheduler(slots=8, queue_weights={}, aging_seconds=0)
+    scheduler.started({"job_id": "run-copasi-step-1", "submitter": "alice"})
+    heads = [head("alice-2", "copasi", submitter="alice", waited=100), head("bob-1", "copasi", submitter="bob", waited=1)]
+    assert scheduler.select(heads, now=NOW)["job_id"] == "bob-1"
+
+
+def test_claim_retries_jobs_claimed_elsewhere(memory_db):
+    scheduler = JobScheduler(slots=2, queue_weights={}, aging_seconds=0)
+    pending = memory_db
+    pending.jobs.extend([head("first", "copasi", waited=10), head("second", "amici", waited=5)])
+    pending.stolen.add("first")
+    job = asyncio.run(scheduler.claim(pending, job_filter={}))
+    assert job["job_id"] == "second"
+    assert scheduler.running_queues["amici"] == 1
+    assert asyncio.run(scheduler.claim(pending, job_filter={})) is None
@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from gateway.handlers.sweep import parameter_grid, parse_sweep
+from worker.pool import TaskSlots
+from worker.sim_runs import sweep
+from worker.sim_runs.model_cache import WarmModelPool
+
+
+class DecaySweepModel(object):
+    """Analytic stand-in for a simulator: one species decaying at rate `k`, failing for negative rates."""
+    loads = 0
+
+    def __init__(self, sbml_fp: str):
+        DecaySweepModel.loads += 1
+        self.species = ["A"]
+
+    def simulate(self, parameters, values, start, stop, steps):
+        k = dict(zip(parameters, values))["k"]
+        if k < 0:
+            raise RuntimeError("negative rate")
+        t = np.linspace(start, stop, steps + 1)
+        return np.exp(-k * t)[:, None]
+
+    def close(self):
+        pass
+
+
+class ParametricSweepModel(sweep.SweepModel):
+    """One species decaying at rate `k + j`, with parameters held in place like a simulator's."""
+    loads = 0
+
+    def __init__(self, sbml_fp: str):
+        ParametricSweepModel.loads += 1
+        super().__init__({"k": 1.0, "j": 0.0})
+        self.parameters = dict(self.initial_values)
+        self.species = ["A"]
+
+    def set_parameter(self, name, value):
+        if name not in self.parameters:
+            raise KeyError(name)
+        self.parameters[name] = value
+
+    def run(self, start, stop, steps):
+        t = np.linspace(start, stop, steps + 1)
+        return np.exp(-(self.parameters["k"] + self.parameters["j"]) * t)[:, None]
+
+
+def test_parse_grid_and_samples():
+    parameters, samples = parameter_grid({"k1": [1, 2], "k2": [10, 20, 30]})
+    assert parameters == ["k1", "k2"]
+    assert samples.shape == (6, 2)
+    assert samples[:3].tolist() == [[1, 10], [1, 20], [1, 30]]
+
+    parameters, samples = parse_sweep(json.dumps({"parameters": ["k"], "samples": [[0.1], [0.2]]}).encode())
+    assert parameters == ["k"]
+    assert samples.tolist() == [[0.1], [0.2]]
+
+    for contents in (
+        {"grid": {"k": [1, 2]}, "samples": [[1]]},
+        {"parameters": ["k1", "k2"], "samples": [[1]]},
+        {"grid": {"k": []}},
+    ):
+        with pytest.raises(HTTPException):
+            parse_sweep(json.dumps(contents).encode())
+    with pytest.raises(HTTPException):
+        parse_sweep(json.dumps({"grid": {"k1": [1, 2, 3], "k2": [1, 2]}}).encode(), max_samples=5)
+
+
+def test_run_sweep_fills_one_array_and_loads_the_model_once(tmp_path, monkeypatch, inline_pool):
+    sbml_fp = tmp_path / "model.xml"
+    sbml_fp.write_text("<sbml/>")
+    model_pool = WarmModelPool()
+    monkeypatch.setattr(sweep, "get_model_pool", lambda: model_pool)
+    monkeypatch.setitem(sweep.SWEEP_MODELS, "decay", DecaySweepModel)
+    DecaySweepModel.loads = 0
+
+    rates = np.array([[0.5], [1.0], [-1.0], [2.0], [0.0]])
+    pool = inline_pool
+    species, values, failed = asyncio.run(
+        sweep.run_sweep(pool, "decay", str(sbml_fp), 0, 2, 4, ["k"], rates, block_size=2)
+    )
+    assert species == ["A"]
+    assert values.shape == (5, 5, 1)
+    assert failed == [2]
+    assert np.all(np.isnan(values[2]))
+    t = np.linspace(0, 2, 5)
+    for i in (0, 1, 3, 4):
+        np.testing.assert_allclose(values[i, :, 0], np.exp(-rates[i, 0] * t))
+    # three blocks, one load (and a reload after the failed sample), no more blocks in flight than the pool has slots
+    assert DecaySweepModel.loads == 2
+    assert pool.max_in_flight == pool.slots
+
+    # a job limited to its own slot runs one block at a time
+    pool.max_in_flight = 0
+    asyncio.run(sweep.run_sweep(pool, "decay", str(sbml_fp), 0, 2, 4, ["k"], rates, block_size=1, slots=TaskSlots(limit=1)))
+    assert pool.max_in_flight == 1
+
+
+def test_pooled_model_is_restored_between_sweeps_over_other_parameters(tmp_path, monkeypatch, inline_pool):
+    sbml_fp = tmp_path / "model.xml"
+    sbml_fp.write_text("<sbml/>")
+    model_pool = WarmModelPool()
+    monkeypatch.setattr(sweep, "get_model_pool", lambda: model_pool)
+    monkeypatch.setitem(sweep.SWEEP_MODELS, "parametric", ParametricSweepModel)
+    ParametricSweepModel.loads = 0
+    t = np.linspace(0, 2, 5)
+
+    def run(parameters, samples):
+        return asyncio.run(sweep.run_sweep(inline_pool, "parametric", str(sbml_fp), 0, 2, 4, parameters, np.array(samples)))
+
+    run(["j"], [[1.0], [2.0]])
+    _, values, failed = run(["k"], [[0.5], [3.0]])
+    # `j` is back at its initial value of 0 for the second sweep, on the same pooled model
+    assert ParametricSweepModel.loads == 1 and failed == []
+    np.testing.assert_allclose(values[:, :, 0], [np.exp(-0.5 * t), np.exp(-3.0 * t)])
+
+    # an unknown parameter fails its sample and discards the pooled model, which is reloaded for the next one
+    _, values, failed = run(["unknown"], [[1.0]])
+    assert failed == [0] and ParametricSweepModel.loads == 1
+    _, values, _ = run(["j"], [[1.0]])
+    assert ParametricSweepModel.loads == 2
+    np.testing.assert_allclose(values[0, :, 0], np.exp(-2.0 * t))
@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+import io
+
+from fastapi import UploadFile
+
+from shared import io as shared_io
+from shared.io import save_uploaded_file, stream_uploaded_file, write_uploaded_file
+
+
+def make_upload(contents: bytes, filename: str = "model.xml") -> UploadFile:
+    return UploadFile(file=io.BytesIO(contents), filename=filename)
+
+
+def test_stream_uploaded_file_hashes_on_the_fly(monkeypatch, memory_file_service):
+    file_service = memory_file_service
+    monkeypatch.setitem(shared_io._file_services, "bucket", file_service)
+    contents = b"<sbml/>" * (shared_io.UPLOAD_CHUNK_BYTES // 3)
+
+    stored = asyncio.run(stream_uploaded_file("job", "bucket", make_upload(contents), ".xml"))
+    assert stored.location == "file_uploads/job/model.xml"
+    assert stored.sha256 == hashlib.sha256(contents).hexdigest()
+    assert stored.size == len(contents)
+    assert file_service.blobs[stored.location] == contents
+
+    location = asyncio.run(write_uploaded_file("job-2", "bucket", make_upload(b"<sbml/>"), ".xml"))
+    assert file_service.blobs[location] == b"<sbml/>"
+
+
+def test_save_uploaded_file_in_chunks(tmp_path):
+    contents = b"x" * (shared_io.UPLOAD_CHUNK_BYTES + 10)
+    file_path = asyncio.run(save_uploaded_file(make_upload(contents, "mesh.ply"), str(tmp_path)))
+    with open(file_path, 'rb') as f:
+        assert f.read() == contents
+
+
+class FakeStream(object):
+    def __init__(self, contents: bytes):
+        self.contents = io.BytesIO(contents)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def read(self, size: int) -> bytes:
+        return self.contents.read(size)
+
+
+class FakeStorage(object):
+    """Stand-in for a `gcloud.aio.storage.Storage` client, recording the arguments of `download_stream`."""
+    def __init__(self, contents: bytes):
+        self.contents = contents
+        self.calls = []
+
+    async def download_stream(self, bucket, object_name, **kwargs):
+        self.calls.append(kwargs)
+        return FakeStream(self.contents)
+
+
+def test_stream_gcs_file_reads_without_deadline():
+    import aiohttp
+    from common.storage.gcs_aio import STREAM_SOCK_READ_TIMEOUT, stream_gcs_file
+
+    async def read_all(client):
+        return [chunk async for chunk in stream_gcs_file("uploads/model.xml", token=None, client=client, start=2, chunk_size=4)]
+
+    client = FakeStorage(b"0123456789")
+    assert asyncio.run(read_all(client)) == [b"0123", b"4567", b"89"]
+    (kwargs,) = client.calls
+    assert kwargs["headers"] == {"Range": "bytes=2-"}
+    timeout = kwargs["timeout"]
+    assert isinstance(timeout, aiohttp.ClientTimeout)
+    assert timeout.total is None and timeout.sock_read == STREAM_SOCK_READ_TIMEOUT
@@ -0,0 +1,24 @@
+import numpy as np
+
+from shared.utils import decode_npz, encode_npz, pack_results, unpack_results
+
+
+def test_npz_round_trip_keeps_structured_arrays():
+    molecules = np.array([(1, 0.5), (2, 1.5)], dtype=[('species', np.int32), ('x', np.float64)])
+    counts = np.arange(6, dtype=np.float64).reshape(2, 3)
+    decoded = decode_npz(encode_npz({'species_counts': counts, 'molecules': molecules}))
+    np.testing.assert_array_equal(decoded['species_counts'], counts)
+    np.testing.assert_array_equal(decoded['molecules'], molecules)
+    assert decoded['molecules'].dtype == molecules.dtype
+
+
+def test_unpack_results_expands_packed_arrays_only():
+    molecules = np.array([(1, 0.5)], dtype=[('species', np.int32), ('x', np.float64)])
+    packed = pack_results({'species_counts': np.ones((1, 2)), 'molecules': molecules}, species_counts_header=['time', 'A'])
+    assert isinstance(packed['data'], bytes)
+    assert unpack_results(packed) == {
+        'species_counts_header': ['time', 'A'],
+        'species_counts': [[1.0, 1.0]],
+        'molecules': {'species': [1], 'x': [0.5]},
+    }
+    assert unpack_results({'A': [1.0]}) == {'A': [1.0]}
@@ -18,27 +18,34 @@ The general workflow should be:
 11. worker: perhaps emit an event?
 """
 import asyncio
-import json
+import shutil
 import tempfile
+import time
 
 import os
-from typing import Any, Mapping, List
+from typing import Any, Dict, Mapping, Set, Tuple
 
 import bsp
 from process_bigraph import Composite
+from pymongo.errors import OperationFailure
 from bsp import app_registrar
 from bsp.processes.simple_membrane_process import SimpleMembraneProcess
 
-from shared.io import download_file_from_bucket
-from shared.database import MongoConnector
-from shared.environment import DEFAULT_BUCKET_NAME
+from shared.io import fetch_file
+from shared.database import MongoConnector, EXPIRE_AT_FIELD, expiry
+from shared.environment import DEFAULT_BUCKET_NAME, DEFAULT_RESULT_STATES_COLLECTION_NAME, DEFAULT_RESULT_STATES_TTL_SECONDS
 from shared.log_config import setup_logging
+from worker.pool import SimulationPool, TaskSlots
+from worker.scheduler import JobScheduler
 from worker.sim_runs.runs import RunsWorker
-from shared.utils import handle_exception
+from shared.utils import handle_exception, serialize_document
 
 
 logger = setup_logging(__file__)
 
+# job id prefixes this worker knows how to dispatch; anything else is left in the queue for other services
+DISPATCHABLE_JOB_PREFIXES = ["composition", "run", "simulation-execution"]
+
 
 class CompositionState(dict):
     """That which is exported by Composite.save()"""
@@ -52,99 +59,214 @@ class ResultData(dict):
         return super(ResultData, cls).__new__(cls, *args, **kwargs)
 
 
+def run_composition(input_state: Dict[str, Any], duration: int) -> Tuple[ResultData, CompositionState, Dict[str, float]]:
+    """Build a composition once, run it, and snapshot its emitter results and final state straight from memory into
+        BSON-ready documents. Defined at module level so that it can be executed in a `worker.pool.SimulationPool` process.
+
+        Returns:
+            the results, the state and the wall time in seconds spent on each phase ('construct', 'run', 'serialize').
+    """
+    timings = {}
+    phase_start = time.perf_counter()
+    composition = JobDispatcher.generate_composite(input_state)
+    timings["construct"] = time.perf_counter() - phase_start
+
+    phase_start = time.perf_counter()
+    results = JobDispatcher.generate_composition_results(composition, duration)
+    timings["run"] = time.perf_counter() - phase_start
+
+    phase_start = time.perf_counter()
+    results = ResultData(**serialize_document(results))
+    state = JobDispatcher.generate_composition_state(composition)
+    timings["serialize"] = time.perf_counter() - phase_start
+
+    return results, state, timings
+
+
 class JobDispatcher(object):
     def __init__(self,
                  db_connector: MongoConnector = None,
-                 timeout: int = 5):
+                 timeout: int = 5,
+                 pool: SimulationPool = None,
+                 scheduler: JobScheduler = None):
         """
         :param db_connector: (`shared.database.MongoConnector`) database connector singleton instantiated with mongo uri.
         :param timeout: number of minutes for timeout. Default is 5 minutes
+        :param pool: (`worker.pool.SimulationPool`) process pool in which simulations are run. Its number of slots is
+            also the number of jobs this dispatcher runs concurrently. Defaults to a pool sized by the cgroup CPU quota.
+        :param scheduler: (`worker.scheduler.JobScheduler`) chooses which pending job to claim whenever a slot is free.
+            Defaults to one with the pool's number of slots.
         """
         self.db_connector = db_connector
         self.timeout = timeout * 60
+        self.pool = pool or SimulationPool()
+        self.slots = asyncio.Semaphore(self.pool.slots)
+        self.scheduler = scheduler or JobScheduler(slots=self.pool.slots)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def task_slots(self, job: Mapping[str, Any]) -> TaskSlots:
+        """Slots for the pool tasks of `job` beyond the first: idle slots of this dispatcher, charged to the job's queue
+            in the scheduler while they are in use.
+        """
+        return TaskSlots(
+            shared=self.slots,
+            charge=lambda: self.scheduler.charge(job),
+            refund=lambda: self.scheduler.finished(job)
+        )
 
     @property
-    def current_jobs(self) -> List[Mapping[str, Any]]:
-        return self.db_connector.get_jobs()
+    def job_filter(self) -> Dict[str, Any]:
+        return {'job_id': {'$regex': f"^({'|'.join(DISPATCHABLE_JOB_PREFIXES)})"}}
+
+    async def claim_job(self) -> Mapping[str, Any] | None:
+        return await self.scheduler.claim(self.db_connector, job_filter=self.job_filter)
 
     async def run(self, limit: int = 5, wait: int = 5):
         i = 0
         while i < limit:
-            for job in self.current_jobs:
-                job_id = job['job_id']
-                if job_id.startswith("run"):
-                    await self.dispatch_run(job)
-                elif job_id.startswith("composition") or job_id.startswith('run-mem3dg-'):
-                    await self.dispatch_composition(job)
+            await self.drain()
             i += 1
             await asyncio.sleep(wait)
 
+    async def drain(self) -> int:
+        """Claim pending jobs and start them as background tasks until none are left (or the scheduler holds the rest
+            back), waiting for a free pool slot before each claim so that jobs this worker cannot start yet stay
+            available to other replicas. Returns the number of jobs dispatched.
+        """
+        n_dispatched = 0
+        while True:
+            await self.slots.acquire()
+            job = await self.claim_job()
+            if job is None:
+                self.slots.release()
+                return n_dispatched
+
+            task = asyncio.create_task(self._dispatch_in_slot(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            n_dispatched += 1
+
+    async def _dispatch_in_slot(self, job: Mapping[str, Any]):
+        try:
+            await self.dispatch(job)
+        finally:
+            self.scheduler.finished(job)
+            self.slots.release()
+
+    async def poll(self, min_wait: float = 0.1, max_wait: float = 5.0, limit: int = None):
+        """Drain the queue on an adaptive interval: reset to `min_wait` whenever a job was found, otherwise double
+            the wait up to `max_wait`. Runs forever unless `limit` cycles is given.
+        """
+        wait = min_wait
+        i = 0
+        while limit is None or i < limit:
+            n_dispatched = await self.drain()
+            wait = min_wait if n_dispatched else min(wait * 2, max_wait)
+            await asyncio.sleep(wait)
+            i += 1
+
+    async def listen(self, min_wait: float = 0.1, max_wait: float = 5.0):
+        """Dispatch jobs as soon as they are inserted by subscribing to a change stream on the job collection. Falls back
+            to adaptive polling (see `poll`) when change streams are unavailable, for example on a standalone mongod.
+            Returns if the change stream is closed by the server.
+        """
+        try:
+            stream = self.db_connector.watch_jobs(max_await_time_ms=int(max_wait * 1000))
+        except OperationFailure as e:
+            logger.warning(f"Change streams are unavailable ({e}), falling back to polling.")
+            return await self.poll(min_wait=min_wait, max_wait=max_wait)
+
+        with stream:
+            # pick up anything submitted before the stream was opened
+            await self.drain()
+            while stream.alive:
+                # try_next blocks for at most max_wait, so keep it off the event loop
+                await asyncio.to_thread(stream.try_next)
+
+                # drain on inserts as well as on idle timeouts: the latter sweeps up jobs that were re-queued by an
+                # update, which this stream does not report
+                await self.drain()
+
+    async def dispatch(self, job: Mapping[str, Any]):
+        """Route a claimed (IN_PROGRESS) job to the appropriate runner."""
+        job_id = job['job_id']
+        if job_id.startswith("composition") or job_id.startswith("run-mem3dg-"):
+            await self.dispatch_composition(job)
+        elif job_id.startswith("run") or job_id.startswith("simulation-execution"):
+            await self.dispatch_run(job)
+
     def create_dynamic_environment(self, job: Mapping[str, Any]) -> int:
         # TODO: implement this
         return 0
 
     async def dispatch_composition(self, job: Mapping[str, Any]):
-        job_status = job["status"]
         job_id = job["job_id"]
-        if job_status.lower() == "pending":
-            try:
-                # install simulators required TODO: implement this
-                self.create_dynamic_environment(job)
-
-                # change job status to IN_PROGRESS
-                await self.db_connector.update_job(job_id=job_id, status="IN_PROGRESS")
-
-                # get request params and parse remote file uploads if needed
-                input_state = job["spec"]
-                duration = job.get("duration", 1)
-                for process_name, process_spec in input_state.items():
-                    process_config = process_spec["config"]
-                    for config_key, config_value in process_config.items():
-                        if config_key == "model":
-                            source_fp = config_value["model_source"]
-                            temp_dest = tempfile.mkdtemp()
-                            local_fp = download_file_from_bucket(source_blob_path=source_fp, out_dir=temp_dest, bucket_name=DEFAULT_BUCKET_NAME)
-                            process_spec["config"]["model"]["model_source"] = local_fp
-                        elif "mesh_file" in config_key:
-                            source_fp = process_config["mesh_file"]
-                            temp_dest = tempfile.mkdtemp()
-                            local_fp = download_file_from_bucket(source_blob_path=source_fp, out_dir=temp_dest, bucket_name=DEFAULT_BUCKET_NAME)
-                            process_spec["config"]["mesh_file"] = local_fp
-
-                # generate composition instance
-                composition = self.generate_composite(input_state)
-
-                # get composition results and state
-                results = self.generate_composition_results(input_state, duration)
-                state = self.generate_composition_state(composition)
-
-                # change status to complete and write results in DB
-                await self.db_connector.update_job(
-                    job_id=job_id,
-                    status="COMPLETE",
-                    results=results
-                )
-
-                # write new result state to states collection
-                await self.db_connector.write(
-                    collection_name="result_states",
-                    job_id=job_id,
-                    data=state,
-                    last_updated=self.db_connector.timestamp()
-                )
-            except Exception as e:
-                message = handle_exception(scope=job_id + str(e).strip())
-                logger.error(message)
-                failed_job = self.generate_failed_job(job_id, message)
-                await self.db_connector.update_job(**failed_job)
-
-    def generate_composite(self, input_state) -> Composite:
+        temp_dirs = []
+        try:
+            # install simulators required TODO: implement this
+            self.create_dynamic_environment(job)
+
+            # get request params and parse remote file uploads if needed
+            input_state = job["spec"]
+            duration = job.get("duration", 1)
+            for process_name, process_spec in input_state.items():
+                process_config = process_spec["config"]
+                for config_key, config_value in process_config.items():
+                    if config_key == "model":
+                        source_fp = config_value["model_source"]
+                        temp_dest = tempfile.mkdtemp()
+                        temp_dirs.append(temp_dest)
+                        local_fp = await fetch_file(source_blob_path=source_fp, out_dir=temp_dest, bucket_name=DEFAULT_BUCKET_NAME)
+                        process_spec["config"]["model"]["model_source"] = local_fp
+                    elif "mesh_file" in config_key:
+                        source_fp = process_config["mesh_file"]
+                        temp_dest = tempfile.mkdtemp()
+                        temp_dirs.append(temp_dest)
+                        local_fp = await fetch_file(source_blob_path=source_fp, out_dir=temp_dest, bucket_name=DEFAULT_BUCKET_NAME)
+                        process_spec["config"]["mesh_file"] = local_fp
+
+            # generate composition instance and get composition results and state in a worker process
+            results, state, timings = await self.pool.run(run_composition, input_state, duration)
+            logger.info(f"{job_id} phase timings (s): {timings}")
+
+            # change status to complete and write results in DB
+            await self.db_connector.update_job(
+                job_id=job_id,
+                status="COMPLETE",
+                results=results,
+                timings=timings
+            )
+
+            # write new result state to states collection
+            state_expiry = {}
+            if DEFAULT_RESULT_STATES_TTL_SECONDS > 0:
+                state_expiry[EXPIRE_AT_FIELD] = expiry(DEFAULT_RESULT_STATES_TTL_SECONDS)
+            await self.db_connector.write(
+                collection_name=DEFAULT_RESULT_STATES_COLLECTION_NAME,
+                job_id=job_id,
+                data=state,
+                last_updated=self.db_connector.timestamp(),
+                **state_expiry
+            )
+            await self.db_connector.memoize_job(job)
+        except Exception as e:
+            message = handle_exception(scope=job_id + str(e).strip())
+            logger.error(message)
+            failed_job = self.generate_failed_job(job_id, message)
+            await self.db_connector.update_job(**failed_job)
+        finally:
+            for temp_dir in temp_dirs:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @staticmethod
+    def generate_composite(input_state) -> Composite:
         return Composite(
             config={"state": input_state},
             core=app_registrar.core
         )
 
-    def generate_composition_results(self, composition: Composite, duration: int) -> ResultData:
+    @staticmethod
+    def generate_composition_results(composition: Composite, duration: int) -> ResultData:
         # run the composition
         composition.run(duration)
 
@@ -152,30 +274,26 @@ class JobDispatcher(object):
         results = composition.gather_results()[("emitter",)]
         return ResultData(**results)
 
-    def generate_composition_state(self, composition: Composite) -> CompositionState:
-        temp_dir = tempfile.mkdtemp()
-        temp_fname = f"temp.state.json"
-        composition.save(filename=temp_fname, outdir=temp_dir)
-        temp_path = os.path.join(temp_dir, temp_fname)
-        with open(temp_path, 'r') as f:
-            current_data = json.load(f)
-        os.remove(temp_path)
-
-        return CompositionState(**current_data)
+    @staticmethod
+    def generate_composition_state(composition: Composite) -> CompositionState:
+        # same document as Composite.save() writes, built in memory rather than through a temporary json file
+        current_data = {
+            "state": composition.serialize_state(),
+            "composition": composition.core.representation(composition.composition)
+        }
+        return CompositionState(**serialize_document(current_data))
 
     async def dispatch_run(self, job: Mapping[str, Any]):
-        job_status = job["status"]
         job_id = job["job_id"]
-        if job_status.lower() == "pending":
-            try:
-                self.create_dynamic_environment(job)
-                await RunsWorker().dispatch(job=job, db_connector=self.db_connector)
-                return
-            except Exception as e:
-                message = handle_exception(scope=job_id + str(e).strip())
-                logger.error(message)
-                failed_job = self.generate_failed_job(job_id, message)
-                await self.db_connector.update_job(**failed_job)
+        try:
+            self.create_dynamic_environment(job)
+            await RunsWorker(pool=self.pool, task_slots=self.task_slots(job)).dispatch(job=job, db_connector=self.db_connector)
+            return
+        except Exception as e:
+            message = handle_exception(scope=job_id + str(e).strip())
+            logger.error(message)
+            failed_job = self.generate_failed_job(job_id, message)
+            await self.db_connector.update_job(**failed_job)
 
     @staticmethod
     def generate_failed_job(job_id: str, msg: str):
@@ -3,12 +3,15 @@ import asyncio
 import logging
 
 from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
 
 from shared.database import MongoConnector
 from shared.environment import ENV_PATH, DEFAULT_DB_NAME
+from shared.io import close_file_services
 from shared.log_config import setup_logging
 
 from worker.dispatch import JobDispatcher
+from worker.pool import SimulationPool
 
 
 load_dotenv(ENV_PATH)  # NOTE: create an env config at this filepath if dev
@@ -18,26 +21,43 @@ load_dotenv(ENV_PATH)  # NOTE: create an env config at this filepath if dev
 logger = setup_logging(__file__)
 
 # constraints
-TIMEOUT = 30
-MAX_RETRIES = 30
+DISPATCH_MODE = os.getenv("DISPATCH_MODE", "listen")  # one of 'listen' (change streams, falling back to polling) or 'poll'
+MIN_POLL_INTERVAL = float(os.getenv("MIN_POLL_INTERVAL", 0.1))
+MAX_POLL_INTERVAL = float(os.getenv("MAX_POLL_INTERVAL", 5))
+POOL_SLOTS = int(os.getenv("WORKER_POOL_SLOTS", 0)) or None  # number of concurrent simulations; defaults to the cgroup CPU quota
 MONGO_URI = os.getenv("MONGO_URI")
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
 # singletons
 db_connector = MongoConnector(connection_uri=MONGO_URI, database_id=DEFAULT_DB_NAME)
-dispatcher = JobDispatcher(db_connector=db_connector)
+pool = SimulationPool(slots=POOL_SLOTS)
+dispatcher = JobDispatcher(db_connector=db_connector, pool=pool)
 
 
-async def main(max_retries=MAX_RETRIES):
-    n_retries = 0
+async def main(dispatch_mode: str = DISPATCH_MODE):
     while True:
-        # no job has come in a while
-        if n_retries == MAX_RETRIES:
-            await asyncio.sleep(TIMEOUT)  # TODO: adjust this for client polling as needed
-        await dispatcher.run()
-        await asyncio.sleep(10)
-        n_retries += 1
+        try:
+            if dispatch_mode == "poll":
+                await dispatcher.poll(min_wait=MIN_POLL_INTERVAL, max_wait=MAX_POLL_INTERVAL)
+            else:
+                # returns only if the change stream is closed, in which case it is re-opened
+                await dispatcher.listen(min_wait=MIN_POLL_INTERVAL, max_wait=MAX_POLL_INTERVAL)
+        except PyMongoError as e:
+            logger.error(f"Lost connection to the job queue: {e}")
+            await asyncio.sleep(MAX_POLL_INTERVAL)
+
+
+async def serve():
+    try:
+        db_connector.ensure_indexes()
+    except PyMongoError as e:
+        logger.error(f"Could not create database indexes: {e}")
+    try:
+        await main()
+    finally:
+        pool.shutdown()
+        await close_file_services()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(serve())
@@ -0,0 +1,186 @@
+"""
+Process-pool execution backend for the worker.
+
+Simulator calls (Composite.run, smoldyn, readdy, the SBML executors) are CPU-bound and synchronous. Running them
+through a `SimulationPool` keeps them off the dispatcher's event loop, so that status updates and other jobs keep
+flowing while a long simulation runs, and lets one pod run as many jobs concurrently as it has CPUs.
+"""
+import asyncio
+import functools
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from shared.log_config import setup_logging
+
+
+logger = setup_logging(__file__)
+
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def cgroup_cpu_quota() -> Optional[float]:
+    """Return the number of CPUs granted by the container's cgroup CPU quota, or `None` if it is unlimited or unknown."""
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    try:
+        with open(CGROUP_V2_CPU_MAX, 'r') as f:
+            quota, period = f.read().split()
+        return int(quota) / int(period) if quota != "max" else None
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1: quota is -1 when unlimited
+    try:
+        with open(CGROUP_V1_CPU_QUOTA, 'r') as f:
+            quota = int(f.read())
+        with open(CGROUP_V1_CPU_PERIOD, 'r') as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_pool_slots() -> int:
+    """Number of concurrent simulations to run: the cgroup CPU quota (rounded up) capped at the visible CPUs."""
+    n_cpus = available_cpus()
+    quota = cgroup_cpu_quota()
+    if quota is None:
+        return n_cpus
+    return max(1, min(n_cpus, math.ceil(quota)))
+
+
+class SimulationPool(object):
+    def __init__(self, slots: int = None, start_method: str = "spawn"):
+        """
+        :param slots: (`int`) number of worker processes, and thus concurrent simulations. Defaults to `default_pool_slots()`.
+        :param start_method: (`str`) multiprocessing start method. Defaults to 'spawn' so that children never inherit
+            the parent's database client or simulator library state.
+        """
+        self.slots = slots or default_pool_slots()
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # created lazily: processes are only started once there is something to run
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.slots,
+                mp_context=multiprocessing.get_context(self.start_method)
+            )
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` in a worker process and return its (pickled) result. `fn` must be importable at
+            module level.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+        except BrokenProcessPool:
+            # a child died (for example a simulator segfault): replace the pool so that subsequent jobs can still run.
+            # The tasks of other jobs on the broken pool fail on their own; cancelling them instead would cancel the
+            # jobs awaiting them. Another task of the broken pool may already have replaced it, and the new pool is kept.
+            logger.error(f"Worker process died while running {getattr(fn, '__name__', fn)}, restarting the pool.")
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=False)
+            raise
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+
+class TaskSlots(object):
+    """Bounds the pool tasks that one job has in flight.
+
+        A job holds one slot of the dispatcher, so it may always run one task. It may run more (the replicates of an
+        ensemble, the blocks of a sweep) only on slots of the dispatcher that are idle when a task starts and only
+        while `charge` accepts them. Borrowed slots are given back (and `refund` called) as soon as their task
+        completes, so a job claimed meanwhile waits for one task of this job rather than for all of them.
+    """
+    def __init__(
+            self,
+            shared: asyncio.Semaphore = None,
+            limit: int = None,
+            charge: Callable[[], bool] = None,
+            refund: Callable[[], None] = None
+    ):
+        """
+        :param shared: (`asyncio.Semaphore`) the dispatcher's slots, from which extra slots are borrowed. When `None`,
+            extra slots are only bounded by `limit`.
+        :param limit: (`int`) maximum number of tasks in flight. Defaults to no limit other than `shared`.
+        :param charge: (`Callable[[], bool]`) called before borrowing a slot: accounts for it (ie: to the job's
+            scheduler queue) and returns `False` if the job may not use another slot now.
+        :param refund: (`Callable[[], None]`) called when a borrowed slot is given back.
+        """
+        self.shared = shared
+        self.limit = limit
+        self.charge = charge
+        self.refund = refund
+        self.borrowed = 0
+        self._own_free = True
+        self._changed = asyncio.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        return self.borrowed + (not self._own_free)
+
+    async def _borrow(self) -> bool:
+        if self.limit is not None and self.in_flight >= self.limit:
+            return False
+        # a locked semaphore also has waiters: a job waiting for a slot goes before borrowers
+        if self.shared is not None and self.shared.locked():
+            return False
+        if self.charge is not None and not self.charge():
+            return False
+        if self.shared is not None:
+            # does not block: the semaphore is not locked
+            await self.shared.acquire()
+        self.borrowed += 1
+        return True
+
+    async def acquire(self) -> bool:
+        """Wait for a slot to run a task on. Returns whether it was borrowed, to be passed back to `release`."""
+        async with self._changed:
+            while True:
+                if self._own_free:
+                    self._own_free = False
+                    return False
+                if await self._borrow():
+                    return True
+                await self._changed.wait()
+
+    async def release(self, borrowed: bool) -> None:
+        async with self._changed:
+            if borrowed:
+                self.borrowed -= 1
+                if self.shared is not None:
+                    self.shared.release()
+                if self.refund is not None:
+                    self.refund()
+            else:
+                self._own_free = True
+            self._changed.notify()
+
+    async def run(self, pool: SimulationPool, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` in `pool` (see `SimulationPool.run`) once a slot is available."""
+        borrowed = await self.acquire()
+        try:
+            return await pool.run(fn, *args, **kwargs)
+        finally:
+            await self.release(borrowed)
@@ -0,0 +1,156 @@
+"""
+Choice of the next job to run, for the dispatcher.
+
+Claiming the oldest pending job lets a burst of long jobs of one kind (ie: multi-hour Mem3dg runs) take every slot and
+hold back sub-second runs queued behind them. Instead, each pending job belongs to a queue (its simulator, see
+`shared.utils.job_queue`), has a priority class (`shared.data_model.JobPriorities`) and a submitter, and whenever a
+slot frees up the `JobScheduler` picks, from the oldest pending job of each queue, submitter and class:
+
+    1. the highest priority class, where every `aging_seconds` of waiting raises a job by one class so that low
+       priority jobs are never starved;
+    2. within it, the queue using the least of its weighted share of this worker's slots (running jobs / weight);
+    3. then the submitter with the fewest running jobs, so that one submitter's batch does not hold back others;
+    4. then the oldest job.
+
+No queue may take more than `max_queue_share` of the slots, which keeps a slot free for other queues when one of them
+has a backlog of long jobs. The selected job is then claimed atomically, as before.
+"""
+import math
+from collections import Counter
+from datetime import datetime
+from typing import *
+
+from shared.data_model import JobPriorities
+from shared.database import DatabaseConnector
+from shared.environment import (
+    DEFAULT_SCHEDULER_QUEUE_WEIGHTS,
+    DEFAULT_SCHEDULER_MAX_QUEUE_SHARE,
+    DEFAULT_SCHEDULER_AGING_SECONDS
+)
+from shared.log_config import setup_logging
+from shared.utils import job_queue, DEFAULT_JOB_QUEUE, ANONYMOUS_SUBMITTER
+
+
+logger = setup_logging(__file__)
+
+# attempts at claiming a selected job before giving up until the next drain, when other replicas keep claiming it first
+CLAIM_ATTEMPTS = 3
+
+
+def parse_queue_weights(weights: str) -> Dict[str, float]:
+    """Parse `SCHEDULER_QUEUE_WEIGHTS`, ie: "tellurium=4,copasi=4,mem3dg=1", into `{queue: weight}`."""
+    parsed = {}
+    for item in weights.split(","):
+        if not item.strip():
+            continue
+        queue, _, weight = item.partition("=")
+        try:
+            parsed[queue.strip()] = float(weight)
+        except ValueError:
+            logger.warning(f"Ignoring invalid queue weight: {item}")
+    return {queue: weight for queue, weight in parsed.items() if weight > 0}
+
+
+def parse_timestamp(timestamp: Any) -> Optional[datetime]:
+    if isinstance(timestamp, datetime):
+        return timestamp
+    try:
+        return datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return None
+
+
+class JobScheduler(object):
+    def __init__(
+            self,
+            slots: int,
+            queue_weights: Mapping[str, float] = None,
+            max_queue_share: float = DEFAULT_SCHEDULER_MAX_QUEUE_SHARE,
+            aging_seconds: float = DEFAULT_SCHEDULER_AGING_SECONDS
+    ):
+        """
+        :param slots: (`int`) number of jobs the worker runs concurrently.
+        :param queue_weights: (`Mapping[str, float]`) share of the slots of each queue relative to the others. Queues
+            that are not listed weigh 1. Defaults to `SCHEDULER_QUEUE_WEIGHTS`.
+        :param max_queue_share: (`float`) fraction of the slots that a single queue may use (at least one slot).
+        :param aging_seconds: (`float`) waiting time after which a pending job is raised by one priority class. 0
+            disables aging.
+        """
+        self.slots = slots
+        self.queue_weights = dict(queue_weights) if queue_weights is not None else parse_queue_weights(DEFAULT_SCHEDULER_QUEUE_WEIGHTS)
+        self.queue_cap = max(1, math.floor(slots * max_queue_share))
+        self.aging_seconds = aging_seconds
+        self.running_queues: Counter = Counter()
+        self.running_submitters: Counter = Counter()
+
+    @staticmethod
+    def job_key(job: Mapping[str, Any]) -> Tuple[str, str]:
+        """Queue and submitter of a job (or pending head), defaulted for jobs submitted without them."""
+        queue = job.get("queue") or (job_queue(job["job_id"]) if "job_id" in job else DEFAULT_JOB_QUEUE)
+        return queue, job.get("submitter") or ANONYMOUS_SUBMITTER
+
+    def effective_priority(self, head: Mapping[str, Any], now: datetime) -> int:
+        priority = head.get("priority")
+        priority = JobPriorities.NORMAL if priority is None else priority
+        submitted = parse_timestamp(head.get("last_updated"))
+        if not self.aging_seconds or submitted is None:
+            return priority
+        waited = max((now - submitted).total_seconds(), 0)
+        return max(JobPriorities.HIGH, priority - int(waited // self.aging_seconds))
+
+    def select(self, heads: Iterable[Mapping[str, Any]], now: datetime = None) -> Optional[Mapping[str, Any]]:
+        """The pending head (see `shared.database.pending_heads_pipeline`) to run next, or `None` if there is none
+            that may run now.
+        """
+        now = now or datetime.utcnow()
+        candidates = []
+        for head in heads:
+            queue, submitter = self.job_key(head)
+            if self.running_queues[queue] >= self.queue_cap:
+                continue
+            candidates.append((
+                self.effective_priority(head, now),
+                self.running_queues[queue] / self.queue_weights.get(queue, 1.),
+                self.running_submitters[submitter],
+                str(head.get("last_updated")),
+                head
+            ))
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: candidate[:4])[-1]
+
+    async def claim(self, db_connector: DatabaseConnector, job_filter: Mapping[str, Any] = None) -> Optional[Mapping[str, Any]]:
+        """Select the next job to run among the pending jobs matching `job_filter` and claim it (moving it to
+            IN_PROGRESS). Returns the claimed job, or `None` if there is nothing this worker should start now.
+        """
+        job_filter = dict(job_filter or {})
+        for _ in range(CLAIM_ATTEMPTS):
+            head = self.select(await db_connector.pending_heads(job_filter))
+            if head is None:
+                return None
+            # the selected job may have been claimed by another replica in the meantime: then select again
+            job = await db_connector.claim_job(job_filter={**job_filter, "job_id": head["job_id"]})
+            if job is not None:
+                self.started(job)
+                return job
+        return None
+
+    def started(self, job: Mapping[str, Any]) -> None:
+        queue, submitter = self.job_key(job)
+        self.running_queues[queue] += 1
+        self.running_submitters[submitter] += 1
+
+    def charge(self, job: Mapping[str, Any]) -> bool:
+        """Account for an extra slot used by the running `job` (see `worker.pool.TaskSlots`), unless its queue already
+            uses its share of the slots. Returns whether the slot was charged; it is given back with `finished`.
+        """
+        queue, _ = self.job_key(job)
+        if self.running_queues[queue] >= self.queue_cap:
+            return False
+        self.started(job)
+        return True
+
+    def finished(self, job: Mapping[str, Any]) -> None:
+        queue, submitter = self.job_key(job)
+        self.running_queues[queue] -= 1
+        self.running_submitters[submitter] -= 1
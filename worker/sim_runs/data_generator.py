@@ -11,6 +11,7 @@ from bsp.utils.base_utils import handle_exception
 
 from shared.io import normalize_smoldyn_output_path_in_root, get_sbml_species_mapping
 from shared.log_config import setup_logging
+from worker.sim_runs.model_cache import ModelCache, get_model_cache, get_model_pool
 
 
 logger = setup_logging(__file__)
@@ -23,8 +24,12 @@ def run_readdy(
         particles_config: List[Dict[str, Union[List[float], np.ndarray]]],  # {PARTICLE_NAME: INITIAL_POSITIONS_ARRAY}  ie: {'E': np.random.random(size=(n_particles_e, 3)) * edge_length - .5*edge_length}
         dt: float,
         duration: float,
-        unit_system_config: Dict[str, str] = None
+        unit_system_config: Dict[str, str] = None,
+        output_dir: str = None
 ) -> Dict[str, str]:
+    """Run a readdy simulation, writing its trajectory to `out.h5` in `output_dir` (defaults to a new temporary
+        directory, so that concurrent runs never share an output file).
+    """
     READDY_ENABLED = True
     try:
         import readdy
@@ -53,7 +58,7 @@ def run_readdy(
             system.reactions.add(reaction_scheme, rate=float(reaction_rate))
         # configure simulation outputs
         simulation = system.simulation(kernel="CPU")
-        simulation.output_file = "out.h5"
+        simulation.output_file = os.path.join(output_dir or mkdtemp(), "out.h5")
         simulation.reaction_handler = "UncontrolledApproximation"
         # set initial particle state and configure observations
         for config in particles_config:
@@ -64,7 +69,7 @@ def run_readdy(
             simulation.add_particles(particle_name, particle_positions)
         simulation.observe.number_of_particles(
             stride=1,
-            types=list(set(species_names))
+            types=list(dict.fromkeys(species_names))
         )
         # run simulation for given time parameters
         n_steps = int(float(duration) / dt)
@@ -78,11 +83,43 @@ def run_readdy(
     return output
 
 
+SMOLDYN_COORDINATE_FIELDS = ["x", "y", "z"]
+
+
+def smoldyn_molecules_array(rows: List[List[float]]) -> np.ndarray:
+    """Convert the rows written by smoldyn's `listmols` command to a data table, ie: `[species, state, *position, serial]`,
+        into a structured array with named fields.
+    """
+    values = np.asarray(rows, dtype=np.float64)
+    n_coords = values.shape[1] - 3 if values.ndim == 2 else 3
+    coordinate_fields = SMOLDYN_COORDINATE_FIELDS[:n_coords] if 0 < n_coords <= 3 else [f"x{i}" for i in range(max(n_coords, 0))]
+    dtype = np.dtype(
+        [('species', np.int32), ('state', np.int32)]
+        + [(field, np.float64) for field in coordinate_fields]
+        + [('serial', np.int64)]
+    )
+    molecules = np.empty(len(values), dtype=dtype)
+    if len(values):
+        molecules['species'] = values[:, 0]
+        molecules['state'] = values[:, 1]
+        for i, field in enumerate(coordinate_fields):
+            molecules[field] = values[:, 2 + i]
+        molecules['serial'] = values[:, -1]
+    return molecules
+
+
 # TODO: should we return the actual data from memory, or that reflected in a smoldyn output txt file or both?
-def run_smoldyn(model_fp: str, duration: int, dt: float = None) -> Dict[str, Union[str, Dict[str, Union[float, List[float]]]]]:
+def run_smoldyn(
+        model_fp: str,
+        duration: int,
+        dt: float = None,
+        seed: int = None,
+        counts_only: bool = False
+) -> Dict[str, Union[str, np.ndarray, Dict[str, Union[List[str], np.ndarray]]]]:
     """Run the simulation model found at `model_fp` for the duration
         specified therein if output_files are specified in the smoldyn model file and return the aforementioned output file
-        or return a dictionary of an array of the `listmols` as well as `molcount` command outputs. NOTE: The model file is currently
+        or return a dictionary of the `molcount` output as a `(n_timesteps, 1 + n_species)` array with a `['time', *species]`
+        header, as well as the `listmols` output as a structured array (see `smoldyn_molecules_array`). NOTE: The model file is currently
         searched for this `output_files` value, and if it exists and not commented out, it will scan the root of the model_fp
         (usually where smoldyn output files are stored, which is the same dir as the model_fp) to retrieve the output file.
 
@@ -90,6 +127,9 @@ def run_smoldyn(model_fp: str, duration: int, dt: float = None) -> Dict[str, Uni
                 model_fp:`str`: path to the smoldyn configuration. Defaults to `None`.
                 duration:`float`: duration in seconds to run the simulation for.
                 dt:`float`: time step in seconds to run the simulation for. Defaults to None, which uses the built-in simulation dt.
+                seed:`int`: random seed of the simulation. Defaults to None, which keeps the seed of the model file (if any).
+                counts_only:`bool`: only return the `molcount` output from memory, even if the model declares output files
+                    (ie: for the replicates of an ensemble). Defaults to False.
 
         For the output, we should read the model file and search for "output_files" to start one of the lines.
         If it startswith that, then assume a return of the output txt file, if not: then assume a return from ram.
@@ -111,16 +151,19 @@ def run_smoldyn(model_fp: str, duration: int, dt: float = None) -> Dict[str, Uni
 
     output_data = {}
     simulation = Simulation.fromFile(model_fp)
+    if seed is not None:
+        simulation.setRandomSeed(seed)
     try:
         # case: there is no declaration of output_files in the smoldyn config file, or it is commented out
-        if not use_file_output:
+        if not use_file_output or counts_only:
             # write molcounts to counts dataset at every timestep (shape=(n_timesteps, 1+n_species <-- one for time)): [timestep, countSpec1, countSpec2, ...]
             simulation.addOutputData('species_counts')
             simulation.addCommand(cmd='molcount species_counts', cmd_type='E')
 
             # write spatial output to molecules dataset
-            simulation.addOutputData('molecules')
-            simulation.addCommand(cmd='listmols molecules', cmd_type='E')
+            if not counts_only:
+                simulation.addOutputData('molecules')
+                simulation.addCommand(cmd='listmols molecules', cmd_type='E')
 
             # run simulation for specified time
             step_size = dt or simulation.dt
@@ -133,17 +176,13 @@ def run_smoldyn(model_fp: str, duration: int, dt: float = None) -> Dict[str, Uni
                 if 'empty' not in species_name.lower():
                     species_names.append(species_name)
 
-            molecule_output = simulation.getOutputData('molecules')
-            counts_output = simulation.getOutputData('species_counts')
-            for i, output_array in enumerate(counts_output):
-                interval_data = {}
-                for j, species_count in enumerate(output_array):
-                    interval_data[species_names[j - 1]] = species_count
-                counts_output.pop(i)
-                counts_output.insert(i, interval_data)
+            # counts: one row per timestep, one column per header entry
+            counts_output = np.asarray(simulation.getOutputData('species_counts'), dtype=np.float64)
 
             # return ram data (default dimensions)
-            output_data = {'species_counts': counts_output, 'molecules': molecule_output}
+            output_data = {'species_counts': {'header': ['time', *species_names], 'values': counts_output}}
+            if not counts_only:
+                output_data['molecules'] = smoldyn_molecules_array(simulation.getOutputData('molecules'))
 
         # case: output files are specified, and thus time parameters by which to capture/collect output
         else:
@@ -170,29 +209,38 @@ def handle_sbml_exception() -> str:
     return error_message
 
 
-def run_sbml_pysces(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[List[float], str]]:
+PYSCES_PSC_FILENAME = "model.psc"
+
+
+def run_sbml_pysces(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[np.ndarray, str]]:
     PYSCES_ENABLED = True
     try:
         import pysces
     except ImportError:
         PYSCES_ENABLED = False
 
-    # model compilation
-    sbml_filename = sbml_fp.split('/')[-1]
-    psc_filename = sbml_filename + '.psc'
-    psc_fp = os.path.join(pysces.model_dir, psc_filename)
     # get output with mapping of internal species ids to external (shared) species names
     sbml_species_mapping = get_sbml_species_mapping(sbml_fp)
-    obs_names = list(sbml_species_mapping.keys())
-    obs_ids = list(sbml_species_mapping.values())
     # run the simulation with specified time params and get the data
     try:
+        # model translation: reuse the .psc translated from identical sbml, otherwise translate into a private dir (not
+        # pysces.model_dir, where concurrent jobs uploading files of the same name would overwrite each other)
+        model_cache = get_model_cache("pysces")
+        if model_cache is not None:
+            model_key = ModelCache.model_key(sbml_fp, pysces.__version__)
+            psc_dir = model_cache.get_or_build(
+                model_key,
+                lambda output_dir: pysces.interface.convertSBML2PSC(sbml_fp, pscfile=PYSCES_PSC_FILENAME, pscdir=output_dir)
+            )
+        else:
+            psc_dir = mkdtemp()
+            pysces.interface.convertSBML2PSC(sbml_fp, pscfile=PYSCES_PSC_FILENAME, pscdir=psc_dir)
         # NOTE: the below model load works only in pysces 1.2.2 which is not available on conda via mac. TODO: fix this.
-        model = pysces.loadSBML(sbmlfile=sbml_fp, pscfile=psc_fp)
+        model = pysces.model(PYSCES_PSC_FILENAME, dir=psc_dir)
         model.sim_time = np.linspace(start, dur, steps + 1)
         model.Simulate(1)  # specify userinit=1 to directly use model.sim_time (t) rather than the default
         return {
-            name: model.data_sim.getSimData(obs_id)[:, 1].tolist()
+            name: model.data_sim.getSimData(obs_id)[:, 1]
             for name, obs_id in sbml_species_mapping.items()
         }
     except:
@@ -201,16 +249,24 @@ def run_sbml_pysces(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str,
         return {"error": error_message}
 
 
-def run_sbml_tellurium(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[List[float], str]]:
+def run_sbml_tellurium(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[np.ndarray, str]]:
     TELLURIUM_ENABLED = True
     try:
         import tellurium as te
     except ImportError:
         TELLURIUM_ENABLED = False
 
+    model_pool = get_model_pool()
+    model_key = None
     result = None
     try:
-        simulator = te.loadSBMLModel(sbml_fp)
+        if model_pool is not None:
+            model_key = ModelCache.model_key(sbml_fp)
+            simulator = model_pool.acquire("tellurium", model_key, lambda: te.loadSBMLModel(sbml_fp))
+            # restore the initial conditions and parameters that the previous run of this instance moved on from
+            simulator.resetToOrigin()
+        else:
+            simulator = te.loadSBMLModel(sbml_fp)
         if start > 0:
             simulator.simulate(0, start)
         result = simulator.simulate(start, dur, steps + 1)
@@ -222,43 +278,93 @@ def run_sbml_tellurium(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[s
                     for spec_name, spec_id in species_mapping.items():
                         if colname.replace("[", "").replace("]", "") == spec_id:
                             data = result[colname]
-                            outputs[spec_name] = data.tolist()
+                            outputs[spec_name] = np.asarray(data)
             return outputs
         else:
             raise Exception('Tellurium: Could not generate results.')
     except:
+        if model_key is not None:
+            model_pool.discard("tellurium", model_key)
         error_message = handle_sbml_exception()
         logger.error(error_message)
         return {"error": error_message}
 
 
-def run_sbml_copasi(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[List[float], str]]:
+def run_sbml_copasi(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[np.ndarray, str]]:
     COPASI_ENABLED = True
     try:
-        from basico import load_model, get_species, run_time_course
+        from basico import load_model, get_species, run_time_course, remove_datamodel
     except ImportError:
         COPASI_ENABLED = False
 
+    model_pool = get_model_pool()
+    model_key = None
     try:
         t = np.linspace(start, dur, steps + 1)
-        model = load_model(sbml_fp)
+        if model_pool is not None:
+            model_key = ModelCache.model_key(sbml_fp)
+            model = model_pool.acquire("copasi", model_key, lambda: load_model(sbml_fp), close=remove_datamodel)
+        else:
+            model = load_model(sbml_fp)
         specs = get_species(model=model).index.tolist()
         for spec in specs:
             if spec == "EmptySet" or "EmptySet" in spec:
                 specs.remove(spec)
-        tc = run_time_course(model=model, update_model=True, values=t)
-        data = {spec: tc[spec].values.tolist() for spec in specs}
+        # leave the model at its initial state so that a pooled instance can be run again as loaded
+        tc = run_time_course(model=model, update_model=False, values=t)
+        data = {spec: tc[spec].to_numpy() for spec in specs}
         return data
     except:
+        if model_key is not None:
+            model_pool.discard("copasi", model_key)
         error_message = handle_sbml_exception()
         logger.error(error_message)
         return {"error": error_message}
 
 
-def run_sbml_amici(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[List[float], str]]:
+def compile_amici_model(sbml_fp: str, model_id: str, model_output_dir: str) -> None:
+    """Generate and compile the amici model module for the SBML model at `sbml_fp` into `model_output_dir`."""
+    from amici import SbmlImporter
+
+    sbml_importer = SbmlImporter(sbml_fp)
+    sbml_importer.sbml2amici(
+        model_id,
+        model_output_dir,
+        verbose=logging.INFO,
+        observables=None,
+        sigmas=None,
+        constant_parameters=None
+    )
+
+
+def load_amici_model(sbml_fp: str):
+    """Compile (or reuse the module compiled for identical sbml, as code generation and compilation dominate amici's
+        runtime) and instantiate the amici model of the SBML model at `sbml_fp`.
+    """
+    import amici
+    from amici import import_model_module
+
+    model_cache = get_model_cache("amici")
+    if model_cache is not None:
+        model_key = ModelCache.model_key(sbml_fp, amici.__version__)
+        model_id = f"amici_{model_key[:16]}"
+        model_output_dir = model_cache.get_or_build(
+            model_key,
+            lambda output_dir: compile_amici_model(sbml_fp, model_id, output_dir)
+        )
+    else:
+        model_id = sbml_fp.split('/')[-1].replace('.xml', '')
+        model_output_dir = mkdtemp()
+        compile_amici_model(sbml_fp, model_id, model_output_dir)
+    model_module = import_model_module(model_id, model_output_dir)
+    return model_module.getModel()
+
+
+def run_sbml_amici(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[np.ndarray, str]]:
     AMICI_ENABLED = True
     try:
-        from amici import SbmlImporter, import_model_module, Model, runAmiciSimulation
+        import amici
+        from amici import Model, runAmiciSimulation
     except ImportError:
         AMICI_ENABLED = False
 
@@ -266,20 +372,7 @@ def run_sbml_amici(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str,
         sbml_reader = libsbml.SBMLReader()
         sbml_doc = sbml_reader.readSBML(sbml_fp)
         sbml_model_object = sbml_doc.getModel()
-        sbml_importer = SbmlImporter(sbml_fp)
-        model_id = sbml_fp.split('/')[-1].replace('.xml', '')
-        model_output_dir = mkdtemp()
-        sbml_importer.sbml2amici(
-            model_id,
-            model_output_dir,
-            verbose=logging.INFO,
-            observables=None,
-            sigmas=None,
-            constant_parameters=None
-        )
-        # model_output_dir = model_id  # mkdtemp()
-        model_module = import_model_module(model_id, model_output_dir)
-        amici_model_object: Model = model_module.getModel()
+        amici_model_object: Model = load_amici_model(sbml_fp)
         floating_species_list = list(amici_model_object.getStateIds())
         floating_species_initial = list(amici_model_object.getInitialStates())
         sbml_species_ids = [spec.getName() for spec in sbml_model_object.getListOfSpecies()]
@@ -303,7 +396,7 @@ def run_sbml_amici(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str,
         ))
         results = floating_results
         return {
-            key: val.tolist() if isinstance(val, np.ndarray) else val
+            key: np.asarray(val)
             for key, val in results.items()
         }
     except:
@@ -317,45 +410,42 @@ def run_sbml_amici(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str,
 COMPATIBLE_UTC_SIMULATORS = ["amici", "copasi", "pysces", "tellurium"]
 
 SBML_EXECUTORS = dict(zip(
-    [data[0] for data in COMPATIBLE_UTC_SIMULATORS],
+    COMPATIBLE_UTC_SIMULATORS,
     [run_sbml_amici, run_sbml_copasi, run_sbml_pysces, run_sbml_tellurium]
 ))
 
 
-def generate_sbml_utc_outputs(sbml_fp: str, start: int, dur: int, steps: int, simulators: list[str] = None) -> dict:
-    # TODO: add VCELL and pysces here
-    output = {}
+def run_sbml_utc_simulator(simulator: str, sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str, Union[np.ndarray, str]]:
+    """Run a uniform time course of the SBML model at `sbml_fp` with a single simulator and index its output by the
+        model's species names. Defined at module level so that each simulator can be run in its own process.
+
+        Returns:
+            `{species_name: values_array}` or `{"error": message}` if the simulation failed.
+    """
     sbml_species_ids = list(get_sbml_species_mapping(sbml_fp).keys())
-    simulators = simulators or ['amici', 'copasi', 'tellurium', 'pysces']
-    all_output_ids = []
-    for simulator in simulators:
-        results = {}
-        simulator = simulator.lower()
-        simulation_executor = SBML_EXECUTORS[simulator]
-        sim_result = simulation_executor(sbml_fp=sbml_fp, start=start, dur=dur, steps=steps)
-
-        # case: simulation execution was successful
-        if "error" not in sim_result.keys():
-            # add to all shared names
-            all_output_ids.append(list(sim_result.keys()))
-
-            # iterate over sbml_species_ids to index output data
-            for species_id in sbml_species_ids:
-                if species_id in sim_result.keys():
-                    output_vals = sim_result[species_id]
-                    if isinstance(output_vals, np.ndarray):
-                        output_vals = output_vals.tolist()
-                    results[species_id] = output_vals
-        else:
-            # case: simulation had an error
-            results = sim_result
+    simulation_executor = SBML_EXECUTORS[simulator.lower()]
+    sim_result = simulation_executor(sbml_fp=sbml_fp, start=start, dur=dur, steps=steps)
+
+    # case: simulation had an error
+    if "error" in sim_result.keys():
+        return sim_result
+
+    # case: simulation execution was successful: iterate over sbml_species_ids to index output data
+    results = {}
+    for species_id in sbml_species_ids:
+        if species_id in sim_result.keys():
+            results[species_id] = sim_result[species_id]
+    return results
+
 
-        # set the simulator output
-        output[simulator] = results
+def select_shared_outputs(output: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Restrict each simulator's output to the species ids produced by every successful simulator (keeping errors)."""
+    successful_output_ids = [
+        list(sim_data.keys()) for sim_data in output.values() if "error" not in sim_data.keys()
+    ]
+    shared_output_ids = set(successful_output_ids[0]).intersection(*successful_output_ids[1:]) if successful_output_ids else set()
 
-    # get the commonly shared output ids
     final_output = {}
-    shared_output_ids = min(all_output_ids)
     for simulator_name in output.keys():
         sim_data = {}
         for spec_id in output[simulator_name].keys():
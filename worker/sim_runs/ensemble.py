@@ -0,0 +1,264 @@
+"""
+Ensembles of stochastic replicates (smoldyn, readdy).
+
+A single trajectory of a stochastic simulator says little on its own, so an ensemble runs N replicates of the same model,
+each as its own task in the worker's process pool, with its own seed and in its own working directory (the simulators
+write their output files next to the model or to a fixed file name, so replicates sharing a directory would overwrite
+each other). Each replicate returns its species counts over time, and the counts are folded into running statistics as
+soon as the replicate completes, so that the worker never holds the N trajectories at once:
+
+    - mean and variance, with Welford's algorithm,
+    - minimum and maximum,
+    - quantiles, each estimated with the P-square algorithm (Jain & Chlamtac), which keeps five markers per value
+      rather than every observation.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import traceback
+from typing import *
+
+import numpy as np
+
+from shared.log_config import setup_logging
+from worker.pool import TaskSlots
+
+
+logger = setup_logging(__file__)
+
+ENSEMBLE_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class RunningMoments(object):
+    """Elementwise mean, (sample) variance, minimum and maximum of a stream of equally shaped arrays."""
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.minimum = None
+        self.maximum = None
+        self._m2 = None
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+        if self.mean is None:
+            self.mean = values.copy()
+            self.minimum = values.copy()
+            self.maximum = values.copy()
+            self._m2 = np.zeros_like(values)
+            return
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (values - self.mean)
+        np.minimum(self.minimum, values, out=self.minimum)
+        np.maximum(self.maximum, values, out=self.maximum)
+
+    @property
+    def variance(self) -> np.ndarray:
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self._m2 / (self.count - 1)
+
+
+class P2Quantile(object):
+    """Elementwise streaming estimate of the `p` quantile of a stream of equally shaped arrays, with the P-square
+        algorithm: five markers per element track the minimum, the `p/2`, `p` and `(1+p)/2` quantiles and the maximum,
+        and are moved towards their desired positions with piecewise-parabolic interpolation. The first five arrays are
+        kept as they are, and the quantile is exact until then.
+    """
+    MARKERS = 5
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self.heights = None
+        self.positions = None
+        # desired (0-based) marker positions, and their increment per observation
+        self.desired = np.array([0., 2 * p, 4 * p, 2 + 2 * p, 4.])
+        self.increments = np.array([0., p / 2, p, (1 + p) / 2, 1.])
+        self._initial = []
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+        if self.heights is None:
+            self._initial.append(values.copy())
+            if len(self._initial) == self.MARKERS:
+                self.heights = np.sort(np.stack(self._initial), axis=0)
+                self.positions = np.broadcast_to(self._marker_index(values.ndim), self.heights.shape).astype(np.float64)
+                self._initial = []
+            return
+
+        q, n = self.heights, self.positions
+        # cell of each value between the markers (0 to 3), then extend the extreme markers to it
+        cell = (values >= q[1:4]).sum(axis=0)
+        np.minimum(q[0], values, out=q[0])
+        np.maximum(q[4], values, out=q[4])
+        n += self._marker_index(values.ndim) > cell
+        self.desired = self.desired + self.increments
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            up = (d >= 1) & (n[i + 1] - n[i] > 1)
+            down = (d <= -1) & (n[i - 1] - n[i] < -1)
+            move = up | down
+            if not move.any():
+                continue
+            s = np.where(up, 1., -1.)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                linear = q[i] + s * (np.where(up, q[i + 1], q[i - 1]) - q[i]) / (np.where(up, n[i + 1], n[i - 1]) - n[i])
+            height = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+            q[i] = np.where(move, height, q[i])
+            n[i] = np.where(move, n[i] + s, n[i])
+
+    def value(self) -> np.ndarray:
+        if self.heights is None:
+            return np.quantile(np.stack(self._initial), self.p, axis=0)
+        return self.heights[2].copy()
+
+    def _marker_index(self, ndim: int) -> np.ndarray:
+        return np.arange(self.MARKERS, dtype=np.float64).reshape((self.MARKERS,) + (1,) * ndim)
+
+
+class EnsembleStatistics(object):
+    """Running statistics of the `(n_timepoints, n_species)` counts of the replicates of an ensemble."""
+    def __init__(self, quantiles: Sequence[float] = ENSEMBLE_QUANTILES):
+        self.moments = RunningMoments()
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    @property
+    def count(self) -> int:
+        return self.moments.count
+
+    def update(self, values: np.ndarray) -> None:
+        self.moments.update(values)
+        for quantile in self.quantiles:
+            quantile.update(values)
+
+    def result(self) -> Dict[str, np.ndarray]:
+        statistics = {
+            "mean": self.moments.mean,
+            "variance": self.moments.variance,
+            "min": self.moments.minimum,
+            "max": self.moments.maximum,
+        }
+        for quantile in self.quantiles:
+            statistics[f"quantile_{quantile.p:g}"] = quantile.value()
+        return statistics
+
+
+def replicate_seeds(seed: Optional[int], n_replicates: int) -> List[int]:
+    """Independent seeds for `n_replicates` replicates, derived from `seed` (reproducibly) or from fresh entropy."""
+    children = np.random.SeedSequence(seed).spawn(n_replicates)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def handle_replicate_exception(simulator: str) -> Dict[str, str]:
+    message = f"{simulator}-replicate-error:\n{traceback.format_exc()}"
+    logger.error(message)
+    return {"error": message}
+
+
+def run_smoldyn_replicate(model_fp: str, duration: int, dt: float = None, seed: int = None) -> Dict[str, Any]:
+    """Run one replicate of the smoldyn model at `model_fp` in a private copy of its directory. Defined at module level
+        so that it can be run in a pool process.
+
+        Returns:
+            `{"header": ['time', *species], "values": (n_timepoints, 1 + n_species) counts}` or `{"error": message}`.
+    """
+    from worker.sim_runs.data_generator import run_smoldyn
+
+    replicate_dir = tempfile.mkdtemp()
+    try:
+        replicate_fp = shutil.copy(model_fp, replicate_dir)
+        output = run_smoldyn(model_fp=replicate_fp, duration=duration, dt=dt, seed=seed, counts_only=True)
+        if "error" in output:
+            return output
+        return output["species_counts"]
+    except:
+        return handle_replicate_exception("smoldyn")
+    finally:
+        shutil.rmtree(replicate_dir, ignore_errors=True)
+
+
+def run_readdy_replicate(**config) -> Dict[str, Any]:
+    """Run one replicate of the readdy system described by `config` (the arguments of `run_readdy`) in its own output
+        directory. Defined at module level so that it can be run in a pool process.
+
+        Returns:
+            `{"header": ['time', *species], "values": (n_timepoints, 1 + n_species) counts}` or `{"error": message}`.
+    """
+    from worker.sim_runs.data_generator import run_readdy
+
+    replicate_dir = tempfile.mkdtemp()
+    try:
+        output = run_readdy(output_dir=replicate_dir, **config)
+        if "error" in output:
+            return output
+        import readdy
+
+        trajectory = readdy.Trajectory(output["results_file"])
+        times, counts = trajectory.read_observable_number_of_particles()
+        species_names = list(dict.fromkeys(species["name"] for species in config["species_config"]))
+        return {"header": ["time", *species_names], "values": np.column_stack([times, counts]).astype(np.float64)}
+    except:
+        return handle_replicate_exception("readdy")
+    finally:
+        shutil.rmtree(replicate_dir, ignore_errors=True)
+
+
+async def run_ensemble(
+        pool,
+        replicate: Callable[..., Dict[str, Any]],
+        replicate_kwargs: Sequence[Mapping[str, Any]],
+        quantiles: Sequence[float] = ENSEMBLE_QUANTILES,
+        slots: TaskSlots = None
+) -> Dict[str, Any]:
+    """Run `replicate(**kwargs)` for each of `replicate_kwargs` in `pool` (a `worker.pool.SimulationPool`) and reduce
+        their counts into ensemble statistics as they complete. At most as many replicates as `slots` allows (by
+        default, the pool's number of slots) are in flight at once, so that an ensemble does not queue ahead of the
+        other jobs of the pool.
+
+        Returns:
+            `{"header": species, "time": times, "statistics": {name: (n_timepoints, n_species)}, "n_replicates": int,
+            "failed": [indices]}`, or `{"error": message}` if every replicate failed.
+    """
+    slots = slots or TaskSlots(limit=pool.slots)
+
+    async def run_replicate(i: int) -> Tuple[int, Dict[str, Any]]:
+        return i, await slots.run(pool, replicate, **replicate_kwargs[i])
+
+    statistics = EnsembleStatistics(quantiles)
+    header = None
+    times = None
+    failed = []
+    errors = []
+    for completed in asyncio.as_completed([run_replicate(i) for i in range(len(replicate_kwargs))]):
+        i, output = await completed
+        if "error" in output:
+            failed.append(i)
+            errors.append(output["error"])
+            continue
+        values = np.asarray(output["values"], dtype=np.float64)
+        if header is None:
+            header, times = list(output["header"]), values[:, 0]
+        elif list(output["header"]) != header or len(values) != len(times):
+            failed.append(i)
+            errors.append(f"Replicate {i} produced a different output shape than the others.")
+            continue
+        await asyncio.to_thread(statistics.update, values[:, 1:])
+
+    if not statistics.count:
+        return {"error": errors[0] if errors else "The ensemble has no replicates."}
+    return {
+        "header": header[1:],
+        "time": times,
+        "statistics": statistics.result(),
+        "n_replicates": statistics.count,
+        "failed": sorted(failed),
+    }
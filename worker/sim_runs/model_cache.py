@@ -0,0 +1,270 @@
+"""
+Caches of simulator artifacts derived from a model file: on disk (ie: compiled AMICI modules), and in memory (loaded
+simulator instances kept warm in each worker process).
+
+Building these artifacts (code generation, compilation, translation) often costs far more than the simulation itself,
+and most submissions are repeats of a model that has been seen before. Entries are keyed by the model's content (plus
+anything else the artifact depends on, such as the simulator version), built at most once per host under a per-entry
+file lock, and evicted least-recently-used first once the cache exceeds its size budget.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+from shared.environment import (
+    DEFAULT_MODEL_CACHE_DIR,
+    DEFAULT_MODEL_CACHE_MAX_BYTES,
+    DEFAULT_MODEL_CACHE_GRACE_SECONDS,
+    DEFAULT_MODEL_POOL_MAX_BYTES
+)
+from shared.log_config import setup_logging
+
+
+logger = setup_logging(__file__)
+
+
+class ModelCache(object):
+    """Directory-per-entry artifact cache for one `namespace` (usually a simulator name) under `root`.
+
+        An entry is only served once its `.complete` marker exists, so that a build interrupted by a crashed worker is
+        never picked up half-written; the marker's mtime doubles as the entry's last-used time for eviction.
+
+        Entries are served under a shared lock and built or evicted under an exclusive one. Callers use the entry
+        directory after the lock is released (ie: to import a compiled module), so entries used within the last
+        `grace_seconds` are never evicted.
+    """
+    COMPLETE_MARKER = ".complete"
+    LOCK_SUFFIX = ".lock"
+
+    def __init__(
+            self,
+            namespace: str,
+            root: str = DEFAULT_MODEL_CACHE_DIR,
+            max_bytes: int = DEFAULT_MODEL_CACHE_MAX_BYTES,
+            grace_seconds: float = DEFAULT_MODEL_CACHE_GRACE_SECONDS
+    ):
+        self.root = os.path.join(root, namespace)
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def model_key(model_fp: str, *salt: Any) -> str:
+        """Hash of the contents of `model_fp` together with `salt` (ie: the simulator version)."""
+        digest = hashlib.sha256()
+        with open(model_fp, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        for value in salt:
+            digest.update(b"\0" + str(value).encode())
+        return digest.hexdigest()
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    @contextmanager
+    def entry_lock(self, key: str, shared: bool = False) -> Iterator[None]:
+        """Advisory lock on the entry for `key`, held across threads and processes of the same host. Its lock file is
+            removed with the entry, so a lock obtained on a file that was removed meanwhile is taken again on the new one.
+        """
+        lock_fp = self.entry_dir(key) + self.LOCK_SUFFIX
+        while True:
+            with open(lock_fp, 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    try:
+                        current = os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_fp))
+                    except FileNotFoundError:
+                        current = False
+                    if current:
+                        yield
+                        return
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _touch(self, entry_dir: str) -> bool:
+        """Mark the entry at `entry_dir` as recently used, if it is complete."""
+        try:
+            os.utime(os.path.join(entry_dir, self.COMPLETE_MARKER))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _remove(self, entry_dir: str) -> None:
+        """Remove the entry at `entry_dir` and its lock file, under its (exclusive) lock."""
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.remove(entry_dir + self.LOCK_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the directory of the complete entry for `key` (marking it as recently used) or `None` on a miss."""
+        entry_dir = self.entry_dir(key)
+        if not os.path.exists(os.path.join(entry_dir, self.COMPLETE_MARKER)):
+            return None
+        # the entry may be evicted until we hold its lock: check that it is still there under the lock
+        with self.entry_lock(key, shared=True):
+            return entry_dir if self._touch(entry_dir) else None
+
+    def get_or_build(self, key: str, build: Callable[[str], Any]) -> str:
+        """Return the directory of the entry for `key`, calling `build(entry_dir)` to populate it on a miss."""
+        entry_dir = self.get(key)
+        if entry_dir is not None:
+            return entry_dir
+
+        entry_dir = self.entry_dir(key)
+        with self.entry_lock(key):
+            # another worker may have built the entry while we were waiting for the lock
+            if not self._touch(entry_dir):
+                # clear any partial build left behind by an interrupted worker
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.makedirs(entry_dir)
+                try:
+                    build(entry_dir)
+                except:
+                    self._remove(entry_dir)
+                    raise
+                open(os.path.join(entry_dir, self.COMPLETE_MARKER), 'w').close()
+                logger.info(f"Built {self.root} cache entry {key}")
+
+        self.evict(keep=entry_dir)
+        return entry_dir
+
+    def evict(self, keep: str = None) -> int:
+        """Remove least-recently-used entries until the cache fits in `max_bytes`, but those used within the last
+            `grace_seconds`. Returns the number of bytes freed.
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            try:
+                last_used = os.stat(os.path.join(entry_dir, self.COMPLETE_MARKER)).st_mtime
+            except (FileNotFoundError, NotADirectoryError):
+                # lock files and entries that are still being built
+                continue
+            entries.append((last_used, directory_size(entry_dir), entry_dir))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        freed = 0
+        in_use_since = time.time() - self.grace_seconds
+        for last_used, size, entry_dir in sorted(entries):
+            if total_bytes - freed <= self.max_bytes:
+                break
+            if entry_dir == keep or last_used > in_use_since:
+                continue
+            with self.entry_lock(os.path.basename(entry_dir)):
+                # the entry may have been served (or evicted) while we were waiting for the lock
+                try:
+                    if os.stat(os.path.join(entry_dir, self.COMPLETE_MARKER)).st_mtime > in_use_since:
+                        continue
+                except FileNotFoundError:
+                    continue
+                self._remove(entry_dir)
+            freed += size
+        return freed
+
+
+def directory_size(dirpath: str) -> int:
+    size = 0
+    for root, _, filenames in os.walk(dirpath):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(root, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+_model_caches: Dict[str, ModelCache] = {}
+
+
+def get_model_cache(namespace: str) -> Optional[ModelCache]:
+    """Per-process `ModelCache` for `namespace`, or `None` if caching is disabled (MODEL_CACHE_MAX_BYTES=0)."""
+    if DEFAULT_MODEL_CACHE_MAX_BYTES <= 0:
+        return None
+    if namespace not in _model_caches:
+        _model_caches[namespace] = ModelCache(namespace)
+    return _model_caches[namespace]
+
+
+# -- in-memory pool of loaded models -- #
+
+def resident_set_size() -> int:
+    """Resident memory of this process in bytes (0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class WarmModelPool(object):
+    """Per-process LRU of loaded simulator instances keyed by simulator and model key, so that repeat simulations of the
+        same model skip parsing and compilation and only pay for the solver.
+
+        An instance's footprint is estimated as the growth of the process' resident memory while it was loaded, and
+        least-recently-used instances are dropped once the pooled footprint exceeds `max_bytes`. Callers must restore
+        the model's initial state before each run. Instances are not shared between concurrent callers: each pool
+        process runs one simulation at a time.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MODEL_POOL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int, Optional[Callable[[Any], Any]]]] = OrderedDict()
+
+    def acquire(self, simulator: str, model_key: str, load: Callable[[], Any], close: Callable[[Any], Any] = None) -> Any:
+        """Return the pooled instance for (`simulator`, `model_key`), calling `load()` to create it on a miss.
+            `close(instance)` is called when the instance is evicted.
+        """
+        key = (simulator, model_key)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        rss_before = resident_set_size()
+        instance = load()
+        footprint = max(resident_set_size() - rss_before, 0)
+        self._entries[key] = (instance, footprint, close)
+        self.total_bytes += footprint
+        self.evict(keep=key)
+        return instance
+
+    def discard(self, simulator: str, model_key: str) -> None:
+        """Drop an instance that may have been left in an unusable state (ie: by a failed run)."""
+        self._remove((simulator, model_key))
+
+    def evict(self, keep: Hashable = None) -> None:
+        for key in list(self._entries.keys()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key != keep:
+                self._remove(key)
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        instance, footprint, close = entry
+        self.total_bytes -= footprint
+        if close is not None:
+            try:
+                close(instance)
+            except Exception as e:
+                logger.warning(f"Could not close pooled {key[0]} model: {e}")
+
+
+_model_pool: WarmModelPool | None = None
+
+
+def get_model_pool() -> Optional[WarmModelPool]:
+    """Per-process `WarmModelPool`, or `None` if pooling is disabled (MODEL_POOL_MAX_BYTES=0)."""
+    global _model_pool
+    if _model_pool is None and DEFAULT_MODEL_POOL_MAX_BYTES > 0:
+        _model_pool = WarmModelPool()
+    return _model_pool
@@ -1,40 +1,64 @@
+import asyncio
 import os
+import shutil
 import tempfile
 from typing import Dict, Mapping, Any
 
 from shared.database import MongoConnector
-from shared.environment import DEFAULT_BUCKET_NAME
-from shared.io import download_file, format_smoldyn_configuration, write_uploaded_file
+from shared.environment import DEFAULT_BUCKET_NAME, DEFAULT_SWEEP_CHUNK_BYTES
+from shared.io import fetch_file, format_smoldyn_configuration, write_uploaded_file
 from shared.data_model import OutputFile
-from worker.sim_runs.data_generator import run_smoldyn, run_readdy, generate_sbml_utc_outputs
+from shared.results_cache import contains_error
+from shared.results_store import ResultsStore
+from worker.pool import SimulationPool, TaskSlots
+from worker.sim_runs.data_generator import run_smoldyn, run_readdy, run_sbml_utc_simulator, select_shared_outputs
+from worker.sim_runs.ensemble import run_ensemble, run_smoldyn_replicate, run_readdy_replicate, replicate_seeds
+from worker.sim_runs.sweep import run_sweep
 
 
 # TODO: CONSOLIDATE THIS INTO A SINGLE COMPOSITION RUNNER
 
 class RunsWorker(object):
+    def __init__(self, pool: SimulationPool = None, results_store: ResultsStore = None, task_slots: TaskSlots = None):
+        """
+        :param pool: (`worker.pool.SimulationPool`) process pool in which the simulator executors are run.
+        :param results_store: (`shared.results_store.ResultsStore`) binary storage for array results.
+        :param task_slots: (`worker.pool.TaskSlots`) bounds the pool tasks of a job that runs several (ensembles, sweeps).
+            Defaults to the pool's number of slots.
+        """
+        self.pool = pool or SimulationPool()
+        self.results_store = results_store or ResultsStore()
+        self.task_slots = task_slots or TaskSlots(limit=self.pool.slots)
+
     async def dispatch(self, job: Mapping[str, Any], db_connector: MongoConnector):
+        """Run a job that has already been claimed (moved to IN_PROGRESS) by the dispatcher."""
         result = {}
-        source_fp = job.get('path')
-        job_status = job["status"]
-        if job_status.lower() == "pending":
-            # change job status to IN_PROGRESS
-            job_id = job["job_id"]
-            await db_connector.update_job(job_id=job_id, status="IN_PROGRESS")
-
-            # case: is either utc or smoldyn
-            if source_fp is not None:
-                out_dir = tempfile.mkdtemp()
-                local_fp = download_file(source_blob_path=source_fp, out_dir=out_dir, bucket_name=DEFAULT_BUCKET_NAME)
+        # utc runs store their sbml source as `model_file`
+        source_fp = job.get('path') or job.get('model_file')
+        job_id = job["job_id"]
+
+        # case: is either utc or smoldyn
+        if source_fp is not None:
+            out_dir = tempfile.mkdtemp()
+            try:
+                local_fp = await fetch_file(source_blob_path=source_fp, out_dir=out_dir, bucket_name=DEFAULT_BUCKET_NAME)
                 if local_fp.endswith('.txt'):
                     result = await self.run_smoldyn(local_fp=local_fp, job=job)
+                elif local_fp.endswith('.xml') and job.get('samples') is not None:
+                    result = await self.run_sweep(local_fp=local_fp, job=job)
                 elif local_fp.endswith('.xml'):
-                    result = await self.run_utc(local_fp=local_fp, job=job)
-            # case: is readdy (no input file)
-            elif "readdy" in job.get('job_id'):
-                result = await self.run_readdy(job)
-
-            # change status to COMPLETE and set results
-            await db_connector.update_job(job_id=job_id, status="COMPLETE", results=result)
+                    result = await self.run_utc(local_fp=local_fp, job=job, db_connector=db_connector)
+            finally:
+                # the model and any outputs written next to it have been uploaded by now
+                shutil.rmtree(out_dir, ignore_errors=True)
+        # case: is readdy (no input file)
+        elif "readdy" in job.get('job_id'):
+            result = await self.run_readdy(job)
+
+        # change status to COMPLETE and set results
+        await db_connector.update_job(job_id=job_id, status="COMPLETE", results=result)
+        if not contains_error(result):
+            await db_connector.memoize_job(job)
 
     async def run_smoldyn(self, local_fp: str, job: Mapping[str, Any]) -> OutputFile | Dict:
         # format model file for disabling graphics
@@ -45,9 +69,11 @@ class RunsWorker(object):
         dt = job.get('dt')
         initial_species_state = job.get('initial_molecule_state')  # not yet implemented
         job_id = job.get('job_id')
+        if job.get('replicates', 1) > 1:
+            return await self.run_smoldyn_ensemble(local_fp, job)
 
         # execute simularium, pointing to a filepath that is returned by the run smoldyn call
-        result = run_smoldyn(model_fp=local_fp, duration=duration, dt=dt)
+        result = await self.pool.run(run_smoldyn, model_fp=local_fp, duration=duration, dt=dt, seed=job.get('seed'))
 
         # write the aforementioned output file (which is itself locally written to the temp out_dir, to the bucket if applicable
         results_file = result.get('results_file')
@@ -58,8 +84,15 @@ class RunsWorker(object):
                 bucket_name=DEFAULT_BUCKET_NAME,
                 extension='.txt'
             )
-            # return {'results_file': uploaded_file_location}
-            return OutputFile(results_file=results_file)
+            return OutputFile(results_file=uploaded_file_location).to_dict()
+        elif 'species_counts' in result:
+            # in-memory output: store the arrays in binary form rather than as nested bson lists
+            species_counts = result['species_counts']
+            return await self.results_store.write(
+                job_id,
+                {'species_counts': species_counts['values'], 'molecules': result['molecules']},
+                species_counts_header=species_counts['header']
+            )
         else:
             return result
 
@@ -72,9 +105,7 @@ class RunsWorker(object):
         particles_config = job.get('particles_config')
         reactions_config = job.get('reactions_config')
         unit_system_config = job.get('unit_system_config')
-
-        # run simulations
-        result = run_readdy(
+        config = dict(
             box_size=box_size,
             species_config=species_config,
             particles_config=particles_config,
@@ -83,6 +114,14 @@ class RunsWorker(object):
             duration=duration,
             dt=dt
         )
+        n_replicates = job.get('replicates', 1)
+        if n_replicates > 1:
+            # readdy cannot be seeded: replicates differ by their own random streams
+            ensemble = await run_ensemble(self.pool, run_readdy_replicate, [config] * n_replicates, slots=self.task_slots)
+            return await self.store_ensemble(job['job_id'], ensemble)
+
+        # run simulations
+        result = await self.pool.run(run_readdy, **config)
 
         # extract results file and write to bucket
         results_file = result.get('results_file')
@@ -93,19 +132,93 @@ class RunsWorker(object):
                 bucket_name=DEFAULT_BUCKET_NAME,
                 extension='.h5'
             )
-            os.remove(results_file)
+            shutil.rmtree(os.path.dirname(results_file), ignore_errors=True)
 
-            # return {'results_file': uploaded_file_location}
-            return OutputFile(results_file=results_file)
+            return OutputFile(results_file=uploaded_file_location).to_dict()
         else:
             return result
 
-    async def run_utc(self, local_fp: str, job: Mapping[str, Any]):
+    async def run_smoldyn_ensemble(self, local_fp: str, job: Mapping[str, Any]) -> Dict:
+        """Run `replicates` replicates of the smoldyn model at `local_fp`, seeded from the job's seed."""
+        seeds = replicate_seeds(job.get('seed'), job['replicates'])
+        ensemble = await run_ensemble(
+            self.pool,
+            run_smoldyn_replicate,
+            [{'model_fp': local_fp, 'duration': job.get('duration'), 'dt': job.get('dt'), 'seed': seed} for seed in seeds],
+            slots=self.task_slots
+        )
+        return await self.store_ensemble(job['job_id'], ensemble, seeds=seeds)
+
+    async def store_ensemble(self, job_id: str, ensemble: Dict[str, Any], **attributes) -> Dict:
+        """Store the statistics of an ensemble (see `worker.sim_runs.ensemble.run_ensemble`), one column each."""
+        if "error" in ensemble:
+            return ensemble
+        return await self.results_store.write(
+            job_id,
+            {'time': ensemble['time'], **ensemble['statistics']},
+            key='ensemble',
+            species=ensemble['header'],
+            n_replicates=ensemble['n_replicates'],
+            failed=ensemble['failed'],
+            **attributes
+        )
+
+    async def run_utc(self, local_fp: str, job: Mapping[str, Any], db_connector: MongoConnector) -> Dict:
+        """Run a uniform time course with each of the requested simulators, each in its own pool process. The output of
+            each simulator is written to `results.<simulator>` as soon as it completes, so that a slow simulator does
+            not hold back the others' (partial) results.
+        """
+        job_id = job['job_id']
         start = job['start']
-        end = job['end']
+        stop = job.get('stop', job.get('end'))
         steps = job['steps']
-        simulator = job.get('simulators')[0]
-
-        result = generate_sbml_utc_outputs(sbml_fp=local_fp, start=start, dur=end, steps=steps, simulators=[simulator])
-        return result[simulator]
-
+        simulators = [simulator.lower() for simulator in job.get('simulators') or [job['simulator']]]
+
+        async def run_simulator(simulator: str) -> tuple[str, Dict, Dict]:
+            sim_result = await self.pool.run(run_sbml_utc_simulator, simulator, local_fp, start, stop, steps)
+            if "error" in sim_result:
+                stored = sim_result
+            else:
+                stored = await self.results_store.write(job_id, sim_result, key=simulator)
+            if len(simulators) > 1:
+                await db_connector.update_job(job_id=job_id, **{f"results.{simulator}": stored})
+            return simulator, sim_result, stored
+
+        runs = await asyncio.gather(*[run_simulator(simulator) for simulator in simulators])
+        shared_output = select_shared_outputs({simulator: sim_result for simulator, sim_result, _ in runs})
+        result = {}
+        for simulator, sim_result, stored in runs:
+            if "error" in sim_result:
+                result[simulator] = shared_output[simulator]
+            else:
+                result[simulator] = await self.results_store.select(stored, shared_output[simulator].keys())
+        return result[simulators[0]] if len(simulators) == 1 else result
+
+    async def run_sweep(self, local_fp: str, job: Mapping[str, Any]) -> Dict:
+        """Run a uniform time course for each parameter set of a sweep (see `worker.sim_runs.sweep`) and store the
+            `(n_samples, n_timepoints, n_species)` values together with the samples, chunked along the samples.
+        """
+        job_id = job['job_id']
+        parameters = job['parameters']
+        samples = (await self.results_store.read(job['samples'], names=['samples']))['samples']
+        species, values, failed = await run_sweep(
+            self.pool,
+            job['simulator'],
+            local_fp,
+            job['start'],
+            job['stop'],
+            job['steps'],
+            parameters,
+            samples,
+            slots=self.task_slots
+        )
+        row_bytes = values[0].nbytes + samples[0].nbytes
+        return await self.results_store.write(
+            job_id,
+            {'values': values, 'samples': samples},
+            key='sweep',
+            chunk_rows=max(DEFAULT_SWEEP_CHUNK_BYTES // row_bytes, 1),
+            parameters=parameters,
+            species=species,
+            failed=failed
+        )
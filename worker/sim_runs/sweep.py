@@ -0,0 +1,284 @@
+"""
+Vectorized parameter sweeps of SBML uniform time courses.
+
+A sweep runs one model with many parameter sets (a grid or a sample matrix, ie: for a sensitivity analysis). Rather than
+submitting each set as its own job, which would reload the model and round-trip through the database every time, the
+sample matrix is split into blocks that are run in the worker's process pool. Each pool process loads the model once
+(and keeps it warm in its `WarmModelPool` for the following blocks, and sweeps), then for every sample restores the
+parameters set by earlier samples, sets the swept parameters in place and simulates. Outputs are written into one preallocated `(n_samples, n_timepoints,
+n_species)` array, which is stored in binary form by the `ResultsStore`.
+
+A sample whose simulation fails (ie: the solver does not converge for extreme parameter values) is left as NaN and its
+index is reported, rather than failing the whole sweep. The model is then reloaded, in case the failure left it unusable.
+"""
+import asyncio
+import math
+import traceback
+from typing import *
+
+import numpy as np
+
+from shared.io import get_sbml_species_mapping
+from shared.log_config import setup_logging
+from worker.pool import TaskSlots
+from worker.sim_runs.model_cache import ModelCache, get_model_pool
+
+
+logger = setup_logging(__file__)
+
+# blocks per pool process, so that processes that finish early pick up more work
+SWEEP_BLOCKS_PER_SLOT = 4
+
+
+class SweepModel(object):
+    """A model loaded once and simulated for many parameter sets, which are set in place. The model may be pooled and
+        reused by later sweeps over other parameters, so before each sample every parameter set by an earlier one is
+        restored to its value at load time (`initial_values`, snapshot by subclasses on load).
+    """
+    species: List[str]
+
+    def __init__(self, initial_values: Mapping[str, float]):
+        self.initial_values = dict(initial_values)
+        self.modified: Set[str] = set()
+
+    def set_parameter(self, name: str, value: float) -> None:
+        raise NotImplementedError
+
+    def run(self, start: int, stop: int, steps: int) -> np.ndarray:
+        """The `(steps + 1, n_species)` values of `species` over `[start, stop]` with the parameters as they are set."""
+        raise NotImplementedError
+
+    def simulate(self, parameters: List[str], values: Sequence[float], start: int, stop: int, steps: int) -> np.ndarray:
+        for name in self.modified.difference(parameters):
+            self.set_parameter(name, self.initial_values[name])
+        self.modified = {name for name in parameters if name in self.initial_values}
+        for name, value in zip(parameters, values):
+            self.set_parameter(name, float(value))
+        return self.run(start, stop, steps)
+
+    def close(self) -> None:
+        pass
+
+
+class TelluriumSweepModel(SweepModel):
+    def __init__(self, sbml_fp: str):
+        import tellurium as te
+
+        # `resetAll` restores every parameter: nothing to snapshot
+        super().__init__({})
+        self.simulator = te.loadSBMLModel(sbml_fp)
+        species_ids = list(self.simulator.getFloatingSpeciesIds())
+        species_names = {spec_id: name for name, spec_id in get_sbml_species_mapping(sbml_fp).items()}
+        self.species = [species_names.get(spec_id, spec_id) for spec_id in species_ids]
+        self.simulator.timeCourseSelections = ["time"] + species_ids
+
+    def simulate(self, parameters: List[str], values: Sequence[float], start: int, stop: int, steps: int) -> np.ndarray:
+        # restore the initial state and every parameter, then set the swept ones in place
+        self.simulator.resetAll()
+        return super().simulate(parameters, values, start, stop, steps)
+
+    def set_parameter(self, name: str, value: float) -> None:
+        self.simulator.setValue(name, value)
+
+    def run(self, start: int, stop: int, steps: int) -> np.ndarray:
+        if start > 0:
+            self.simulator.simulate(0, start)
+        return np.asarray(self.simulator.simulate(start, stop, steps + 1))[:, 1:]
+
+
+class CopasiSweepModel(SweepModel):
+    def __init__(self, sbml_fp: str):
+        from basico import load_model, get_species, get_parameters, get_reaction_parameters
+
+        self.model = load_model(sbml_fp)
+        self.species = [spec for spec in get_species(model=self.model).index.tolist() if "EmptySet" not in spec]
+        # global parameters, and local parameters of reactions (named `(reaction).parameter`)
+        global_parameters = get_parameters(model=self.model)
+        local_parameters = get_reaction_parameters(model=self.model)
+        self.local_parameters = set() if local_parameters is None else set(local_parameters.index)
+        super().__init__({
+            **({} if global_parameters is None else global_parameters["initial_value"].to_dict()),
+            **({} if local_parameters is None else local_parameters["value"].to_dict())
+        })
+
+    def set_parameter(self, name: str, value: float) -> None:
+        from basico import set_parameters, set_reaction_parameters
+
+        if name in self.local_parameters:
+            set_reaction_parameters(name, value=value, model=self.model)
+        else:
+            set_parameters(name, exact=True, initial_value=value, model=self.model)
+
+    def run(self, start: int, stop: int, steps: int) -> np.ndarray:
+        from basico import run_time_course
+
+        # leave the model at its initial state for the next sample
+        tc = run_time_course(model=self.model, update_model=False, values=np.linspace(start, stop, steps + 1))
+        return tc[self.species].to_numpy()
+
+    def close(self) -> None:
+        from basico import remove_datamodel
+
+        remove_datamodel(self.model)
+
+
+class AmiciSweepModel(SweepModel):
+    def __init__(self, sbml_fp: str):
+        import amici
+        from worker.sim_runs.data_generator import load_amici_model
+
+        self.model = load_amici_model(sbml_fp)
+        self.solver = self.model.getSolver()
+        self.success = amici.AMICI_SUCCESS
+        self.species = list(self.model.getStateNames())
+        super().__init__(dict(zip(self.model.getParameterNames(), self.model.getParameters())))
+
+    def set_parameter(self, name: str, value: float) -> None:
+        # initial states are recomputed from the parameters on each run
+        self.model.setParameterByName(name, value)
+
+    def run(self, start: int, stop: int, steps: int) -> np.ndarray:
+        from amici import runAmiciSimulation
+
+        self.model.setTimepoints(np.linspace(start, stop, steps + 1))
+        result_data = runAmiciSimulation(self.model, self.solver)
+        if result_data.status != self.success:
+            raise RuntimeError(f"amici simulation failed with status {result_data.status}")
+        return np.asarray(result_data.x)
+
+
+SWEEP_MODELS = {
+    "amici": AmiciSweepModel,
+    "copasi": CopasiSweepModel,
+    "tellurium": TelluriumSweepModel,
+}
+
+
+def load_sweep_model(simulator: str, sbml_fp: str):
+    """The sweep model of `simulator` for the SBML model at `sbml_fp`, loaded at most once per process while it stays
+        in the warm model pool.
+    """
+    model_class = SWEEP_MODELS[simulator.lower()]
+    model_pool = get_model_pool()
+    if model_pool is None:
+        return model_class(sbml_fp)
+    return model_pool.acquire(
+        f"{simulator.lower()}-sweep",
+        ModelCache.model_key(sbml_fp),
+        lambda: model_class(sbml_fp),
+        close=lambda model: model.close()
+    )
+
+
+def discard_sweep_model(simulator: str, sbml_fp: str, model) -> None:
+    """Close `model` (see `load_sweep_model`), which a failed simulation may have left in an unusable state, so that it
+        is reloaded on its next use.
+    """
+    model_pool = get_model_pool()
+    if model_pool is None:
+        model.close()
+    else:
+        model_pool.discard(f"{simulator.lower()}-sweep", ModelCache.model_key(sbml_fp))
+
+
+def sample_blocks(n_samples: int, block_size: int) -> List[slice]:
+    """Consecutive slices of at most `block_size` of the rows of a sample matrix of `n_samples` rows."""
+    block_size = max(int(block_size), 1)
+    return [slice(start, min(start + block_size, n_samples)) for start in range(0, n_samples, block_size)]
+
+
+def default_block_size(n_samples: int, slots: int) -> int:
+    return max(math.ceil(n_samples / (max(slots, 1) * SWEEP_BLOCKS_PER_SLOT)), 1)
+
+
+def run_sweep_block(
+        simulator: str,
+        sbml_fp: str,
+        start: int,
+        stop: int,
+        steps: int,
+        parameters: List[str],
+        samples: np.ndarray
+) -> Dict[str, Any]:
+    """Simulate each row of `samples` (values of `parameters`) in turn. Defined at module level so that it can be run in
+        a pool process.
+
+        Returns:
+            `{"species": names, "values": (n_rows, steps + 1, n_species) array, "failed": row indices}`, or
+            `{"error": message}` if the model could not be loaded.
+    """
+    try:
+        model = load_sweep_model(simulator, sbml_fp)
+    except:
+        message = f"sweep-model-error:\n{traceback.format_exc()}"
+        logger.error(message)
+        return {"error": message}
+
+    species = model.species
+    values = np.full((len(samples), steps + 1, len(species)), np.nan)
+    failed = []
+    for i, sample in enumerate(samples):
+        try:
+            if model is None:
+                model = load_sweep_model(simulator, sbml_fp)
+            values[i] = model.simulate(parameters, sample, start, stop, steps)
+        except Exception as e:
+            logger.warning(f"Sweep sample {i} of {simulator} failed: {e}")
+            failed.append(i)
+            if model is not None:
+                discard_sweep_model(simulator, sbml_fp, model)
+                model = None
+    return {"species": species, "values": values, "failed": failed}
+
+
+async def run_sweep(
+        pool,
+        simulator: str,
+        sbml_fp: str,
+        start: int,
+        stop: int,
+        steps: int,
+        parameters: List[str],
+        samples: np.ndarray,
+        block_size: int = None,
+        slots: TaskSlots = None
+) -> Tuple[List[str], np.ndarray, List[int]]:
+    """Run the uniform time course of the SBML model at `sbml_fp` with `simulator` for each row of `samples`, in blocks
+        spread over the processes of `pool` (a `worker.pool.SimulationPool`), with at most as many blocks in flight as
+        `slots` allows (by default, the pool's number of slots).
+
+        Args:
+            parameters: names of the swept parameters, one per column of `samples`.
+            samples: `(n_samples, n_parameters)` array of parameter values.
+            block_size: samples per pool task. Defaults to a few blocks per pool process.
+            slots: bounds the blocks in flight, so that a sweep does not queue ahead of the other jobs of the pool.
+
+        Returns:
+            The species names, the `(n_samples, steps + 1, n_species)` array of their values (NaN for failed samples)
+            and the indices of the samples that failed.
+
+        Raises:
+            RuntimeError if the model could not be loaded.
+    """
+    samples = np.asarray(samples, dtype=float)
+    n_samples = len(samples)
+    blocks = sample_blocks(n_samples, block_size or default_block_size(n_samples, pool.slots))
+    slots = slots or TaskSlots(limit=pool.slots)
+
+    async def run_block(block: slice) -> Tuple[slice, Dict[str, Any]]:
+        output = await slots.run(pool, run_sweep_block, simulator, sbml_fp, start, stop, steps, parameters, samples[block])
+        return block, output
+
+    species = []
+    values = None
+    failed = []
+    for completed in asyncio.as_completed([run_block(block) for block in blocks]):
+        block, output = await completed
+        if "error" in output:
+            raise RuntimeError(output["error"])
+        if values is None:
+            species = output["species"]
+            values = np.full((n_samples,) + output["values"].shape[1:], np.nan)
+        values[block] = output["values"]
+        failed.extend(block.start + i for i in output["failed"])
+    return species, values, sorted(failed)